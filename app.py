@@ -1,224 +1,3329 @@
 # app.py - Serveur Flask avec gestion des entreprises
-from flask import Flask, request, jsonify, send_file, abort
+from flask import Flask, Response, g, request, jsonify, send_file, abort
+import ast
+import atexit
+import bisect
+import copy
+import fcntl
+import io
 import os
 import json
+import gzip
+import hashlib
+import heapq
+import hmac
 import logging
+import logging.handlers
+import math
+import queue
+import re
+import secrets
+import shutil
+import sqlite3
+import threading
+import time
+import weakref
+import zipfile
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
+from itsdangerous import BadSignature, URLSafeSerializer
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 app = Flask(__name__)
 
 # Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-PLUGINS_DIR = os.path.join(BASE_DIR, 'plugins')
-CONFIG_DIR = os.path.join(BASE_DIR, 'config')
-LOGS_DIR = os.path.join(BASE_DIR, 'logs')
+PLUGINS_DIR = os.environ.get('PLUGINS_DIR', os.path.join(BASE_DIR, 'plugins'))
+CONFIG_DIR = os.environ.get('CONFIG_DIR', os.path.join(BASE_DIR, 'config'))
+LOGS_DIR = os.environ.get('LOGS_DIR', os.path.join(BASE_DIR, 'logs'))
+# Stockage adressé par contenu: une copie par version de plugin, nommée par son sha256
+PLUGIN_OBJECTS_DIR = os.environ.get('PLUGIN_OBJECTS_DIR', os.path.join(BASE_DIR, 'plugin_objects'))
+# Rétention du stockage par hash: versions précédentes gardées par plugin (au
+# plus KEEP_VERSIONS, pendant RETENTION_DAYS jours après leur remplacement).
+# Les objets d'un plugin retiré de PLUGINS_DIR sont supprimés au rescan suivant
+PLUGIN_OBJECTS_KEEP_VERSIONS = int(os.environ.get('PLUGIN_OBJECTS_KEEP_VERSIONS', '3'))
+PLUGIN_OBJECTS_RETENTION_DAYS = float(os.environ.get('PLUGIN_OBJECTS_RETENTION_DAYS', '30'))
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Stockage des utilisateurs: 'json' (config/users.json) ou 'sqlite' (USERS_DB,
+# alimentée par import_users.py) avec un LRU d'entreprises compilées
+USER_STORE = os.environ.get('USER_STORE', 'json')
+USERS_DB = os.environ.get('USERS_DB', os.path.join(CONFIG_DIR, 'users.sqlite3'))
+USER_STORE_CACHE_COMPANIES = int(os.environ.get('USER_STORE_CACHE_COMPANIES', '1000'))
+
+# Journal des modifications de l'API d'administration (mode json) et
+# intervalle de compaction dans users.json en secondes
+USERS_JOURNAL = os.environ.get('USERS_JOURNAL', os.path.join(CONFIG_DIR, 'users.journal'))
+USERS_COMPACT_INTERVAL = float(os.environ.get('USERS_COMPACT_INTERVAL', '60'))
+
+# Intervalle de surveillance de users.json en secondes (0 = rechargement à chaud désactivé)
+CONFIG_RELOAD_INTERVAL = float(os.environ.get('CONFIG_RELOAD_INTERVAL', '2'))
+
+# Surveillance démarrée par chaque worker (hook post_fork de gunicorn) plutôt
+# qu'à l'import: avec preload_app, le maître ne doit pas forker pendant un
+# rechargement (verrous et flock du journal hérités sans propriétaire)
+CONFIG_WATCHER_POST_FORK = os.environ.get('CONFIG_WATCHER_POST_FORK', '') == '1'
+
+# Budget mémoire du cache de contenu des plugins (octets, variantes compressées incluses)
+PLUGIN_CACHE_BYTES = int(os.environ.get('PLUGIN_CACHE_BYTES', str(64 * 1024 * 1024)))
+
+# Écriture groupée des exécutions de scripts: toutes les N entrées ou T millisecondes
+EXECUTION_FLUSH_RECORDS = int(os.environ.get('EXECUTION_FLUSH_RECORDS', '100'))
+EXECUTION_FLUSH_INTERVAL_MS = int(os.environ.get('EXECUTION_FLUSH_INTERVAL_MS', '200'))
+MAX_EXECUTION_BATCH = 1000
+
+# Base SQLite de l'historique des exécutions (vide = désactivée)
+EXECUTIONS_DB = os.environ.get('EXECUTIONS_DB', os.path.join(LOGS_DIR, 'executions.sqlite3'))
+
+# Délestage des échecs d'authentification (par couple et par user_key): rafale
+# tolérée, recharge (jetons/s) et durée de mémorisation des couples refusés
+AUTH_FAILURE_BURST = int(os.environ.get('AUTH_FAILURE_BURST', '10'))
+AUTH_FAILURE_RATE = float(os.environ.get('AUTH_FAILURE_RATE', '0.5'))
+AUTH_NEGATIVE_TTL = float(os.environ.get('AUTH_NEGATIVE_TTL', '30'))
+
+# Budget des échecs par IP, bien plus large: un bureau entier peut partager
+# une IP (NAT), et ce budget ne refuse que des identifiants jamais validés
+AUTH_IP_FAILURE_BURST = int(os.environ.get('AUTH_IP_FAILURE_BURST', '200'))
+AUTH_IP_FAILURE_RATE = float(os.environ.get('AUTH_IP_FAILURE_RATE', '10'))
+
+# Jetons de session signés (POST /api/token): secret HMAC et durée de vie en secondes
+SESSION_SECRET = os.environ.get('SESSION_SECRET', '')
+SESSION_TOKEN_TTL = int(os.environ.get('SESSION_TOKEN_TTL', '3600'))
+
+# Nombre de reverse proxies de confiance devant le serveur (X-Forwarded-For)
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', '0'))
+
+# Dossier partagé des instantanés de métriques entre workers (vide = processus unique)
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+
+# Clé d'administration (header X-Admin-Key); endpoints d'administration désactivés si vide
+ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY', '')
+
+# Flux d'événements SSE (/api/events): intervalle de heartbeat en secondes et
+# nombre maximal de connexions ouvertes par processus. Avec des workers gthread
+# chaque flux occupe un thread: par défaut la moitié de GUNICORN_THREADS, l'autre
+# moitié restant aux autres requêtes (gunicorn_config.py relève la limite pour
+# les workers asynchrones)
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', '15'))
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', int(os.environ.get('GUNICORN_THREADS', '8')) // 2))
+
+# Pagination des listes de plugins (/api/plugins, /api/user_info): taille par
+# défaut et maximale d'une page
+PLUGIN_PAGE_SIZE = int(os.environ.get('PLUGIN_PAGE_SIZE', '100'))
+MAX_PLUGIN_PAGE = 1000
+
+# Budget mémoire des réponses JSON pré-sérialisées (/, /api/status, listes de
+# plugins, user_info), par processus
+RESPONSE_CACHE_BYTES = int(os.environ.get('RESPONSE_CACHE_BYTES', str(16 * 1024 * 1024)))
+
+# Adresse client réelle derrière un reverse proxy (clé du délestage par IP)
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
 
 # S'assurer que le dossier de logs existe
 os.makedirs(LOGS_DIR, exist_ok=True)
 
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par enregistrement, avec les champs d'accès s'ils sont présents"""
+
+    ACCESS_FIELDS = ('route', 'method', 'status', 'duration_ms', 'user_key', 'company_id',
+                     'plugin', 'remote_addr')
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'pid': record.process,
+            'message': record.getMessage()
+        }
+        for field in self.ACCESS_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def build_log_handlers(names, log_format):
+    """Handlers de sortie selon l'environnement (LOG_HANDLERS=file,console)"""
+    text_formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    file_formatter = JsonFormatter() if log_format == 'json' else text_formatter
+    handlers = []
+    for name in names:
+        if name == 'file':
+            # Mode append: chaque ligne part en un seul write(), les workers
+            # peuvent partager le fichier sans s'entrelacer
+            handler = logging.FileHandler(os.path.join(LOGS_DIR, 'access.log'), encoding='utf-8')
+            handler.setFormatter(file_formatter)
+        elif name == 'console':
+            handler = logging.StreamHandler()
+            handler.setFormatter(text_formatter)
+        else:
+            raise ValueError(f"Handler de log inconnu: {name}")
+        handlers.append(handler)
+    return handlers
+
+
+class LoggingPipeline:
+    """Logs asynchrones: QueueHandler côté requête, un thread d'écriture par processus
+
+    Le listener ne survit pas à un fork: il est reconstruit dans chaque
+    worker (os.register_at_fork), et arrêté proprement à la sortie.
+    """
+
+    def __init__(self, target, handler_names, log_format):
+        self.target = target
+        self.handler_names = handler_names
+        self.log_format = log_format
+        self.queue_handler = None
+        self.listener = None
+
+    def start(self):
+        log_queue = queue.SimpleQueue()
+        handlers = build_log_handlers(self.handler_names, self.log_format)
+        self.queue_handler = logging.handlers.QueueHandler(log_queue)
+        self.target.addHandler(self.queue_handler)
+        self.listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
+
+    def restart_after_fork(self):
+        # Le thread du parent n'existe pas dans l'enfant: repartir d'une file neuve
+        self.target.removeHandler(self.queue_handler)
+        self.listener = None
+        self.start()
+
+
 # Configuration du logger
 logger = logging.getLogger('plugin_server')
-logger.setLevel(logging.INFO)
-fh = logging.FileHandler(os.path.join(LOGS_DIR, 'access.log'))
-formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-fh.setFormatter(formatter)
-logger.addHandler(fh)
-logger.addHandler(logging.StreamHandler())
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+logger.propagate = False
+logging_pipeline = LoggingPipeline(
+    logger,
+    [name.strip() for name in os.environ.get('LOG_HANDLERS', 'file,console').split(',') if name.strip()],
+    os.environ.get('LOG_FORMAT', 'json'))
+logging_pipeline.start()
+atexit.register(logging_pipeline.stop)
+os.register_at_fork(after_in_child=logging_pipeline.restart_after_fork)
+
+
+class AuthenticationError(Exception):
+    """Échec d'authentification; `reason` sert aux métriques, le message au client"""
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+class SqliteDatabase:
+    """Base SQLite: schéma créé à l'ouverture, une connexion par thread et par processus
+
+    Mode WAL: les lectures ne bloquent pas les écritures.
+    """
+
+    SCHEMA = []
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class PermissionSet:
+    """Ensemble de plugins autorisés, partagé par tous les utilisateurs ayant la même liste
+
+    Les ensembles sont internés (une instance par liste distincte). Leur
+    intersection avec le catalogue ('*' = tout le catalogue) et le fragment
+    JSON des détails sont calculés une fois par état du catalogue.
+    """
+
+    __slots__ = ('wildcard', 'allowed', 'allowed_sorted', 'fingerprint', '_resolved', '__weakref__')
+
+    _interned = weakref.WeakValueDictionary()
+    _intern_lock = threading.Lock()
+
+    def __init__(self, wildcard, allowed_sorted):
+        self.wildcard = wildcard
+        self.allowed = frozenset(allowed_sorted)
+        self.allowed_sorted = allowed_sorted
+        self.fingerprint = hashlib.sha256(
+            json.dumps([wildcard, allowed_sorted]).encode('utf-8')).hexdigest()[:16]
+        # (epoch du catalogue, entrées autorisées présentes, fragment JSON des détails)
+        self._resolved = None
+
+    @classmethod
+    def intern(cls, allowed_plugins):
+        """Instance partagée pour cette liste allowed_plugins"""
+        key = ('*' in allowed_plugins, tuple(sorted({name for name in allowed_plugins if name != '*'})))
+        with cls._intern_lock:
+            permissions = cls._interned.get(key)
+            if permissions is None:
+                permissions = cls._interned[key] = cls(*key)
+            return permissions
+
+    @classmethod
+    def interned_count(cls):
+        return len(cls._interned)
+
+    def permits(self, plugin_name):
+        return self.wildcard or plugin_name in self.allowed
+
+    def resolve(self, catalog, epoch):
+        """(entrées autorisées présentes dans le catalogue, fragment JSON de leurs détails)"""
+        resolved = self._resolved
+        if resolved is None or resolved[0] != epoch:
+            if self.wildcard:
+                entries = list(catalog.entries())
+            else:
+                entries = catalog.page(allowed=self.allowed)[0]
+            fragment = json.dumps([entry.details for entry in entries])
+            resolved = self._resolved = (epoch, entries, fragment)
+        return resolved[1], resolved[2]
+
+
+class UserRecord:
+    """Utilisateur compilé au chargement: expiration parsée, permissions internées"""
+
+    __slots__ = ('user_key', 'company_id', 'data', 'api_key', 'active', 'expires_at', 'permissions')
+
+    def __init__(self, user_key, company_id, data):
+        self.user_key = user_key
+        self.company_id = company_id
+        self.data = data
+        self.api_key = data.get('api_key')
+        self.active = bool(data.get('active', False))
+        self.permissions = PermissionSet.intern(data.get('allowed_plugins', []))
+
+        self.expires_at = None
+        expires = data.get('expires')
+        if expires:
+            try:
+                self.expires_at = datetime.strptime(expires, "%Y-%m-%d")
+            except (TypeError, ValueError):
+                # Format invalide: considéré comme sans expiration
+                logger.warning(f"Format de date expires invalide pour {user_key}: {expires}")
+
+    def is_expired(self, now):
+        return self.expires_at is not None and now > self.expires_at
+
+
+class CompiledCompany:
+    """Entreprise compilée: UserRecord par user_key et compteurs actifs / expirés
+
+    Les compteurs sont calculés une fois; un tas des dates d'expiration fait
+    ensuite basculer les utilisateurs dans les expirés au bon moment.
+    """
+
+    __slots__ = ('company_id', 'data', 'active', 'records', 'stats', '_expiry_heap', '_expiry_lock')
+
+    def __init__(self, company_id, data, now):
+        self.company_id = company_id
+        self.data = data
+        self.active = bool(data.get('active', False))
+        users = data.get('users', {})
+        self.records = {}
+        self._expiry_heap = []
+        self._expiry_lock = threading.Lock()
+        self.stats = {
+            'company_name': data.get('name'),
+            'total_users': len(users),
+            'active_users': 0,
+            'expired_users': 0,
+            'created_at': data.get('created_at')
+        }
+
+        for user_key, user in users.items():
+            record = self.records[user_key] = UserRecord(user_key, company_id, user)
+            if not record.active:
+                continue
+            if record.is_expired(now):
+                self.stats['expired_users'] += 1
+            else:
+                self.stats['active_users'] += 1
+                if record.expires_at is not None:
+                    self._expiry_heap.append((record.expires_at, user_key))
+        heapq.heapify(self._expiry_heap)
+
+    def global_counts(self):
+        """Contribution aux statistiques globales (entreprises actives uniquement)"""
+        if not self.active:
+            return {}
+        return {'active_companies': 1, 'total_users': len(self.records),
+                'active_users': sum(1 for record in self.records.values() if record.active)}
+
+    def stats_at(self, now):
+        """Statistiques (copie) après bascule des utilisateurs expirés avant `now`"""
+        heap = self._expiry_heap
+        if heap and now > heap[0][0]:
+            with self._expiry_lock:
+                while heap and now > heap[0][0]:
+                    heapq.heappop(heap)
+                    self.stats['active_users'] -= 1
+                    self.stats['expired_users'] += 1
+        return dict(self.stats)
+
+
+class ConfigSnapshot:
+    """Configuration immuable (entreprises + index utilisateurs) chargée depuis users.json
+
+    Toutes les entreprises sont compilées au chargement; les statistiques
+    globales sont calculées une seule fois. Les modifications de l'API
+    d'administration produisent un nouveau snapshot (with_company) qui
+    partage les index de base et ne recopie que de petites surcouches.
+    """
+
+    def __init__(self, config, generation, mtime=None, version='', journal_seq=0):
+        self.config = config
+        self.companies = config.get('companies', {})
+        self.generation = generation
+        # Empreinte du contenu: identique dans tous les workers pour un même fichier
+        self.version = version
+        self.loaded_at = datetime.now()
+        self.mtime = mtime
+        # Dernière entrée du journal des modifications prise en compte
+        self.journal_seq = journal_seq
+        # Surcouches des modifications depuis le chargement: company_id ->
+        # CompiledCompany, user_key -> UserRecord (None = retiré de l'index),
+        # autodesk_user -> company_id, autodesk_user -> user_key candidats,
+        # company_id -> position des nouvelles entreprises
+        self._company_overlay = {}
+        self._user_overlay = {}
+        self._autodesk_overlay = {}
+        self._candidates_overlay = {}
+        self._extra_positions = {}
+        self._compile(self.companies, self.loaded_at)
+
+    def _compile(self, companies, now):
+        self._compiled = {}
+        self._positions = {}
+        # user_key -> UserRecord, limité aux entreprises actives
+        self.user_index = {}
+        # autodesk_user -> company_id (attribution des exécutions de scripts)
+        self.autodesk_index = {}
+        # autodesk_user -> user_key de toutes les entreprises portant ce nom:
+        # recalcul de l'attribution quand une modification la remet en cause
+        self._autodesk_candidates = {}
+        # user_key présents dans plusieurs entreprises actives
+        self._duplicates = set()
+        global_stats = {'total_companies': len(companies), 'active_companies': 0,
+                        'total_users': 0, 'active_users': 0}
+
+        for position, (company_id, company_data) in enumerate(companies.items()):
+            compiled = self._compiled[company_id] = CompiledCompany(company_id, company_data, now)
+            self._positions[company_id] = position
+            for user_key, record in compiled.records.items():
+                self._autodesk_candidates.setdefault(record.data.get('autodesk_user'), set()).add(user_key)
+            if not compiled.active:
+                continue
+            global_stats['active_companies'] += 1
+            global_stats['total_users'] += len(compiled.records)
+            for user_key, record in compiled.records.items():
+                # En cas de doublon, la première entreprise gagne (comme l'ancien parcours)
+                if self.user_index.setdefault(user_key, record) is record:
+                    self.autodesk_index.setdefault(record.data.get('autodesk_user'), company_id)
+                else:
+                    self._duplicates.add(user_key)
+                if record.active:
+                    global_stats['active_users'] += 1
+        self.global_stats = global_stats
+
+    @property
+    def company_count(self):
+        return len(self.companies) + len(self._extra_positions)
+
+    def lookup_user(self, user_key):
+        if self._user_overlay and user_key in self._user_overlay:
+            return self._user_overlay[user_key]
+        return self.user_index.get(user_key)
+
+    def _compiled_company(self, company_id):
+        compiled = self._company_overlay.get(company_id)
+        if compiled is None:
+            compiled = self._compiled.get(company_id)
+        return compiled
+
+    def _position(self, company_id):
+        position = self._positions.get(company_id)
+        return position if position is not None else self._extra_positions[company_id]
+
+    def company_ids(self):
+        """Identifiants dans l'ordre du fichier (nouvelles entreprises à la fin)"""
+        yield from self.companies
+        yield from self._extra_positions
+
+    def company(self, company_id):
+        compiled = self._compiled_company(company_id)
+        return compiled.data if compiled is not None else None
+
+    def company_for_autodesk_user(self, autodesk_user):
+        if self._autodesk_overlay and autodesk_user in self._autodesk_overlay:
+            return self._autodesk_overlay[autodesk_user]
+        return self.autodesk_index.get(autodesk_user)
+
+    def company_stats(self, company_id, now=None):
+        """Statistiques d'une entreprise (copie), None si inconnue"""
+        compiled = self._compiled_company(company_id)
+        if compiled is None:
+            return None
+        return compiled.stats_at(now or datetime.now())
+
+    def to_config(self):
+        """Document users.json équivalent (compaction du journal)"""
+        companies = {company_id: self.company(company_id) for company_id in self.company_ids()}
+        return dict(self.config, companies=companies, journal_seq=self.journal_seq)
+
+    def with_company(self, company_id, data, version, journal_seq):
+        """Nouveau snapshot où l'entreprise company_id est remplacée par data
+
+        Seule cette entreprise est recompilée: le coût dépend de sa taille et
+        du nombre de modifications depuis le chargement, pas du nombre total
+        d'entreprises.
+        """
+        previous = self._compiled_company(company_id)
+        compiled = CompiledCompany(company_id, data, datetime.now())
+
+        snapshot = copy.copy(self)
+        snapshot.generation = self.generation + 1
+        snapshot.version = version
+        snapshot.journal_seq = journal_seq
+        snapshot.loaded_at = datetime.now()
+        snapshot._company_overlay = dict(self._company_overlay, **{company_id: compiled})
+        if previous is None:
+            snapshot._extra_positions = dict(self._extra_positions)
+            snapshot._extra_positions[company_id] = self.company_count
+
+        global_stats = dict(self.global_stats)
+        for counts, sign in ((previous.global_counts() if previous else None, -1), (compiled.global_counts(), 1)):
+            for key, value in (counts or {}).items():
+                global_stats[key] += sign * value
+        if previous is None:
+            global_stats['total_companies'] += 1
+        snapshot.global_stats = global_stats
+
+        user_overlay = dict(self._user_overlay)
+        duplicates = self._duplicates
+        position = snapshot._position(company_id)
+        keys = set(compiled.records)
+        if previous is not None:
+            keys.update(previous.records)
+        for user_key in keys:
+            current = self.lookup_user(user_key)
+            record = compiled.records.get(user_key) if compiled.active else None
+            if record is not None:
+                if current is not None and current.company_id != company_id:
+                    if duplicates is self._duplicates:
+                        duplicates = set(duplicates)
+                    duplicates.add(user_key)
+                    if snapshot._position(current.company_id) < position:
+                        continue
+                user_overlay[user_key] = record
+            elif current is not None and current.company_id == company_id:
+                # Propriétaire retiré: la clé revient à l'entreprise suivante s'il y en a une
+                user_overlay[user_key] = (snapshot._first_owner(user_key, company_id)
+                                          if user_key in duplicates else None)
+        snapshot._user_overlay = user_overlay
+        snapshot._duplicates = duplicates
+
+        # Attribution recalculée pour chaque autodesk_user touché: ceux de
+        # l'entreprise (avant et après) et ceux des clés qui changent de propriétaire
+        affected = set()
+        for records in ((previous.records if previous else {}), compiled.records):
+            affected.update(record.data.get('autodesk_user') for record in records.values())
+        for user_key in keys:
+            for record in (self.lookup_user(user_key), snapshot.lookup_user(user_key)):
+                if record is not None:
+                    affected.add(record.data.get('autodesk_user'))
+
+        candidates_overlay = dict(self._candidates_overlay)
+        for user_key, record in compiled.records.items():
+            autodesk_user = record.data.get('autodesk_user')
+            candidates = self._candidates(autodesk_user)
+            if user_key not in candidates:
+                candidates_overlay[autodesk_user] = candidates | {user_key}
+        snapshot._candidates_overlay = candidates_overlay
+
+        autodesk_overlay = dict(self._autodesk_overlay)
+        for autodesk_user in affected:
+            autodesk_overlay[autodesk_user] = snapshot._autodesk_owner(autodesk_user)
+        snapshot._autodesk_overlay = autodesk_overlay
+        return snapshot
+
+    def _candidates(self, autodesk_user):
+        candidates = self._candidates_overlay.get(autodesk_user)
+        if candidates is None:
+            candidates = self._autodesk_candidates.get(autodesk_user, frozenset())
+        return candidates
+
+    def _autodesk_owner(self, autodesk_user):
+        """Entreprise attribuée à autodesk_user, comme un chargement complet
+
+        Première entreprise (ordre du fichier) dont un utilisateur de ce nom
+        est le propriétaire de sa clé dans l'index; les candidats périmés
+        (utilisateur renommé ou retiré) sont ignorés.
+        """
+        owner = None
+        for user_key in self._candidates(autodesk_user):
+            record = self.lookup_user(user_key)
+            if record is None or record.data.get('autodesk_user') != autodesk_user:
+                continue
+            if owner is None or self._position(record.company_id) < self._position(owner):
+                owner = record.company_id
+        return owner
+
+    def _first_owner(self, user_key, excluded):
+        for company_id in self.company_ids():
+            compiled = self._compiled_company(company_id)
+            if company_id != excluded and compiled.active and user_key in compiled.records:
+                return compiled.records[user_key]
+        return None
+
+
+class SqliteUserSnapshot:
+    """Vue d'une version de la base utilisateurs SQLite
+
+    Seules les statistiques globales sont calculées au chargement; chaque
+    entreprise est compilée à la demande et gardée dans un LRU borné.
+    """
+
+    def __init__(self, store, generation, version, max_companies):
+        self.store = store
+        self.generation = generation
+        self.version = version
+        self.loaded_at = datetime.now()
+        self.max_companies = max_companies
+        self._companies = OrderedDict()
+        self._lock = threading.Lock()
+        self.global_stats = store.global_stats()
+
+    @property
+    def company_count(self):
+        return self.global_stats['total_companies']
+
+    def _compiled(self, company_id):
+        with self._lock:
+            compiled = self._companies.get(company_id)
+            if compiled is not None:
+                self._companies.move_to_end(company_id)
+                return compiled
+        data = self.store.load_company(company_id)
+        if data is None:
+            return None
+        compiled = CompiledCompany(company_id, data, datetime.now())
+        with self._lock:
+            self._companies[company_id] = compiled
+            while len(self._companies) > self.max_companies:
+                self._companies.popitem(last=False)
+        return compiled
+
+    def lookup_user(self, user_key):
+        company_id = self.store.company_for_user(user_key)
+        if company_id is None:
+            return None
+        compiled = self._compiled(company_id)
+        return compiled.records.get(user_key) if compiled is not None else None
+
+    def company(self, company_id):
+        compiled = self._compiled(company_id)
+        return compiled.data if compiled is not None else None
+
+    def company_for_autodesk_user(self, autodesk_user):
+        return self.store.company_for_autodesk_user(autodesk_user)
+
+    def company_stats(self, company_id, now=None):
+        compiled = self._compiled(company_id)
+        if compiled is None:
+            return None
+        return compiled.stats_at(now or datetime.now())
+
+    def with_company(self, previous, compiled, version):
+        """Snapshot après écriture d'une entreprise dans la base (cache conservé)"""
+        snapshot = copy.copy(self)
+        snapshot.generation = self.generation + 1
+        snapshot.version = version
+        snapshot.loaded_at = datetime.now()
+        snapshot._lock = threading.Lock()
+        with self._lock:
+            snapshot._companies = OrderedDict(self._companies)
+        snapshot._companies[compiled.company_id] = compiled
+
+        global_stats = dict(self.global_stats)
+        for counts, sign in ((previous.global_counts() if previous else None, -1), (compiled.global_counts(), 1)):
+            for key, value in (counts or {}).items():
+                global_stats[key] += sign * value
+        if previous is None:
+            global_stats['total_companies'] += 1
+        snapshot.global_stats = global_stats
+        return snapshot
+
+
+def validate_config(config):
+    """Vérifie la structure de users.json, lève ValueError si invalide"""
+    if not isinstance(config, dict):
+        raise ValueError('la racine doit être un objet')
+    companies = config.get('companies', {})
+    if not isinstance(companies, dict):
+        raise ValueError("'companies' doit être un objet")
+    for company_id, company in companies.items():
+        if not isinstance(company, dict):
+            raise ValueError(f"entreprise {company_id}: doit être un objet")
+        users = company.get('users', {})
+        if not isinstance(users, dict):
+            raise ValueError(f"entreprise {company_id}: 'users' doit être un objet")
+        for user_key, user in users.items():
+            if not isinstance(user, dict):
+                raise ValueError(f"utilisateur {user_key}: doit être un objet")
+            if not isinstance(user.get('allowed_plugins', []), list):
+                raise ValueError(f"utilisateur {user_key}: 'allowed_plugins' doit être une liste")
+
+
+# Champs utilisés par l'authentification et /api/user_info
+NEW_USER_FIELDS = ('name', 'email', 'autodesk_user', 'computer_name')
+
+
+def validate_user_fields(fields):
+    """Vérifie les champs utilisateur envoyés à l'API d'administration"""
+    for name in NEW_USER_FIELDS:
+        if name in fields and (not isinstance(fields[name], str) or not fields[name]):
+            raise ValueError(f"'{name}' doit être une chaîne non vide")
+    if 'api_key' in fields and (not isinstance(fields['api_key'], str) or not fields['api_key']):
+        raise ValueError("'api_key' doit être une chaîne non vide")
+    if 'active' in fields and not isinstance(fields['active'], bool):
+        raise ValueError("'active' doit être un booléen")
+    if 'allowed_plugins' in fields:
+        plugins = fields['allowed_plugins']
+        if not isinstance(plugins, list) or not all(isinstance(p, str) for p in plugins):
+            raise ValueError("'allowed_plugins' doit être une liste de noms")
+    if fields.get('expires') is not None:
+        try:
+            datetime.strptime(fields['expires'], "%Y-%m-%d")
+        except (TypeError, ValueError):
+            raise ValueError("'expires' doit être une date AAAA-MM-JJ")
+
+
+def merge_change(company, change):
+    """Applique une modification du journal à une entreprise (copie, l'original n'est pas modifié)
+
+    change: {'op': 'company' | 'user', 'company_id', 'user_key', 'fields', 'at'}.
+    Les champs fournis remplacent les existants; une entreprise ou un
+    utilisateur inconnu est créé (actif par défaut).
+    """
+    fields = change.get('fields')
+    if not isinstance(fields, dict):
+        raise ValueError("'fields' doit être un objet")
+    op = change.get('op')
+    if op == 'company':
+        if 'users' in fields:
+            raise ValueError("les utilisateurs se modifient un par un")
+        if 'active' in fields and not isinstance(fields['active'], bool):
+            raise ValueError("'active' doit être un booléen")
+        if 'name' in fields and (not isinstance(fields['name'], str) or not fields['name']):
+            raise ValueError("'name' doit être une chaîne non vide")
+        if company is None:
+            if 'name' not in fields:
+                raise ValueError("champ requis pour créer une entreprise: name")
+            company = {'active': True, 'created_at': change.get('at'), 'users': {}}
+        merged = dict(company)
+        merged.update(fields)
+        return merged
+    if op == 'user':
+        if company is None:
+            raise ValueError(f"entreprise inconnue: {change.get('company_id')}")
+        user_key = change.get('user_key')
+        if not isinstance(user_key, str) or not user_key:
+            raise ValueError("'user_key' manquant")
+        validate_user_fields(fields)
+        users = dict(company.get('users', {}))
+        if user_key not in users:
+            missing = [name for name in NEW_USER_FIELDS if not fields.get(name)]
+            if missing:
+                raise ValueError(f"champs requis pour créer un utilisateur: {', '.join(missing)}")
+            if user_key != f"{fields['autodesk_user']}_{fields['computer_name']}":
+                raise ValueError("user_key doit valoir <autodesk_user>_<computer_name>")
+        else:
+            # L'identité fait partie de la clé (authentification, attribution des exécutions)
+            changed = [name for name in ('autodesk_user', 'computer_name')
+                       if name in fields and fields[name] != users[user_key].get(name)]
+            if changed:
+                raise ValueError(f"{', '.join(changed)} non modifiable: créer un nouvel utilisateur "
+                                 f"et désactiver {user_key}")
+        user = dict(users.get(user_key) or {'active': True, 'allowed_plugins': []})
+        user.update(fields)
+        users[user_key] = user
+        return dict(company, users=users)
+    raise ValueError(f"opération inconnue: {op}")
+
+
+class ChangeJournal:
+    """Journal append-only des modifications (une entrée JSON par ligne)
+
+    Partagé entre processus: les ajouts et la compaction prennent un verrou
+    exclusif (flock sur un fichier .lock), les lectures un verrou partagé.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+
+    @contextmanager
+    def locked(self, exclusive=False):
+        try:
+            lock_file = open(self.lock_path, 'a')
+        except OSError:
+            # Répertoire en lecture seule: aucune écriture concurrente possible
+            yield
+            return
+        with lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def position(self):
+        """(inode, taille) du journal, (None, 0) s'il n'existe pas"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None, 0
+        return st.st_ino, st.st_size
+
+    def read_from(self, offset):
+        """Lignes complètes à partir de offset; retourne (lignes, nouvel offset)"""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+        # Une dernière ligne sans saut de ligne est une écriture interrompue
+        end = data.rfind(b'\n') + 1
+        return [line.decode('utf-8') for line in data[:end].splitlines(keepends=True)], offset + end
+
+    def append(self, line):
+        """Ajoute une ligne et la force sur disque; retourne la nouvelle taille"""
+        with open(self.path, 'ab') as f:
+            f.write(line.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def reset(self):
+        """Remplace le journal par un fichier vide (après compaction)"""
+        write_atomic(self.path, b'')
+
+
+def write_atomic(path, data):
+    """Écrit un fichier via un temporaire + rename: les lecteurs voient l'ancien ou le nouveau"""
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class JsonUserStore:
+    """Stockage des utilisateurs dans users.json + journal des modifications (petites installations)
+
+    Les écritures de l'API d'administration sont ajoutées au journal puis
+    appliquées au snapshot; les autres workers rejouent les nouvelles
+    entrées. La compaction réécrit users.json (journal_seq = dernière
+    entrée incluse, config_version = version chaînée) et vide le journal.
+    """
+
+    name = 'json'
+
+    def __init__(self, users_file, journal_file):
+        self.users_file = users_file
+        self.journal = ChangeJournal(journal_file)
+        self._last_seen_mtime = None
+        self._journal_inode = None
+        self._journal_offset = 0
+        # journal_seq du users.json chargé: rien à compacter au-delà
+        self._compacted_seq = 0
+
+    def has_changed(self):
+        try:
+            mtime = os.stat(self.users_file).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        # Un fichier invalide n'est relu qu'après une nouvelle modification
+        return mtime != self._last_seen_mtime
+
+    def load(self, generation):
+        """Lit et valide users.json puis rejoue le journal; lève OSError / ValueError si inutilisable"""
+        with self.journal.locked():
+            return self._read(generation)
+
+    def _read(self, generation):
+        mtime = os.stat(self.users_file).st_mtime_ns
+        self._last_seen_mtime = mtime
+        with open(self.users_file, 'rb') as f:
+            raw = f.read()
+        config = json.loads(raw.decode('utf-8'))
+        validate_config(config)
+        journal_seq = config.get('journal_seq', 0)
+        # Fichier compacté non retouché: la version chaînée du journal est conservée
+        version = config.get('config_version')
+        if not version or config.get('config_digest') != self._content_digest(config):
+            version = hashlib.sha256(raw).hexdigest()[:16]
+        snapshot = ConfigSnapshot(config, generation, mtime, version=version, journal_seq=journal_seq)
+        self._compacted_seq = journal_seq
+        self._journal_offset = 0
+        return self._replay(snapshot)
+
+    @staticmethod
+    def _content_digest(config):
+        """Empreinte du contenu de users.json hors champs de version (retouches manuelles)"""
+        content = {key: value for key, value in config.items() if key not in ('config_version', 'config_digest')}
+        return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def _journal_replaced(self):
+        # Journal remplacé (compacté) depuis notre lecture; sa création n'en est pas un
+        inode = self.journal.position()[0]
+        return self._journal_inode is not None and inode != self._journal_inode
+
+    def _replay(self, snapshot):
+        self._journal_inode = self.journal.position()[0]
+        lines, self._journal_offset = self.journal.read_from(self._journal_offset)
+        for line in lines:
+            change = json.loads(line)
+            if change['seq'] <= snapshot.journal_seq:
+                continue
+            if change['seq'] != snapshot.journal_seq + 1:
+                raise ValueError(f"journal discontinu: entrée {change['seq']} après {snapshot.journal_seq}")
+            snapshot = self._apply(snapshot, change, line)
+        return snapshot
+
+    @staticmethod
+    def _apply(snapshot, change, line):
+        company = merge_change(snapshot.company(change['company_id']), change)
+        # Version chaînée: identique dans tous les workers qui rejouent le même journal
+        version = hashlib.sha256((snapshot.version + line).encode('utf-8')).hexdigest()[:16]
+        return snapshot.with_company(change['company_id'], company, version, change['seq'])
+
+    def refresh(self, snapshot):
+        """Applique les entrées ajoutées par d'autres processus; None si rien de nouveau"""
+        inode, size = self.journal.position()
+        if inode == self._journal_inode and size == self._journal_offset:
+            return None
+        with self.journal.locked():
+            if self._journal_replaced():
+                # Journal compacté par un autre processus: users.json a changé, rechargement complet
+                return None
+            refreshed = self._replay(snapshot)
+        return refreshed if refreshed is not snapshot else None
+
+    def apply(self, snapshot, change):
+        """Journalise une modification puis retourne le snapshot qui l'inclut"""
+        with self.journal.locked(exclusive=True):
+            # Rattraper les autres workers avant d'attribuer le numéro d'entrée
+            if self.has_changed() or self._journal_replaced():
+                snapshot = self._read(snapshot.generation + 1)
+            else:
+                snapshot = self._replay(snapshot)
+            change = dict(change, seq=snapshot.journal_seq + 1, at=datetime.now().isoformat(timespec='seconds'))
+            # Validation avant écriture: une entrée invalide n'entre jamais dans le journal
+            merge_change(snapshot.company(change['company_id']), change)
+            line = json.dumps(change, ensure_ascii=False) + '\n'
+            self._journal_offset = self.journal.append(line)
+            return self._apply(snapshot, change, line)
+
+    def compact(self, snapshot):
+        """Réécrit users.json avec toutes les modifications et vide le journal
+
+        Retourne True si une compaction a eu lieu. Le fichier réécrit est
+        ensuite rechargé normalement par tous les processus, y compris
+        celui-ci (index reconstruits à l'identique d'un démarrage).
+        """
+        if snapshot.journal_seq == self._compacted_seq:
+            return False
+        with self.journal.locked(exclusive=True):
+            if self.has_changed() or self._journal_replaced():
+                # Déjà compacté par un autre processus
+                return False
+            snapshot = self._replay(snapshot)
+            # La version courante est conservée: le rechargement qui suit ne périme
+            # ni les jetons de session ni les réponses en cache
+            config = snapshot.to_config()
+            config.update(config_version=snapshot.version, config_digest=self._content_digest(config))
+            data = json.dumps(config, indent=2, ensure_ascii=False).encode('utf-8')
+            write_atomic(self.users_file, data)
+            self.journal.reset()
+            self._compacted_seq = snapshot.journal_seq
+        logger.info(f"Journal compacté dans users.json (jusqu'à l'entrée {snapshot.journal_seq})")
+        return True
+
+
+class SqliteUserStore(SqliteDatabase):
+    """Stockage des utilisateurs dans SQLite, indexé sur user_key et entreprise
+
+    Pour les gros volumes: rien n'est chargé en bloc, les entreprises sont
+    lues à la demande. La version (table meta) change à chaque import et à
+    chaque écriture de l'API d'administration; les écritures sont aussi
+    consignées dans la table append-only changes.
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS companies (
+               company_id TEXT PRIMARY KEY,
+               position INTEGER NOT NULL,
+               active INTEGER NOT NULL,
+               data TEXT NOT NULL
+           )""",
+        """CREATE TABLE IF NOT EXISTS users (
+               company_id TEXT NOT NULL,
+               user_key TEXT NOT NULL,
+               autodesk_user TEXT,
+               active INTEGER NOT NULL,
+               data TEXT NOT NULL,
+               PRIMARY KEY (company_id, user_key)
+           )""",
+        'CREATE INDEX IF NOT EXISTS idx_users_user_key ON users (user_key)',
+        'CREATE INDEX IF NOT EXISTS idx_users_autodesk_user ON users (autodesk_user)',
+        'CREATE INDEX IF NOT EXISTS idx_companies_position ON companies (position)',
+        'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+        """CREATE TABLE IF NOT EXISTS changes (
+               seq INTEGER PRIMARY KEY AUTOINCREMENT,
+               at TEXT NOT NULL,
+               change TEXT NOT NULL
+           )""",
+    ]
+
+    def __init__(self, db_path, max_companies=1000):
+        super().__init__(db_path)
+        self.max_companies = max_companies
+        self._last_seen_version = None
+
+    def current_version(self):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else None
+
+    def has_changed(self):
+        return self.current_version() != self._last_seen_version
+
+    def load(self, generation):
+        version = self.current_version()
+        self._last_seen_version = version
+        if version is None:
+            raise ValueError(f"base utilisateurs vide ({self.db_path}): lancer import_users.py")
+        return SqliteUserSnapshot(self, generation, version, self.max_companies)
+
+    def global_stats(self):
+        conn = self._connect()
+        total_companies, active_companies = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(active), 0) FROM companies').fetchone()
+        total_users, active_users = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(u.active), 0) FROM users u '
+            'JOIN companies c ON c.company_id = u.company_id WHERE c.active = 1').fetchone()
+        return {'total_companies': total_companies, 'active_companies': active_companies,
+                'total_users': total_users, 'active_users': active_users}
+
+    def company_for_user(self, user_key):
+        # Première entreprise active dans l'ordre du fichier d'origine (comme en mode JSON)
+        row = self._connect().execute(
+            'SELECT u.company_id FROM users u JOIN companies c ON c.company_id = u.company_id '
+            'WHERE u.user_key = ? AND c.active = 1 ORDER BY c.position LIMIT 1', (user_key,)).fetchone()
+        return row[0] if row else None
+
+    def company_for_autodesk_user(self, autodesk_user):
+        row = self._connect().execute(
+            'SELECT u.company_id FROM users u JOIN companies c ON c.company_id = u.company_id '
+            'WHERE u.autodesk_user = ? AND c.active = 1 ORDER BY c.position LIMIT 1',
+            (autodesk_user,)).fetchone()
+        return row[0] if row else None
+
+    def load_company(self, company_id):
+        """Entreprise au format users.json (avec ses utilisateurs), None si inconnue"""
+        conn = self._connect()
+        row = conn.execute('SELECT data FROM companies WHERE company_id = ?', (company_id,)).fetchone()
+        if row is None:
+            return None
+        company = json.loads(row[0])
+        company['users'] = {user_key: json.loads(data) for user_key, data in conn.execute(
+            'SELECT user_key, data FROM users WHERE company_id = ? ORDER BY rowid', (company_id,))}
+        return company
+
+    @staticmethod
+    def _write_company(conn, company_id, position, company):
+        users = company.get('users', {})
+        data = {k: v for k, v in company.items() if k != 'users'}
+        conn.execute('INSERT OR REPLACE INTO companies (company_id, position, active, data) VALUES (?, ?, ?, ?)',
+                     (company_id, position, int(bool(company.get('active', False))), json.dumps(data)))
+        conn.executemany(
+            'INSERT INTO users (company_id, user_key, autodesk_user, active, data) VALUES (?, ?, ?, ?, ?)',
+            [(company_id, user_key, user.get('autodesk_user'), int(bool(user.get('active', False))),
+              json.dumps(user)) for user_key, user in users.items()])
+
+    @staticmethod
+    def _bump_version(conn):
+        version = secrets.token_hex(8)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (version,))
+        return version
+
+    def import_config(self, config):
+        """Remplace le contenu de la base par un document au format users.json"""
+        validate_config(config)
+        companies = config.get('companies', {})
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM users')
+            conn.execute('DELETE FROM companies')
+            for position, (company_id, company) in enumerate(companies.items()):
+                self._write_company(conn, company_id, position, company)
+            self._bump_version(conn)
+        return len(companies), sum(len(c.get('users', {})) for c in companies.values())
+
+    def refresh(self, snapshot):
+        # Les écritures des autres processus changent la version: rechargement via has_changed()
+        return None
+
+    def apply(self, snapshot, change):
+        """Écrit une modification dans la base (une transaction) et retourne le snapshot qui l'inclut"""
+        conn = self._connect()
+        company_id = change['company_id']
+        with conn:
+            # Verrou d'écriture pris dès la lecture: pas d'écriture concurrente entre les deux
+            conn.execute('BEGIN IMMEDIATE')
+            version_before = self.current_version()
+            previous = self.load_company(company_id)
+            at = datetime.now().isoformat(timespec='seconds')
+            change = dict(change, at=at)
+            company = merge_change(previous, change)
+            row = conn.execute('SELECT position FROM companies WHERE company_id = ?', (company_id,)).fetchone()
+            if row is not None:
+                position = row[0]
+            else:
+                position = conn.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM companies').fetchone()[0]
+            conn.execute('DELETE FROM users WHERE company_id = ?', (company_id,))
+            self._write_company(conn, company_id, position, company)
+            conn.execute('INSERT INTO changes (at, change) VALUES (?, ?)',
+                         (at, json.dumps(change, ensure_ascii=False)))
+            version = self._bump_version(conn)
+        self._last_seen_version = version
+
+        if version_before != snapshot.version:
+            # Un autre processus a écrit entre-temps: nouvelle vue complète
+            return self.load(snapshot.generation + 1)
+        now = datetime.now()
+        return snapshot.with_company(CompiledCompany(company_id, previous, now) if previous else None,
+                                     CompiledCompany(company_id, company, now), version)
+
+    def compact(self, snapshot):
+        # Base modifiée en place: rien à compacter
+        return False
+
+
+class PluginEntry:
+    """Plugin présent sur le disque (métadonnées + empreinte du contenu)
+
+    Un plugin est soit un fichier <nom>.py, soit un dossier <nom>/ (paquet
+    avec DLL, familles, données) servi sous forme d'archive zip précalculée:
+    path désigne alors l'archive et source le dossier.
+    """
+
+    __slots__ = ('name', 'path', 'size', 'mtime', 'sha256', 'details', 'manifest', 'source', 'signature')
+
+    def __init__(self, name, path, size, mtime, sha256, source=None, signature=None):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.sha256 = sha256
+        self.source = source
+        # Signature (fichiers, tailles, mtimes) d'un paquet: reconstruction si elle change
+        self.signature = signature
+        # Métadonnées extraites par PluginManifestIndex (None tant que non indexé)
+        self.manifest = None
+        # Représentation publique, construite une seule fois
+        self.details = {
+            'name': name,
+            'type': 'package' if source else 'file',
+            'size': size,
+            'sha256': sha256,
+            'modified': datetime.fromtimestamp(mtime).isoformat()
+        }
+
+    @property
+    def key(self):
+        return self.name, self.sha256
+
+    @property
+    def is_package(self):
+        return self.source is not None
+
+    @property
+    def filename(self):
+        return f"{self.name}.zip" if self.is_package else f"{self.name}.py"
+
+
+# Encodages précalculés pour les plugins (mtime=0: sortie gzip déterministe)
+PLUGIN_ENCODERS = {
+    'gzip': lambda data: gzip.compress(data, compresslevel=9, mtime=0),
+    'deflate': lambda data: zlib.compress(data, 9),
+}
+
+
+def negotiate_encoding(accept_encodings):
+    """Choisit l'encodage de réponse selon Accept-Encoding (None = identité)"""
+    best = accept_encodings.best_match(list(PLUGIN_ENCODERS) + ['identity'], default='identity')
+    return None if best == 'identity' else best
+
+
+class StalePluginError(Exception):
+    """Le fichier sur disque ne correspond plus au hash du catalogue"""
+
+
+class PluginContent:
+    """Contenu d'un plugin et ses variantes compressées {encodage: bytes}"""
+
+    __slots__ = ('raw', 'variants', 'size')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.variants = {}
+        for name, compress in PLUGIN_ENCODERS.items():
+            data = compress(raw)
+            # Inutile de garder une variante qui ne réduit pas la taille
+            if len(data) < len(raw):
+                self.variants[name] = data
+        self.size = len(raw) + sum(len(data) for data in self.variants.values())
+
+
+class PluginContentCache:
+    """Cache LRU du contenu des plugins, borné en octets
+
+    Clé (nom, sha256): une nouvelle version d'un plugin ne peut jamais être
+    servie depuis une ancienne entrée. Les plugins trop gros pour le budget
+    ne sont pas mis en cache (get() retourne None).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resident_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, entry):
+        """Contenu du plugin (depuis la mémoire si possible), None s'il dépasse le budget"""
+        with self._lock:
+            content = self._items.get(entry.key)
+            if content is not None:
+                self._items.move_to_end(entry.key)
+                self.hits += 1
+                return content
+            self.misses += 1
+
+        # Les variantes font au plus la taille du source: 3x borne l'empreinte totale.
+        # Les paquets (archives zip, souvent volumineuses) sont servis depuis le disque.
+        if entry.is_package or entry.size * (1 + len(PLUGIN_ENCODERS)) > self.max_bytes:
+            return None
+
+        with open(entry.path, 'rb') as f:
+            raw = f.read()
+        if hashlib.sha256(raw).hexdigest() != entry.sha256:
+            raise StalePluginError(entry.name)
+        content = PluginContent(raw)
+
+        with self._lock:
+            if entry.key not in self._items:
+                self._items[entry.key] = content
+                self.resident_bytes += content.size
+                while self.resident_bytes > self.max_bytes:
+                    _, evicted = self._items.popitem(last=False)
+                    self.resident_bytes -= evicted.size
+                    self.evictions += 1
+        return content
+
+    def preload(self, entries):
+        """Charge les plugins tant que le budget le permet; retourne le nombre chargé"""
+        loaded = 0
+        for entry in entries:
+            if entry.key in self._items:
+                loaded += 1
+                continue
+            if entry.is_package or self.resident_bytes + entry.size * (1 + len(PLUGIN_ENCODERS)) > self.max_bytes:
+                continue
+            try:
+                self.get(entry)
+                loaded += 1
+            except (OSError, StalePluginError) as e:
+                logger.warning(f"Préchargement impossible pour {entry.name}: {e}")
+        return loaded
+
+    def prune(self, entries):
+        """Retire les versions qui ne sont plus dans le catalogue"""
+        valid = {entry.key for entry in entries}
+        with self._lock:
+            for key in [key for key in self._items if key not in valid]:
+                self.resident_bytes -= self._items.pop(key).size
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._items),
+            'resident_bytes': self.resident_bytes,
+            'max_bytes': self.max_bytes
+        }
+
+
+# Fonctions considérées comme points d'entrée d'un plugin
+PLUGIN_ENTRY_POINTS = ('main', 'run', 'execute')
+
+
+def extract_plugin_manifest(source):
+    """Métadonnées d'un plugin lues par analyse syntaxique (le code n'est jamais importé)
+
+    Retourne docstring, version (__version__ ou VERSION), points d'entrée
+    (fonctions main/run/execute et fonctions du module appelées par le bloc
+    __main__), modules importés et, si le fichier ne compile pas, l'erreur de
+    syntaxe.
+    """
+    manifest = {'docstring': None, 'version': None, 'entry_points': [], 'imports': [], 'syntax_error': None}
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError) as e:
+        line = getattr(e, 'lineno', None)
+        manifest['syntax_error'] = f"ligne {line}: {e.msg}" if line else str(e)
+        return manifest
+
+    manifest['docstring'] = ast.get_docstring(tree)
+    # Seuls les appels de fonctions du module comptent (pas print, sys.exit...)
+    defined = {node.name for node in tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    entry_points = []
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and manifest['version'] is None:
+            targets = {t.id for t in node.targets if isinstance(t, ast.Name)}
+            if targets & {'__version__', 'VERSION'} and isinstance(node.value, ast.Constant):
+                manifest['version'] = str(node.value.value)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name in PLUGIN_ENTRY_POINTS:
+            entry_points.append(node.name)
+        elif (isinstance(node, ast.If) and isinstance(node.test, ast.Compare)
+              and isinstance(node.test.left, ast.Name) and node.test.left.id == '__name__'):
+            for call in ast.walk(node):
+                if isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id in defined:
+                    entry_points.append(call.func.id)
+    manifest['entry_points'] = list(dict.fromkeys(entry_points))
+
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.module:
+                imports.append(node.module.split('.')[0])
+            elif node.level:
+                # from . import autre_plugin
+                imports.extend(alias.name for alias in node.names)
+    manifest['imports'] = sorted(set(imports))
+    return manifest
+
+
+def extract_package_manifest(name, source_dir):
+    """Manifeste d'un dossier plugin
+
+    Docstring, version et points d'entrée viennent du module principal
+    (__init__.py, main.py ou <nom>.py); les imports sont ceux de tous les
+    fichiers Python du dossier, hors modules internes au paquet.
+    """
+    manifest = {'docstring': None, 'version': None, 'entry_points': [], 'imports': [], 'syntax_error': None}
+    sources = [relpath for relpath, _, _ in PluginObjectStore.package_files(source_dir) if relpath.endswith('.py')]
+    main_module = next((m for m in ('__init__.py', 'main.py', f'{name}.py') if m in sources), None)
+    local_modules = {relpath.split('/')[0].rsplit('.', 1)[0] for relpath in sources}
+    imports = set()
+    for relpath in sources:
+        with open(os.path.join(source_dir, relpath), 'rb') as f:
+            module = extract_plugin_manifest(f.read())
+        if module['syntax_error'] and not manifest['syntax_error']:
+            manifest['syntax_error'] = f"{relpath}, {module['syntax_error']}"
+        imports.update(module['imports'])
+        if relpath == main_module:
+            manifest.update(docstring=module['docstring'], version=module['version'],
+                            entry_points=module['entry_points'])
+    manifest['imports'] = sorted(imports - local_modules)
+    return manifest
+
+
+class PluginManifestIndex:
+    """Index des métadonnées des plugins, mis en cache par hash de contenu
+
+    Alimenté à chaque changement du catalogue (publication): seuls les
+    contenus jamais vus sont analysés. Les plugins qui ne compilent pas sont
+    signalés dans les logs et dans leurs détails publics.
+    """
+
+    def __init__(self):
+        self._manifests = {}
+        self._lock = threading.Lock()
+
+    def get(self, entry):
+        """Manifeste du plugin (calculé à la demande s'il n'est pas encore indexé)"""
+        if entry.manifest is not None:
+            return entry.manifest
+        manifest = self._manifests.get(entry.sha256)
+        if manifest is None:
+            if entry.is_package:
+                manifest = extract_package_manifest(entry.name, entry.source)
+            else:
+                with open(entry.path, 'rb') as f:
+                    raw = f.read()
+                if hashlib.sha256(raw).hexdigest() != entry.sha256:
+                    raise StalePluginError(entry.name)
+                manifest = extract_plugin_manifest(raw)
+            if manifest['syntax_error']:
+                logger.warning(f"Plugin {entry.name} invalide ({manifest['syntax_error']})")
+            with self._lock:
+                self._manifests[entry.sha256] = manifest
+        entry.manifest = manifest
+        # Nouveau dictionnaire: les lecteurs concurrents ne voient jamais un état partiel
+        entry.details = dict(entry.details, description=(manifest['docstring'] or '').strip().split('\n')[0] or None,
+                             version=manifest['version'], entry_points=manifest['entry_points'],
+                             syntax_error=manifest['syntax_error'])
+        return manifest
+
+    def index(self, entries):
+        """Indexe les nouvelles versions et oublie les anciennes (avant publication du catalogue)"""
+        for entry in entries:
+            try:
+                self.get(entry)
+            except (OSError, StalePluginError) as e:
+                logger.warning(f"Indexation de {entry.name} impossible: {e}")
+        valid = {entry.sha256 for entry in entries}
+        with self._lock:
+            for sha256 in [sha256 for sha256 in self._manifests if sha256 not in valid]:
+                del self._manifests[sha256]
+
+    def stats(self):
+        return {'indexed': len(self._manifests),
+                'syntax_errors': sum(1 for m in self._manifests.values() if m['syntax_error'])}
+
+
+class PluginCatalog:
+    """Catalogue en mémoire des plugins de PLUGINS_DIR
+
+    Le dossier n'est relu que si son mtime change (ajout, suppression,
+    renommage) ou après invalidate(). Un rescan complet des stats est fait
+    toutes les `rescan_interval` secondes pour détecter les modifications en
+    place; seuls les fichiers modifiés sont re-hashés.
+
+    Hors premier scan et scan() explicite (démarrage, SIGHUP), les
+    vérifications tournent dans un thread dédié: les requêtes servent l'état
+    courant et ne font que le réveiller. Le nouvel état n'est publié qu'une
+    fois préparé (stockage par hash, manifestes indexés).
+    """
+
+    def __init__(self, plugins_dir, objects, check_interval=1.0, rescan_interval=30.0):
+        self.plugins_dir = plugins_dir
+        # Stockage par hash, où sont construites les archives des paquets
+        self.objects = objects
+        self.check_interval = check_interval
+        self.rescan_interval = rescan_interval
+        self.generation = 0
+        self._entries = []
+        self._index = {}
+        # Index de pagination: (entrées, noms triés, entrées par mtime, mtimes triés)
+        self._sorted = ([], [], [], [])
+        self._by_hash = {}
+        self._dir_mtime = None
+        self._last_check = 0.0
+        self._last_scan = 0.0
+        self._stale = True
+        self._lock = threading.Lock()
+        self._preparers = []
+        self._listeners = []
+        # Vérifications commencées / terminées (attente d'un rescan par rescan())
+        self._started = 0
+        self._checks = 0
+        self._scanner_pid = None
+        self._wakeup = threading.Event()
+        self._done = threading.Condition()
+        self._start_lock = threading.Lock()
+
+    def add_listener(self, callback, before_publish=False):
+        """Enregistre callback(entries), appelé à chaque changement de génération
+
+        Une génération est publiée dès qu'une entrée est remplacée, y compris
+        quand seul son mtime change. Avec before_publish, callback reçoit les
+        nouvelles entrées avant qu'elles ne soient visibles des requêtes;
+        sinon juste après leur publication.
+        """
+        (self._preparers if before_publish else self._listeners).append(callback)
+
+    def invalidate(self):
+        """Force un rescan au prochain accès (notification de changement)"""
+        self._stale = True
+
+    def rescan(self, timeout=5.0):
+        """Demande un rescan et attend qu'il soit terminé (au plus timeout secondes)"""
+        self._stale = True
+        started = self._started
+        self._request_scan()
+        with self._done:
+            self._done.wait_for(lambda: self._checks > started, timeout)
+
+    def _refresh(self):
+        if not self._checks:
+            # Rien à servir avant le premier scan: il est fait par l'appelant
+            self.scan()
+            return
+        now = time.monotonic()
+        if not self._stale and now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        self._request_scan()
+
+    def _request_scan(self):
+        # Le thread ne survit pas à un fork (workers gunicorn): redémarrage par processus
+        if self._scanner_pid != os.getpid():
+            with self._start_lock:
+                if self._scanner_pid != os.getpid():
+                    self._wakeup = threading.Event()
+                    self._done = threading.Condition()
+                    threading.Thread(target=self._run_scanner, args=(self._wakeup,),
+                                     name='plugin-catalog', daemon=True).start()
+                    self._scanner_pid = os.getpid()
+        self._wakeup.set()
+
+    def _run_scanner(self, wakeup):
+        while True:
+            wakeup.wait()
+            wakeup.clear()
+            try:
+                self.scan()
+            except Exception as e:
+                logger.error(f"Erreur au rescan du catalogue plugins: {e}")
+                self._stale = True
+            with self._done:
+                self._done.notify_all()
+
+    def scan(self):
+        """Vérifie le disque dans le thread appelant et publie le nouvel état"""
+        with self._lock:
+            self._started += 1
+            try:
+                now = time.monotonic()
+                self._last_check = now
+                try:
+                    dir_mtime = os.stat(self.plugins_dir).st_mtime_ns
+                except FileNotFoundError:
+                    dir_mtime = None
+                if (self._stale or not self._checks or dir_mtime != self._dir_mtime
+                        or now - self._last_scan >= self.rescan_interval):
+                    # Avant le scan: une invalidation pendant celui-ci n'est pas perdue
+                    self._stale = False
+                    self._scan(dir_mtime)
+                    self._dir_mtime = dir_mtime
+                    self._last_scan = now
+            finally:
+                self._checks += 1
+
+    def _scan(self, dir_mtime):
+        entries = []
+        if dir_mtime is not None:
+            for file in sorted(os.listdir(self.plugins_dir)):
+                path = os.path.join(self.plugins_dir, file)
+                if os.path.isdir(path):
+                    if not file.startswith(('.', '_')):
+                        entry = self._scan_package(file, path)
+                        if entry is not None:
+                            entries.append(entry)
+                    continue
+                if not file.endswith('.py'):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                name = file[:-3]  # Enlever .py
+                previous = self._index.get(name)
+                if (previous is not None and previous.size == stat.st_size
+                        and previous.mtime == stat.st_mtime):
+                    entries.append(previous)
+                    continue
+                try:
+                    with open(path, 'rb') as f:
+                        digest = hashlib.sha256(f.read()).hexdigest()
+                except OSError as e:
+                    logger.warning(f"Plugin {file} illisible: {e}")
+                    continue
+                entries.append(PluginEntry(name, path, stat.st_size, stat.st_mtime, digest))
+
+        entries.sort(key=lambda entry: entry.name)
+        index = {entry.name: entry for entry in entries}
+        # Toute nouvelle entrée compte, même à contenu identique (touch, redéploiement):
+        # ses détails publics (modified) changent
+        if (len(entries) == len(self._entries)
+                and all(self._index.get(entry.name) is entry for entry in entries)):
+            return
+        for callback in self._preparers:
+            callback(entries)
+        self._entries, self._index = entries, index
+        by_mtime = sorted(entries, key=lambda entry: entry.mtime)
+        self._sorted = (entries, [e.name for e in entries], by_mtime, [e.mtime for e in by_mtime])
+        self._by_hash = {entry.sha256: entry for entry in entries}
+        self.generation += 1
+        logger.info(f"Catalogue plugins: {len(entries)} plugins (génération {self.generation})")
+        for callback in self._listeners:
+            callback(entries)
+
+    def _scan_package(self, name, source_dir):
+        """Entrée d'un dossier plugin; l'archive n'est reconstruite que si le contenu change"""
+        try:
+            files = self.objects.package_files(source_dir)
+            if not files:
+                return None
+            signature = hashlib.sha256(json.dumps(files).encode('utf-8')).hexdigest()
+            previous = self._index.get(name)
+            if previous is not None and previous.signature == signature:
+                return previous
+            sha256 = self.objects.package(name, source_dir, files, signature)
+            path = self.objects.path(sha256)
+            mtime = max(mtime_ns for _, _, mtime_ns in files) / 1e9
+            return PluginEntry(name, path, os.path.getsize(path), mtime, sha256,
+                               source=source_dir, signature=signature)
+        except OSError as e:
+            logger.warning(f"Paquet {name} illisible: {e}")
+            return None
+
+    def snapshot(self):
+        """Liste courante sans vérification du disque"""
+        return self._entries
+
+    def entries(self):
+        """Liste des plugins triés par nom"""
+        self._refresh()
+        return self._entries
+
+    def get(self, name):
+        """Plugin par nom, ou None s'il n'existe pas"""
+        self._refresh()
+        return self._index.get(name)
+
+    def get_by_hash(self, sha256):
+        """Version courante ayant ce hash, ou None (ancienne version ou inconnu)"""
+        self._refresh()
+        return self._by_hash.get(sha256)
+
+    def page(self, prefix='', after=None, modified_since=None, limit=None, allowed=None):
+        """Page de plugins triés par nom: (entrées, curseur suivant ou None)
+
+        prefix filtre sur le début du nom, after est le curseur (dernier nom de
+        la page précédente), modified_since un timestamp, allowed un ensemble de
+        noms autorisés. Le parcours part de l'index trié: le coût suit la taille
+        de la page (ou des plus petits candidats), pas celle du catalogue.
+        """
+        self._refresh()
+        entries, names, by_mtime, mtimes = self._sorted
+        lo = bisect.bisect_left(names, prefix)
+        if after is not None:
+            lo = max(lo, bisect.bisect_right(names, after))
+        hi = bisect.bisect_left(names, prefix + '\U0010ffff') if prefix else len(names)
+
+        if allowed is not None:
+            lower = names[lo] if lo < hi else None
+            candidates = [self._index[name] for name in sorted(allowed)
+                          if name in self._index and lower is not None
+                          and lower <= name and name[:len(prefix)] == prefix]
+        elif modified_since is not None and len(mtimes) - bisect.bisect_right(mtimes, modified_since) < hi - lo:
+            # Peu de plugins récents: partir de l'index par date
+            candidates = sorted((entry for entry in by_mtime[bisect.bisect_right(mtimes, modified_since):]
+                                 if lo < len(names) and names[lo] <= entry.name
+                                 and entry.name[:len(prefix)] == prefix),
+                                key=lambda entry: entry.name)
+        else:
+            candidates = (entries[i] for i in range(lo, hi))
+
+        result = []
+        for entry in candidates:
+            if modified_since is not None and entry.mtime <= modified_since:
+                continue
+            if limit is not None and len(result) == limit:
+                return result, result[-1].name
+            result.append(entry)
+        return result, None
+
+
+class PluginObjectStore:
+    """Copies immuables des plugins, une par version, adressées par sha256
+
+    Alimenté à chaque changement du catalogue: une version publiée reste
+    téléchargeable par son hash après modification du plugin, tant qu'elle
+    fait partie des `keep_versions` précédentes et a été remplacée il y a
+    moins de `retention` secondes. Les versions d'un plugin retiré du
+    catalogue sont supprimées. L'historique (versions.json) est partagé entre
+    processus sous verrou; un objet absent de l'historique n'est supprimé
+    qu'après `grace` secondes (version en cours de publication par un autre worker).
+    """
+
+    SHA256 = re.compile(r'[0-9a-f]{64}')
+
+    def __init__(self, objects_dir, keep_versions=3, retention=30 * 86400, grace=3600):
+        self.objects_dir = objects_dir
+        self.keep_versions = keep_versions
+        self.retention = retention
+        self.grace = grace
+        self.history_path = os.path.join(objects_dir, 'versions.json')
+        self.stored = 0
+        self.collected = 0
+
+    def path(self, sha256):
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    def find(self, sha256):
+        """Chemin de l'objet, None si le hash est invalide ou inconnu"""
+        if not self.SHA256.fullmatch(sha256):
+            return None
+        path = self.path(sha256)
+        return path if os.path.exists(path) else None
+
+    @staticmethod
+    def mimetype(path):
+        """Type MIME d'un objet: archive zip (paquet) ou source Python"""
+        with open(path, 'rb') as f:
+            return 'application/zip' if f.read(4) == b'PK\x03\x04' else 'text/x-python'
+
+    @staticmethod
+    def package_files(source_dir):
+        """Fichiers d'un dossier plugin: [[chemin relatif, taille, mtime_ns], ...] triés"""
+        files = []
+        for root, dirs, names in os.walk(source_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != '__pycache__')
+            for name in names:
+                if name.startswith('.') or name.endswith('.pyc'):
+                    continue
+                path = os.path.join(root, name)
+                st = os.stat(path)
+                files.append([os.path.relpath(path, source_dir).replace(os.sep, '/'), st.st_size, st.st_mtime_ns])
+        files.sort()
+        return files
+
+    def package(self, name, source_dir, files, signature):
+        """Archive zip d'un dossier plugin, retourne son sha256
+
+        L'archive est déterministe (ordre et dates fixes): même contenu, même
+        hash. Elle n'est reconstruite que si la signature du dossier change,
+        y compris d'un redémarrage à l'autre (packages/<nom>.json).
+        """
+        index_path = os.path.join(self.objects_dir, 'packages', f"{name}.json")
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                known = json.load(f)
+            if known['signature'] == signature and os.path.exists(self.path(known['sha256'])):
+                return known['sha256']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        tmp_path = os.path.join(self.objects_dir, f".{name}.zip.tmp{os.getpid()}")
+        try:
+            with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                for relpath, _, _ in files:
+                    info = zipfile.ZipInfo(relpath, date_time=(1980, 1, 1, 0, 0, 0))
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    info.external_attr = 0o644 << 16
+                    with open(os.path.join(source_dir, relpath), 'rb') as src, archive.open(info, 'w') as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+            digest = hashlib.sha256()
+            with open(tmp_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            sha256 = digest.hexdigest()
+            os.makedirs(os.path.dirname(self.path(sha256)), exist_ok=True)
+            os.replace(tmp_path, self.path(sha256))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        write_atomic(index_path, json.dumps({'signature': signature, 'sha256': sha256}).encode('utf-8'))
+        self.stored += 1
+        logger.info(f"Paquet {name} archivé: {len(files)} fichiers ({sha256[:12]})")
+        return sha256
+
+    @contextmanager
+    def _history(self):
+        """Historique {nom: [[sha256, remplacé le (timestamp) ou None], ...]} sous verrou exclusif"""
+        os.makedirs(self.objects_dir, exist_ok=True)
+        with open(self.history_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(self.history_path, 'r', encoding='utf-8') as f:
+                    history = json.load(f)
+            except (OSError, ValueError):
+                history = {}
+            before = json.dumps(history, sort_keys=True)
+            yield history
+            after = json.dumps(history, sort_keys=True)
+            if after != before:
+                write_atomic(self.history_path, after.encode('utf-8'))
+
+    def _record_versions(self, entries):
+        now = time.time()
+        with self._history() as history:
+            for name, sha256 in ((entry.name, entry.sha256) for entry in entries):
+                versions = [version for version in history.get(name, []) if version[0] != sha256]
+                for version in versions:
+                    if version[1] is None:
+                        version[1] = now
+                history[name] = [[sha256, None]] + versions
+
+    def store(self, entries):
+        """Copie les versions du catalogue absentes du stockage (avant publication du catalogue)"""
+        try:
+            self._record_versions(entries)
+        except OSError as e:
+            logger.warning(f"Historique du stockage par hash non mis à jour: {e}")
+        for entry in entries:
+            path = self.path(entry.sha256)
+            if entry.is_package or os.path.exists(path):
+                continue
+            try:
+                with open(entry.path, 'rb') as f:
+                    raw = f.read()
+                if hashlib.sha256(raw).hexdigest() != entry.sha256:
+                    # Modifié depuis le scan: la nouvelle version sera copiée au prochain
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                write_atomic(path, raw)
+                self.stored += 1
+            except OSError as e:
+                logger.warning(f"Copie de {entry.name} dans le stockage par hash impossible: {e}")
+
+    def collect(self, entries):
+        """Supprime les versions hors rétention et celles des plugins retirés (listener du catalogue)"""
+        now = time.time()
+        names = {entry.name for entry in entries}
+        keep = {entry.sha256 for entry in entries}
+        dropped = set()
+        try:
+            with self._history() as history:
+                for name in list(history):
+                    versions = history[name]
+                    kept = []
+                    if name in names:
+                        kept = [versions[0]] + [version for version in versions[1:self.keep_versions + 1]
+                                                if version[1] is not None and now - version[1] < self.retention]
+                        history[name] = kept
+                    else:
+                        del history[name]
+                    dropped.update(version[0] for version in versions if version not in kept)
+                    keep.update(version[0] for version in kept)
+                removed = 0
+                for prefix in os.listdir(self.objects_dir):
+                    directory = os.path.join(self.objects_dir, prefix)
+                    if len(prefix) != 2 or not os.path.isdir(directory):
+                        continue
+                    for sha256 in os.listdir(directory):
+                        path = os.path.join(directory, sha256)
+                        # Hash inconnu de l'historique: peut-être en cours de publication
+                        if (self.SHA256.fullmatch(sha256) and sha256 not in keep
+                                and (sha256 in dropped or now - os.stat(path).st_mtime >= self.grace)):
+                            os.remove(path)
+                            removed += 1
+        except OSError as e:
+            logger.warning(f"Nettoyage du stockage par hash impossible: {e}")
+            return
+        if removed:
+            self.collected += removed
+            logger.info(f"Stockage par hash: {removed} versions supprimées (rétention)")
+
+
+class PluginEventHub:
+    """Diffusion des changements de catalogue et de configuration aux flux SSE
+
+    Un changement ne coûte qu'un notify_all: chaque flux se réveille et
+    recalcule lui-même la vue de son utilisateur (plugins autorisés, droits).
+    Les identifiants d'événements <état du catalogue>.<empreinte des droits>
+    sont les mêmes dans tous les workers, un client peut donc reprendre sur
+    n'importe lequel avec Last-Event-ID.
+    """
+
+    def __init__(self, max_streams, history=64):
+        self.max_streams = max_streams
+        self.history = history
+        self.sequence = 0
+        self.streams = 0
+        self.events_sent = 0
+        self.catalog_state = ''
+        self._catalogs = OrderedDict()  # état -> {nom: sha256}
+        self._condition = threading.Condition()
+
+    def catalog_changed(self, entries):
+        """Listener du catalogue: mémorise le nouvel état et réveille les flux"""
+        plugins = {entry.name: entry.sha256 for entry in entries}
+        state = hashlib.sha256(json.dumps(sorted(plugins.items())).encode('utf-8')).hexdigest()[:16]
+        with self._condition:
+            self._catalogs[state] = plugins
+            self._catalogs.move_to_end(state)
+            while len(self._catalogs) > self.history:
+                self._catalogs.popitem(last=False)
+            self.catalog_state = state
+            self.sequence += 1
+            self._condition.notify_all()
+
+    def config_changed(self):
+        with self._condition:
+            self.sequence += 1
+            self._condition.notify_all()
+
+    def current_catalog(self):
+        """(état, {nom: sha256}) cohérents entre eux"""
+        with self._condition:
+            return self.catalog_state, self._catalogs.get(self.catalog_state, {})
+
+    def catalog_at(self, state):
+        """Catalogue d'un état récent, None s'il est inconnu de ce processus"""
+        with self._condition:
+            return self._catalogs.get(state)
+
+    def wait(self, seen, timeout):
+        """Attend un changement postérieur à `seen`; retourne la séquence courante"""
+        with self._condition:
+            if self.sequence == seen:
+                self._condition.wait(timeout)
+            return self.sequence
+
+    def open_stream(self):
+        with self._condition:
+            if self.streams >= self.max_streams:
+                return False
+            self.streams += 1
+            return True
+
+    def close_stream(self):
+        with self._condition:
+            self.streams -= 1
+
+    def event_sent(self):
+        with self._condition:
+            self.events_sent += 1
+
+    def stats(self):
+        return {'open_streams': self.streams, 'max_streams': self.max_streams,
+                'events_sent': self.events_sent, 'catalog_state': self.catalog_state}
 
 
 class PluginServer:
     def __init__(self):
         self.users_file = os.path.join(CONFIG_DIR, 'users.json')
+        self.objects = PluginObjectStore(PLUGIN_OBJECTS_DIR, PLUGIN_OBJECTS_KEEP_VERSIONS,
+                                         PLUGIN_OBJECTS_RETENTION_DAYS * 86400)
+        self.catalog = PluginCatalog(PLUGINS_DIR, self.objects)
+        self.content_cache = PluginContentCache(PLUGIN_CACHE_BYTES)
+        self.catalog.add_listener(self.content_cache.prune)
+        self.catalog.add_listener(self.objects.collect)
+        self.catalog.add_listener(self.objects.store, before_publish=True)
+        self.events = PluginEventHub(SSE_MAX_STREAMS)
+        self.manifests = PluginManifestIndex()
+        self.catalog.add_listener(self.manifests.index, before_publish=True)
+        # Epoch des résolutions de permissions: incrémenté à chaque publication
+        self.catalog_epoch = 0
+        self.catalog.add_listener(self._catalog_indexed)
+        self.catalog.add_listener(self.events.catalog_changed)
+        if USER_STORE == 'sqlite':
+            self.user_store = SqliteUserStore(USERS_DB, USER_STORE_CACHE_COMPANIES)
+        else:
+            self.user_store = JsonUserStore(self.users_file, USERS_JOURNAL)
+        self._snapshot = ConfigSnapshot({}, generation=0)
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._watch_interval = 0
+        self._last_compaction = time.monotonic()
+        self.ready = False
         self._load_config()
 
+    # Accès à la configuration courante (lecture d'un snapshot immuable)
+    @property
+    def config_generation(self):
+        return self._snapshot.generation
+
+    @property
+    def config_version(self):
+        return self._snapshot.version
+
+    @property
+    def config_loaded_at(self):
+        return self._snapshot.loaded_at
+
     def _load_config(self):
-        """Charge la configuration des entreprises et utilisateurs"""
-        try:
-            with open(self.users_file, 'r', encoding='utf-8') as f:
-                self.config = json.load(f)
-                self.companies = self.config.get('companies', {})
-                logger.info(f"Configuration chargée: {len(self.companies)} entreprises")
-        except FileNotFoundError:
-            logger.error(f"Fichier users.json non trouvé: {self.users_file}")
-            self.companies = {}
-        except json.JSONDecodeError as e:
-            logger.error(f"Erreur JSON dans users.json: {e}")
-            self.companies = {}
+        """Charge la configuration des entreprises et utilisateurs
+
+        Le nouveau snapshot n'est publié que si la source est valide; en cas
+        d'erreur la dernière configuration valide reste en place.
+        """
+        with self._reload_lock:
+            try:
+                snapshot = self.user_store.load(self._snapshot.generation + 1)
+            except FileNotFoundError:
+                logger.error(f"Fichier users.json non trouvé: {self.users_file}")
+                return False
+            except json.JSONDecodeError as e:
+                logger.error(f"Erreur JSON dans users.json: {e}")
+                return False
+            except ValueError as e:
+                # Inclut les erreurs de décodage UTF-8
+                logger.error(f"Configuration users.json invalide: {e}")
+                return False
+            except sqlite3.Error as e:
+                logger.error(f"Erreur base utilisateurs: {e}")
+                return False
+
+            if snapshot.version == self._snapshot.version:
+                # Contenu inchangé (compaction du journal): ni nouvelle génération ni réveil des flux
+                return False
+
+            # Remplacement atomique: une seule affectation de référence
+            self._publish(snapshot)
+            logger.info(f"Configuration chargée: {snapshot.company_count} entreprises "
+                        f"(génération {snapshot.generation}, stockage {self.user_store.name})")
+            return True
+
+    def _publish(self, snapshot):
+        self._snapshot = snapshot
+        self.events.config_changed()
+
+    def lookup_user(self, user_key):
+        """UserRecord courant (entreprises actives), None si inconnu"""
+        return self._snapshot.lookup_user(user_key)
+
+    def reload_config_if_changed(self):
+        """Recharge la configuration si la source a changé depuis le dernier chargement
+
+        Sinon, applique les modifications journalisées par d'autres processus.
+        """
+        if self.user_store.has_changed():
+            return self._load_config()
+        with self._reload_lock:
+            snapshot = self.user_store.refresh(self._snapshot)
+            if snapshot is None:
+                return False
+            self._publish(snapshot)
+        logger.info(f"Modifications appliquées depuis le journal (génération {snapshot.generation})")
+        return True
+
+    def apply_change(self, change):
+        """Applique une modification de l'API d'administration; retourne le snapshot publié
+
+        Lève ValueError si la modification est invalide (rien n'est écrit).
+        """
+        with self._reload_lock:
+            snapshot = self.user_store.apply(self._snapshot, change)
+            self._publish(snapshot)
+        target = '/'.join(filter(None, (change['company_id'], change.get('user_key'))))
+        logger.info(f"Modification {change['op']} {target} appliquée (génération {snapshot.generation})")
+        return snapshot
+
+    def compact_if_due(self, interval):
+        """Compaction périodique du journal dans users.json"""
+        if time.monotonic() - self._last_compaction < interval:
+            return False
+        self._last_compaction = time.monotonic()
+        with self._reload_lock:
+            return self.user_store.compact(self._snapshot)
+
+    def start_config_watcher(self, interval):
+        """Démarre la surveillance de users.json (polling du mtime) en arrière-plan"""
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._watch_interval = interval
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload_config_if_changed()
+                    self.compact_if_due(USERS_COMPACT_INTERVAL)
+                except Exception as e:
+                    logger.error(f"Erreur rechargement configuration: {e}")
+
+        self._watcher = threading.Thread(target=watch, name='config-watcher', daemon=True)
+        self._watcher.start()
+        logger.info(f"Rechargement à chaud de users.json activé (toutes les {interval}s)")
+
+    def restart_watcher_after_fork(self):
+        # Les threads du processus maître ne sont pas hérités par les workers;
+        # un verrou pris par l'un d'eux au moment du fork ne serait jamais relâché
+        self._reload_lock = threading.Lock()
+        if self._watcher is not None:
+            self._watcher = None
+            self.start_config_watcher(self._watch_interval)
+
+    def warm_up(self):
+        """Préchauffe catalogue et cache de contenu; le serveur devient prêt (readiness)"""
+        self.catalog.scan()
+        entries = self.catalog.snapshot()
+        loaded = self.content_cache.preload(entries)
+        self.ready = True
+        logger.info(f"Préchauffage terminé: {len(entries)} plugins, {loaded} en cache mémoire")
+
+    def reload(self):
+        """Rechargement complet (SIGHUP): configuration, catalogue et caches"""
+        self._load_config()
+        self.catalog.invalidate()
+        self.warm_up()
 
     def authenticate_user(self, autodesk_user, computer_name, api_key):
         """Authentifie un utilisateur par autodesk_user + computer_name + api_key"""
         user_key = f"{autodesk_user}_{computer_name}"
 
-        # Chercher dans toutes les entreprises
-        for company_id, company_data in self.companies.items():
-            if not company_data.get('active', False):
-                continue
+        # Recherche directe dans l'index (entreprises actives uniquement)
+        snapshot = self._snapshot
+        record = snapshot.lookup_user(user_key)
+        if record is None:
+            raise AuthenticationError('Utilisateur non trouvé ou non autorisé', 'unknown_user')
 
-            users = company_data.get('users', {})
-            if user_key in users:
-                user = users[user_key]
+        # Vérifier l'API key
+        if record.api_key != api_key:
+            raise AuthenticationError('API key invalide', 'bad_key')
 
-                # Vérifier l'API key
-                if user.get('api_key') != api_key:
-                    raise Exception('API key invalide')
+        if not record.active:
+            raise AuthenticationError('Compte utilisateur désactivé', 'disabled')
 
-                if not user.get('active', False):
-                    raise Exception('Compte utilisateur désactivé')
+        # Vérifier l'expiration de l'utilisateur (date déjà parsée au chargement)
+        if record.is_expired(datetime.now()):
+            raise AuthenticationError('Compte utilisateur expiré', 'expired')
 
-                # Vérifier l'expiration de l'utilisateur
-                expires = user.get('expires')
-                if expires:
-                    try:
-                        expire_date = datetime.strptime(expires, "%Y-%m-%d")
-                        if datetime.now() > expire_date:
-                            raise Exception('Compte utilisateur expiré')
-                    except ValueError:
-                        logger.warning(f"Format de date expires invalide pour {user_key}: {expires}")
-
-                # Retourner l'utilisateur avec les infos de l'entreprise
-                return {
-                    'user': user,
-                    'company': company_data,
-                    'company_id': company_id,
-                    'user_key': user_key
-                }
-
-        raise Exception('Utilisateur non trouvé ou non autorisé')
+        # Retourner l'utilisateur avec les infos de l'entreprise
+        return {
+            'user': record.data,
+            'record': record,
+            'company': snapshot.company(record.company_id),
+            'company_id': record.company_id,
+            'user_key': user_key,
+            # Génération du snapshot lu: clé des réponses construites à partir de ces données
+            'generation': snapshot.generation,
+            # Version de configuration qui a validé les identifiants: signée dans le jeton
+            'version': snapshot.version
+        }
+
+    def issue_session_token(self, auth_data, serializer, ttl):
+        """Jeton signé: entreprise, utilisateur, version de config, empreinte des droits, expiration"""
+        record = auth_data['record']
+        expires = time.time() + ttl
+        if record.expires_at is not None:
+            expires = min(expires, record.expires_at.timestamp())
+        token = serializer.dumps({
+            'cid': record.company_id,
+            'uk': record.user_key,
+            'cfg': auth_data['version'],
+            'fp': record.permissions.fingerprint,
+            'exp': int(expires)
+        })
+        return token, int(expires)
+
+    def authenticate_token(self, token, serializer):
+        """Vérifie un jeton de session (HMAC + version de config), sans relire les identifiants"""
+        try:
+            payload = serializer.loads(token)
+        except BadSignature:
+            raise AuthenticationError('Jeton de session invalide', 'bad_token')
+
+        snapshot = self._snapshot
+        if payload.get('cfg') != snapshot.version:
+            raise AuthenticationError('Jeton de session périmé (configuration modifiée)', 'stale_token')
+        if time.time() >= payload.get('exp', 0):
+            raise AuthenticationError('Jeton de session expiré', 'expired_token')
+
+        record = snapshot.lookup_user(payload.get('uk'))
+        if record is None or record.company_id != payload.get('cid') \
+                or record.permissions.fingerprint != payload.get('fp'):
+            raise AuthenticationError('Jeton de session invalide', 'bad_token')
+
+        return {
+            'user': record.data,
+            'record': record,
+            'company': snapshot.company(record.company_id),
+            'company_id': record.company_id,
+            'user_key': record.user_key,
+            'generation': snapshot.generation,
+            'version': snapshot.version
+        }
+
+    def company_for_revit_user(self, revit_user, computer_name=None):
+        """Entreprise d'un utilisateur Revit (sans authentification, pour les statistiques)"""
+        snapshot = self._snapshot
+        if computer_name:
+            record = snapshot.lookup_user(f"{revit_user}_{computer_name}")
+            if record is not None:
+                return record.company_id
+        return snapshot.company_for_autodesk_user(revit_user)
 
     def check_plugin_access(self, auth_data, plugin_name):
         """Vérifie l'accès au plugin basé sur les permissions utilisateur"""
-        user = auth_data['user']
-        allowed = user.get('allowed_plugins', [])
-
-        if '*' in allowed or plugin_name in allowed:
+        if auth_data['record'].permissions.permits(plugin_name):
             return True
         raise Exception(f'Accès refusé au plugin: {plugin_name}')
 
     def get_user_allowed_plugins(self, auth_data):
         """Récupère les plugins autorisés pour l'utilisateur"""
-        user = auth_data['user']
-        allowed = user.get('allowed_plugins', [])
+        permissions = auth_data['record'].permissions
+
+        if permissions.wildcard:
+            return [entry.name for entry in self.allowed_entries(auth_data)[0]]
+        return list(permissions.allowed_sorted)
+
+    def allowed_entries(self, auth_data):
+        """Plugins autorisés présents dans le catalogue et fragment JSON de leurs détails
+
+        Résolution partagée par tous les utilisateurs ayant les mêmes droits.
+        """
+        # Réveille si besoin le rescan du catalogue (en arrière-plan, hors premier scan)
+        self.catalog.entries()
+        return auth_data['record'].permissions.resolve(self.catalog, self.catalog_epoch)
+
+    def _catalog_indexed(self, entries):
+        """Invalide les résolutions de permissions (listener du catalogue)"""
+        self.catalog_epoch += 1
+
+    def compute_sync_delta(self, auth_data, manifest):
+        """Compare le manifeste client {nom: hash} aux plugins autorisés
+
+        Retourne (plugins nouveaux ou modifiés, noms à supprimer côté client).
+        """
+        catalog_entries = self.allowed_entries(auth_data)[0]
+
+        current = {entry.name for entry in catalog_entries}
+        changed = [entry for entry in catalog_entries if manifest.get(entry.name) != entry.sha256]
+        removed = sorted(name for name in manifest if name not in current)
+        return changed, removed
+
+    def plugin_dependencies(self, entry):
+        """Plugins du catalogue importés par ce plugin"""
+        return [name for name in self.manifests.get(entry)['imports']
+                if name != entry.name and self.catalog.get(name) is not None]
+
+    def resolve_plugin_closure(self, auth_data, plugin_name):
+        """Plugin et ses dépendances transitives autorisées, dépendances d'abord
+
+        Retourne (entrées, graphe {nom: dépendances}, dépendances refusées).
+        Lève Exception si le plugin demandé n'est pas autorisé, et
+        StalePluginError s'il a disparu du catalogue.
+        """
+        self.check_plugin_access(auth_data, plugin_name)
+        record = auth_data['record']
+        ordered, graph, denied = [], {}, set()
+
+        def visit(name):
+            entry = self.catalog.get(name)
+            if entry is None:
+                # Supprimé entre deux lectures du catalogue
+                if name == plugin_name:
+                    raise StalePluginError(name)
+                return False
+            graph[name] = self.plugin_dependencies(entry)
+            for dependency in list(graph[name]):
+                if dependency in graph:
+                    continue
+                if not record.permissions.permits(dependency):
+                    denied.add(dependency)
+                    continue
+                if not visit(dependency):
+                    graph[name].remove(dependency)
+            ordered.append(entry)
+            return True
 
-        if '*' in allowed:
-            return [p['name'] for p in self.list_disk_plugins()]
-        return sorted(allowed)
+        visit(plugin_name)
+        return ordered, graph, sorted(denied)
 
     def list_disk_plugins(self):
-        """Liste tous les plugins disponibles sur le disque"""
-        plugins = []
-        if os.path.exists(PLUGINS_DIR):
-            for file in os.listdir(PLUGINS_DIR):
-                if file.endswith('.py'):
-                    stat = os.stat(os.path.join(PLUGINS_DIR, file))
-                    plugins.append({
-                        'name': file[:-3],  # Enlever .py
-                        'size': stat.st_size,
-                        'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
-                    })
-        return plugins
+        """Liste tous les plugins disponibles sur le disque (depuis le catalogue)"""
+        return [entry.details for entry in self.catalog.entries()]
+
+    def get_company(self, company_id):
+        """Données d'une entreprise (avec ses utilisateurs), None si inconnue"""
+        return self._snapshot.company(company_id)
 
     def get_company_stats(self, company_id):
-        """Statistiques d'une entreprise"""
-        if company_id not in self.companies:
-            return None
+        """Statistiques d'une entreprise (compteurs maintenus au chargement)"""
+        return self._snapshot.company_stats(company_id)
 
-        company = self.companies[company_id]
-        users = company.get('users', {})
+    def get_global_stats(self):
+        """Statistiques globales du système"""
+        stats = dict(self._snapshot.global_stats)
+        stats['total_plugins'] = len(self.catalog.entries())
+        return stats
 
-        # Compter les utilisateurs actifs et non expirés
-        active_users = 0
-        expired_users = 0
 
-        for user in users.values():
-            if not user.get('active', False):
-                continue
+class ZipStream(io.RawIOBase):
+    """Flux d'écriture non seekable: zipfile y écrit, on vide au fur et à mesure"""
 
-            expires = user.get('expires')
-            if expires:
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_plugin_archive(entries, sync_manifest, chunk_size=64 * 1024, manifest_name='sync_manifest.json'):
+    """Générateur produisant une archive zip des plugins sans la bufferiser en entier"""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(manifest_name, json.dumps(sync_manifest))
+        yield stream.drain()
+
+        for entry in entries:
+            try:
+                with open(entry.path, 'rb') as src, archive.open(entry.filename, 'w') as dst:
+                    while True:
+                        chunk = src.read(chunk_size)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        data = stream.drain()
+                        if data:
+                            yield data
+            except FileNotFoundError:
+                logger.warning(f"Plugin {entry.name} disparu pendant la synchronisation")
+            data = stream.drain()
+            if data:
+                yield data
+    yield stream.drain()
+
+
+def sse_event(event, event_id, data):
+    """Événement Server-Sent Events sérialisé"""
+    return f"event: {event}\nid: {event_id}\ndata: {json.dumps(data)}\n\n"
+
+
+def revocation_reason(connected, current, now):
+    """Motif de fermeture d'un flux si le compte n'est plus valable, sinon None"""
+    if current is None:
+        return 'unknown_user'
+    if current.api_key != connected.api_key:
+        return 'key_rotated'
+    if not current.active:
+        return 'disabled'
+    if current.is_expired(now):
+        return 'expired'
+    return None
+
+
+def stream_plugin_events(server, record, last_event_id=None, heartbeat=15.0):
+    """Générateur du flux SSE d'un utilisateur: plugins autorisés et changements de droits
+
+    Événements: snapshot (état complet), catalog (ajouts / mises à jour /
+    suppressions parmi les plugins autorisés), permissions (droits modifiés,
+    état complet), revoked (compte désactivé, expiré ou clé changée: fin du
+    flux). Un commentaire heartbeat est envoyé toutes les `heartbeat` secondes.
+    La place du flux dans le hub est libérée par l'appelant (close de la réponse).
+    """
+    hub = server.events
+    yield f"retry: {int(heartbeat * 1000)}\n\n"
+    sent_plugins, sent_fingerprint = None, None
+
+    # Reprise: l'identifiant décrit l'état déjà connu du client
+    if last_event_id and '.' in last_event_id:
+        state, sent_fingerprint = last_event_id.split('.', 1)
+        catalog = hub.catalog_at(state)
+        if catalog is not None and sent_fingerprint == record.permissions.fingerprint:
+            sent_plugins = {name: sha256 for name, sha256 in catalog.items()
+                            if record.permissions.permits(name)}
+
+    seen = hub.sequence
+    while True:
+        current = server.lookup_user(record.user_key)
+        reason = revocation_reason(record, current, datetime.now())
+        state, catalog = hub.current_catalog()
+        if reason:
+            hub.event_sent()
+            yield sse_event('revoked', f"{state}.", {'reason': reason})
+            return
+
+        permissions = current.permissions
+        plugins = {name: sha256 for name, sha256 in catalog.items() if permissions.permits(name)}
+        event_id = f"{state}.{permissions.fingerprint}"
+        if sent_fingerprint is not None and sent_fingerprint != permissions.fingerprint:
+            yield sse_event('permissions', event_id, {
+                'allowed_fingerprint': permissions.fingerprint, 'plugins': plugins})
+        elif sent_plugins is None:
+            yield sse_event('snapshot', event_id, {
+                'allowed_fingerprint': permissions.fingerprint, 'plugins': plugins})
+        elif plugins != sent_plugins:
+            yield sse_event('catalog', event_id, {
+                'added': {n: h for n, h in plugins.items() if n not in sent_plugins},
+                'updated': {n: h for n, h in plugins.items() if n in sent_plugins and sent_plugins[n] != h},
+                'removed': sorted(n for n in sent_plugins if n not in plugins)})
+        else:
+            event_id = None
+        if event_id is not None:
+            hub.event_sent()
+        sent_plugins, sent_fingerprint = plugins, permissions.fingerprint
+        record = current
+
+        sequence = hub.wait(seen, heartbeat)
+        if sequence == seen:
+            yield ": heartbeat\n\n"
+            # Aucun client ne sollicite peut-être le catalogue: vérification du disque
+            server.catalog.entries()
+        seen = sequence
+
+
+def normalize_timestamp(value):
+    """Horodatage ISO comparable lexicographiquement (heure locale, à la seconde)"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat(timespec='seconds')
+
+
+class ExecutionStore(SqliteDatabase):
+    """Historique des exécutions indexé dans SQLite
+
+    Index sur l'horodatage, le script, l'utilisateur et l'entreprise: les
+    requêtes sur une période restent des parcours d'index, sans charger
+    l'historique en mémoire.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS executions (
+               id INTEGER PRIMARY KEY,
+               ts TEXT NOT NULL,
+               script_name TEXT,
+               revit_user TEXT,
+               company_id TEXT
+           )""",
+        'CREATE INDEX IF NOT EXISTS idx_executions_ts ON executions (ts)',
+        'CREATE INDEX IF NOT EXISTS idx_executions_script ON executions (script_name, ts)',
+        'CREATE INDEX IF NOT EXISTS idx_executions_user ON executions (revit_user, ts)',
+        'CREATE INDEX IF NOT EXISTS idx_executions_company ON executions (company_id, ts)',
+        'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+    ]
+
+    GROUP_COLUMNS = {
+        'script': 'script_name',
+        'user': 'revit_user',
+        'company': 'company_id',
+    }
+
+    FILTER_COLUMNS = ('script_name', 'revit_user', 'company_id')
+
+    @staticmethod
+    def _row(record):
+        try:
+            ts = normalize_timestamp(record.get('timestamp'))
+        except (TypeError, ValueError):
+            ts = datetime.now().isoformat(timespec='seconds')
+        return ts, record.get('script_name'), record.get('revit_user'), record.get('company_id')
+
+    def insert_many(self, records):
+        """Insère un lot d'enregistrements en une transaction"""
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT INTO executions (ts, script_name, revit_user, company_id) VALUES (?, ?, ?, ?)',
+                [self._row(record) for record in records])
+
+    def mark_jsonl_end(self, log_file):
+        """Fige la partie de log_file à importer: les lignes ajoutées ensuite sont indexées à l'écriture
+
+        Le premier processus à démarrer son thread d'écriture fixe la limite.
+        """
+        try:
+            size = os.path.getsize(log_file)
+        except FileNotFoundError:
+            size = 0
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('jsonl_import_end', ?)", (str(size),))
+
+    def import_jsonl_batch(self, log_file, batch_size=10000):
+        """Importe le lot suivant de l'historique JSONL en une transaction courte
+
+        La position atteinte est enregistrée avec le lot: l'import reprend
+        après un redémarrage et plusieurs processus peuvent s'y relayer sans
+        doublons. Retourne le nombre d'entrées importées, None une fois terminé.
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN "
+                                     "('jsonl_imported', 'jsonl_import_end', 'jsonl_import_offset')"))
+            if 'jsonl_imported' in meta or 'jsonl_import_end' not in meta:
+                return None
+            offset = int(meta.get('jsonl_import_offset', 0))
+            end = int(meta['jsonl_import_end'])
+            batch = []
+            lines = 0
+            line = b''
+            try:
+                with open(log_file, 'rb') as f:
+                    f.seek(offset)
+                    while offset < end and lines < batch_size:
+                        line = f.readline()
+                        if not line:
+                            break
+                        offset += len(line)
+                        lines += 1
+                        try:
+                            record = json.loads(line)
+                        except (json.JSONDecodeError, UnicodeDecodeError):
+                            continue
+                        if isinstance(record, dict):
+                            batch.append(self._row(record))
+                finished = offset >= end or not line
+            except FileNotFoundError:
+                finished = True
+            conn.executemany('INSERT INTO executions (ts, script_name, revit_user, company_id) '
+                             'VALUES (?, ?, ?, ?)', batch)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('jsonl_import_offset', ?)",
+                         (str(offset),))
+            if finished:
+                conn.execute("INSERT INTO meta (key, value) VALUES ('jsonl_imported', ?)",
+                             (datetime.now().isoformat(),))
+        return len(batch)
+
+    def import_jsonl(self, log_file, batch_size=10000):
+        """Import unique de l'historique JSONL existant, lot par lot; retourne le nombre d'entrées"""
+        imported = 0
+        while True:
+            count = self.import_jsonl_batch(log_file, batch_size)
+            if count is None:
+                break
+            imported += count
+        if imported:
+            logger.info(f"Historique des exécutions importé: {imported} entrées")
+        return imported
+
+    def _where(self, start=None, end=None, filters=None):
+        clauses, params = [], []
+        if start:
+            clauses.append('ts >= ?')
+            params.append(normalize_timestamp(start))
+        if end:
+            clauses.append('ts < ?')
+            params.append(normalize_timestamp(end))
+        for column in self.FILTER_COLUMNS:
+            value = (filters or {}).get(column)
+            if value:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def count(self, start=None, end=None, filters=None):
+        """Nombre d'exécutions sur la période"""
+        where, params = self._where(start, end, filters)
+        return self._connect().execute(f'SELECT COUNT(*) FROM executions{where}', params).fetchone()[0]
+
+    def breakdown(self, group_by, start=None, end=None, filters=None, limit=10):
+        """Top-N des exécutions groupées par script, utilisateur ou entreprise"""
+        column = self.GROUP_COLUMNS[group_by]
+        where, params = self._where(start, end, filters)
+        rows = self._connect().execute(
+            f'SELECT {column}, COUNT(*) AS n FROM executions{where} '
+            f'GROUP BY {column} ORDER BY n DESC, {column} LIMIT ?', params + [limit]).fetchall()
+        return [{group_by: value, 'count': n} for value, n in rows]
+
+
+class ExecutionTracker:
+    """Ingestion asynchrone des exécutions de scripts
+
+    Les requêtes ne font que déposer les enregistrements dans une file; un
+    thread d'écriture les regroupe et les ajoute au fichier JSONL toutes les
+    `flush_records` entrées ou `flush_interval` secondes (group commit).
+    À l'arrêt (stop(), appelé via atexit), la file est vidée sur disque avant
+    de rendre la main; les enregistrements reçus après l'arrêt sont écrits
+    directement dans la requête.
+    """
+
+    _STOP = object()
+
+    def __init__(self, log_file, flush_records=100, flush_interval=0.2, max_queue=100000, store=None):
+        self.log_file = log_file
+        self.store = store
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+        self._stopped = False
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Le thread ne survit pas à un fork (workers gunicorn): redémarrage par processus
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._thread = threading.Thread(target=self._run, name='execution-writer', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def submit(self, records):
+        """Met en file des enregistrements; retourne le nombre accepté"""
+        if self._stopped:
+            self._write(records)
+            return len(records)
+        self._ensure_started()
+        accepted = 0
+        for record in records:
+            try:
+                self._queue.put_nowait(record)
+                accepted += 1
+            except queue.Full:
+                self.dropped += 1
+        return accepted
+
+    def _run(self):
+        if self.store is not None:
+            try:
+                # Avant toute écriture: la suite du fichier sera indexée au fil de l'eau
+                self.store.mark_jsonl_end(self.log_file)
+                threading.Thread(target=self._import_history, name='execution-import', daemon=True).start()
+            except Exception as e:
+                logger.error(f"Erreur import historique des exécutions: {e}")
+        while True:
+            item = self._queue.get()
+            stopping = item is self._STOP
+            batch = [] if stopping else [item]
+            deadline = time.monotonic() + self.flush_interval
+            while not stopping and len(batch) < self.flush_records:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
                 try:
-                    expire_date = datetime.strptime(expires, "%Y-%m-%d")
-                    if datetime.now() > expire_date:
-                        expired_users += 1
-                    else:
-                        active_users += 1
-                except ValueError:
-                    active_users += 1  # Si format invalide, considérer comme actif
-            else:
-                active_users += 1  # Pas d'expiration = actif
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if stopping:
+                # Vider ce qui reste sans attendre
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not self._STOP:
+                        batch.append(item)
+            if batch:
+                self._write(batch)
+            if stopping:
+                return
+
+    def _import_history(self):
+        """Import de l'historique JSONL hors du thread d'écriture (qui continue de vider la file)"""
+        try:
+            self.store.import_jsonl(self.log_file)
+        except Exception as e:
+            logger.error(f"Erreur import historique des exécutions: {e}")
 
+    def _write(self, batch):
+        try:
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(record) + '\n' for record in batch))
+            self.written += len(batch)
+        except OSError as e:
+            self.dropped += len(batch)
+            logger.error(f"Erreur écriture des exécutions ({len(batch)} perdues): {e}")
+            return
+        if self.store is not None:
+            try:
+                self.store.insert_many(batch)
+            except sqlite3.Error as e:
+                logger.error(f"Erreur indexation des exécutions: {e}")
+
+    def stop(self, timeout=5.0):
+        """Arrêt propre: écrit tout ce qui est en file puis arrête le thread"""
+        self._stopped = True
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join(timeout)
+
+    def stats(self):
         return {
-            'company_name': company['name'],
-            'total_users': len(users),
-            'active_users': active_users,
-            'expired_users': expired_users,
-            'created_at': company.get('created_at')
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped
         }
 
-    def get_global_stats(self):
-        """Statistiques globales du système"""
-        total_companies = len(self.companies)
-        active_companies = len([c for c in self.companies.values() if c.get('active', False)])
-
-        total_users = 0
-        active_users = 0
 
-        for company in self.companies.values():
-            if not company.get('active', False):
-                continue
-            users = company.get('users', {})
-            total_users += len(users)
-            active_users += len([u for u in users.values() if u.get('active', False)])
+def execution_record(data, computer_name=None):
+    """Enregistrement d'exécution normalisé à partir du JSON client"""
+    return {
+        'timestamp': data.get('timestamp'),
+        'revit_user': data.get('revit_user'),
+        'script_name': data.get('script_name'),
+        'company_id': plugin_server.company_for_revit_user(data.get('revit_user'), computer_name),
+    }
+
+
+class Metrics:
+    """Compteurs et histogrammes de latence exposés au format Prometheus
+
+    Chaque processus agrège en mémoire (un verrou, quelques opérations de
+    dictionnaire par requête). Avec plusieurs workers (METRICS_DIR défini),
+    chaque processus publie périodiquement un instantané JSON dans ce
+    dossier et /metrics additionne les instantanés de tous les workers;
+    la jauge des requêtes en cours ne compte que les processus vivants.
+    """
+
+    LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, metrics_dir=None, flush_interval=1.0):
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}        # (route, method, status) -> nombre
+            self.latency = {}         # route -> [compteurs par bucket..., +Inf, somme]
+            self.response_bytes = {}  # route -> octets
+            self.plugin_downloads = {}  # (plugin, outcome) -> nombre
+            self.auth = {}            # (result, reason) -> nombre
+            self.response_cache = {}  # (route, outcome) -> nombre
+            self.in_flight = 0
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def observe_request(self, route, method, status, duration, nbytes):
+        index = bisect.bisect_left(self.LATENCY_BUCKETS, duration)
+        with self._lock:
+            key = (route, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            buckets = self.latency.get(route)
+            if buckets is None:
+                buckets = self.latency[route] = [0] * (len(self.LATENCY_BUCKETS) + 1) + [0.0]
+            buckets[index] += 1
+            buckets[-1] += duration
+            if nbytes:
+                self.response_bytes[route] = self.response_bytes.get(route, 0) + nbytes
+
+    def inc_plugin_download(self, plugin, outcome):
+        with self._lock:
+            key = (plugin, outcome)
+            self.plugin_downloads[key] = self.plugin_downloads.get(key, 0) + 1
+
+    def inc_auth(self, result, reason):
+        with self._lock:
+            key = (result, reason)
+            self.auth[key] = self.auth.get(key, 0) + 1
+
+    def inc_response_cache(self, route, outcome):
+        with self._lock:
+            key = (route, outcome)
+            self.response_cache[key] = self.response_cache.get(key, 0) + 1
+
+    # Agrégation multi-processus
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'requests': [list(k) + [v] for k, v in self.requests.items()],
+                'latency': {route: list(b) for route, b in self.latency.items()},
+                'response_bytes': dict(self.response_bytes),
+                'plugin_downloads': [list(k) + [v] for k, v in self.plugin_downloads.items()],
+                'auth': [list(k) + [v] for k, v in self.auth.items()],
+                'response_cache': [list(k) + [v] for k, v in self.response_cache.items()],
+                'in_flight': self.in_flight
+            }
 
+    def _snapshot_path(self, pid):
+        return os.path.join(self.metrics_dir, f'metrics_{pid}.json')
+
+    def flush(self):
+        """Publie l'instantané du processus (écriture temporaire + rename atomique)"""
+        if not self.metrics_dir:
+            return
+        path = self._snapshot_path(os.getpid())
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def ensure_flusher(self):
+        """Démarre (une fois par processus) le thread de publication des instantanés"""
+        if not self.metrics_dir or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except OSError as e:
+                    logger.warning(f"Publication des métriques impossible: {e}")
+
+        threading.Thread(target=run, name='metrics-flusher', daemon=True).start()
+
+    def collect(self):
+        """Instantanés de tous les processus (le processus courant en direct)"""
+        snapshots = {os.getpid(): self.snapshot()}
+        if self.metrics_dir and os.path.isdir(self.metrics_dir):
+            for file in os.listdir(self.metrics_dir):
+                if not (file.startswith('metrics_') and file.endswith('.json')):
+                    continue
+                try:
+                    with open(os.path.join(self.metrics_dir, file), encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                snapshots.setdefault(data.get('pid'), data)
+        return list(snapshots.values())
+
+    @staticmethod
+    def _pid_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def render(self, extra_gauges=None):
+        """Texte au format d'exposition Prometheus"""
+        requests, downloads, auth, response_cache = {}, {}, {}, {}
+        latency, response_bytes = {}, {}
+        in_flight = 0
+        for snap in self.collect():
+            for *labels, value in snap['requests']:
+                requests[tuple(labels)] = requests.get(tuple(labels), 0) + value
+            for *labels, value in snap['plugin_downloads']:
+                downloads[tuple(labels)] = downloads.get(tuple(labels), 0) + value
+            for *labels, value in snap['auth']:
+                auth[tuple(labels)] = auth.get(tuple(labels), 0) + value
+            for *labels, value in snap.get('response_cache', []):
+                response_cache[tuple(labels)] = response_cache.get(tuple(labels), 0) + value
+            for route, buckets in snap['latency'].items():
+                total = latency.setdefault(route, [0] * len(buckets))
+                for i, value in enumerate(buckets):
+                    total[i] += value
+            for route, value in snap['response_bytes'].items():
+                response_bytes[route] = response_bytes.get(route, 0) + value
+            if snap['pid'] == os.getpid() or self._pid_alive(snap['pid']):
+                in_flight += snap['in_flight']
+
+        def labels(**values):
+            return '{' + ','.join(f'{k}="{escape_label(v)}"' for k, v in values.items()) + '}'
+
+        prefix = 'plugin_server'
+        lines = [f'# HELP {prefix}_requests_total Requêtes HTTP par route, méthode et statut',
+                 f'# TYPE {prefix}_requests_total counter']
+        for (route, method, status), value in sorted(requests.items()):
+            lines.append(f'{prefix}_requests_total{labels(route=route, method=method, status=status)} {value}')
+
+        lines += [f'# HELP {prefix}_request_duration_seconds Latence des requêtes par route',
+                  f'# TYPE {prefix}_request_duration_seconds histogram']
+        for route, buckets in sorted(latency.items()):
+            cumulative = 0
+            for bound, count in zip(self.LATENCY_BUCKETS + ('+Inf',), buckets[:-1]):
+                cumulative += count
+                lines.append(f'{prefix}_request_duration_seconds_bucket{labels(route=route, le=bound)} {cumulative}')
+            lines.append(f'{prefix}_request_duration_seconds_sum{labels(route=route)} {buckets[-1]:.6f}')
+            lines.append(f'{prefix}_request_duration_seconds_count{labels(route=route)} {cumulative}')
+
+        lines += [f'# HELP {prefix}_response_bytes_total Octets envoyés par route',
+                  f'# TYPE {prefix}_response_bytes_total counter']
+        for route, value in sorted(response_bytes.items()):
+            lines.append(f'{prefix}_response_bytes_total{labels(route=route)} {value}')
+
+        lines += [f'# HELP {prefix}_requests_in_flight Requêtes en cours de traitement',
+                  f'# TYPE {prefix}_requests_in_flight gauge',
+                  f'{prefix}_requests_in_flight {in_flight}']
+
+        lines += [f'# HELP {prefix}_plugin_downloads_total Téléchargements par plugin',
+                  f'# TYPE {prefix}_plugin_downloads_total counter']
+        for (plugin, outcome), value in sorted(downloads.items()):
+            lines.append(f'{prefix}_plugin_downloads_total{labels(plugin=plugin, outcome=outcome)} {value}')
+
+        lines += [f'# HELP {prefix}_auth_total Authentifications par résultat et motif',
+                  f'# TYPE {prefix}_auth_total counter']
+        for (result, reason), value in sorted(auth.items()):
+            lines.append(f'{prefix}_auth_total{labels(result=result, reason=reason)} {value}')
+
+        lines += [f'# HELP {prefix}_response_cache_total Réponses JSON servies depuis le cache (hit) ou reconstruites (miss)',
+                  f'# TYPE {prefix}_response_cache_total counter']
+        for (route, outcome), value in sorted(response_cache.items()):
+            lines.append(f'{prefix}_response_cache_total{labels(route=route, outcome=outcome)} {value}')
+
+        for name, (help_text, value) in (extra_gauges or {}).items():
+            lines += [f'# HELP {prefix}_{name} {help_text}', f'# TYPE {prefix}_{name} gauge',
+                      f'{prefix}_{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    """Échappement d'une valeur de label Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class ResponseCache:
+    """Corps JSON pré-sérialisés des endpoints lus en boucle
+
+    La clé contient les générations (configuration, catalogue) dont dépend la
+    réponse: les mêmes octets sont servis jusqu'à ce que l'une change, et les
+    entrées périmées sortent du LRU, borné en octets. Le corps est stocké
+    ouvert (sans l'accolade finale) pour y ajouter les champs volatils de
+    chaque requête.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.resident_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, build):
+        """(corps ouvert, hit) pour key; build() produit le corps en cas d'absence"""
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return body, True
+        body = build()
+        with self._lock:
+            self.misses += 1
+            if len(body) > self.max_bytes:
+                return body, False
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.resident_bytes -= len(previous)
+            self._entries[key] = body
+            self.resident_bytes += len(body)
+            while self.resident_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.resident_bytes -= len(evicted)
+                self.evictions += 1
+        return body, False
+
+    def stats(self):
+        return {'entries': len(self._entries), 'resident_bytes': self.resident_bytes,
+                'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+def open_json(data):
+    """Objet JSON sérialisé sans son accolade fermante (corps de ResponseCache)"""
+    return json.dumps(data, sort_keys=True)[:-1].encode('utf-8')
+
+
+class CountingIterable:
+    """Enveloppe d'un corps de réponse streamé qui compte les octets envoyés"""
+
+    def __init__(self, iterable, on_close):
+        self._iterable = iterable
+        self._on_close = on_close
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self._iterable:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        if hasattr(self._iterable, 'close'):
+            self._iterable.close()
+        self._on_close(self.sent)
+
+
+class AuthThrottle:
+    """Délestage des échecs d'authentification
+
+    Trois token buckets sont débités à chaque échec: le couple (user_key,
+    api_key), le user_key et l'IP du client (budget propre, ip_burst et
+    ip_rate). Un couple épuisé reçoit 429 avant toute recherche dans la
+    configuration. Un user_key ou une IP épuisés ne refusent que les couples
+    jamais validés: les derniers couples authentifiés avec succès sont
+    mémorisés et passent toujours, si bien qu'une rafale de mauvaises clés
+    (un user_key se devine facilement) ou un balayage depuis le NAT d'un
+    bureau ne bloquent pas les utilisateurs légitimes. Les derniers couples
+    refusés sont mémorisés `negative_ttl` secondes (invalidés au changement
+    de configuration) et rejetés sans repasser par authenticate_user.
+    """
+
+    def __init__(self, burst=10, rate=0.5, ip_burst=200, ip_rate=10.0, negative_ttl=30.0, max_keys=100000):
+        self.burst = burst
+        self.rate = rate
+        self.ip_burst = ip_burst
+        self.ip_rate = ip_rate
+        self.negative_ttl = negative_ttl
+        self.max_keys = max_keys
+        self.throttled = 0
+        self.negative_hits = 0
+        self._buckets = OrderedDict()   # clé -> (jetons, instant)
+        self._negative = OrderedDict()  # (user_key, api_key) -> (expiration, génération, erreur)
+        self._known = OrderedDict()     # (user_key, api_key) authentifiés avec succès -> None
+        self._lock = threading.Lock()
+
+    def _budget(self, key):
+        """(rafale, recharge) du bucket selon le type de clé"""
+        if key[0] == 'ip':
+            return self.ip_burst, self.ip_rate
+        return self.burst, self.rate
+
+    def _tokens(self, key, now):
+        burst, rate = self._budget(key)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return burst
+        tokens, last = bucket
+        return min(burst, tokens + (now - last) * rate)
+
+    def retry_after(self, *keys):
+        """Secondes d'attente si l'une des clés est épuisée, sinon 0"""
+        if not self._buckets:
+            return 0
+        now = time.monotonic()
+        wait = 0
+        with self._lock:
+            for key in keys:
+                tokens = self._tokens(key, now)
+                if tokens < 1:
+                    wait = max(wait, math.ceil((1 - tokens) / self._budget(key)[1]))
+        if not wait:
+            return 0
+        self.throttled += 1
+        return max(1, wait)
+
+    def record_failure(self, *keys):
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                self._buckets[key] = (self._tokens(key, now) - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+    def cached_failure(self, user_key, api_key, generation):
+        """AuthenticationError mémorisée pour ce couple, ou None"""
+        entry = self._negative.get((user_key, api_key))
+        if entry is None:
+            return None
+        expires, entry_generation, error = entry
+        if entry_generation != generation or time.monotonic() > expires:
+            with self._lock:
+                self._negative.pop((user_key, api_key), None)
+            return None
+        self.negative_hits += 1
+        return error
+
+    def is_known(self, user_key, api_key):
+        """Couple déjà authentifié avec succès (non soumis aux budgets user_key et IP)"""
+        return (user_key, api_key) in self._known
+
+    def remember_success(self, user_key, api_key):
+        with self._lock:
+            self._known[(user_key, api_key)] = None
+            self._known.move_to_end((user_key, api_key))
+            while len(self._known) > self.max_keys:
+                self._known.popitem(last=False)
+
+    def remember_failure(self, user_key, api_key, generation, error):
+        with self._lock:
+            self._known.pop((user_key, api_key), None)
+            self._negative[(user_key, api_key)] = (time.monotonic() + self.negative_ttl, generation, error)
+            self._negative.move_to_end((user_key, api_key))
+            while len(self._negative) > self.max_keys:
+                self._negative.popitem(last=False)
+
+    def stats(self):
         return {
-            'total_companies': total_companies,
-            'active_companies': active_companies,
-            'total_users': total_users,
-            'active_users': active_users,
-            'total_plugins': len(self.list_disk_plugins())
+            'throttled': self.throttled,
+            'negative_cache_hits': self.negative_hits,
+            'tracked_clients': len(self._buckets),
+            'negative_cache_entries': len(self._negative),
+            'known_pairs': len(self._known),
+            'burst': self.burst,
+            'refill_per_second': self.rate,
+            'ip_burst': self.ip_burst,
+            'ip_refill_per_second': self.ip_rate,
+            'negative_ttl_seconds': self.negative_ttl
         }
 
 
 # IMPORTANT: Instance du serveur AVANT les routes
 plugin_server = PluginServer()
+if not CONFIG_WATCHER_POST_FORK:
+    plugin_server.start_config_watcher(CONFIG_RELOAD_INTERVAL)
+os.register_at_fork(after_in_child=plugin_server.restart_watcher_after_fork)
+
+execution_store = ExecutionStore(EXECUTIONS_DB) if EXECUTIONS_DB else None
+execution_tracker = ExecutionTracker(os.path.join(LOGS_DIR, 'script_executions.log'),
+                                     flush_records=EXECUTION_FLUSH_RECORDS,
+                                     flush_interval=EXECUTION_FLUSH_INTERVAL_MS / 1000,
+                                     store=execution_store)
+atexit.register(execution_tracker.stop)
+
+metrics = Metrics(METRICS_DIR)
+response_cache = ResponseCache(RESPONSE_CACHE_BYTES)
+
+# Secret de signature des jetons: à fixer en production (sinon aléatoire, partagé
+# entre workers uniquement grâce au préchargement gunicorn)
+if not SESSION_SECRET:
+    logger.warning("SESSION_SECRET non défini: secret de jetons aléatoire, propre à ce processus "
+                   "(jetons refusés par les autres workers/hôtes sans préchargement, invalidés au redémarrage)")
+session_serializer = URLSafeSerializer(SESSION_SECRET or secrets.token_hex(32), salt='session-token')
+
+auth_throttle = AuthThrottle(burst=AUTH_FAILURE_BURST, rate=AUTH_FAILURE_RATE,
+                             ip_burst=AUTH_IP_FAILURE_BURST, ip_rate=AUTH_IP_FAILURE_RATE,
+                             negative_ttl=AUTH_NEGATIVE_TTL)
+
+
+def throttled_response(retry_after):
+    """Réponse 429 minimale (aucun accès à la configuration)"""
+    metrics.inc_auth('failure', 'throttled')
+    response = jsonify({'error': 'Trop de tentatives échouées, réessayez plus tard'})
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def authenticate_request(allow_token=True):
+    """Authentification par autodesk_user + computer_name + api_key, ou jeton de session
+
+    Avec allow_token=False (émission de jeton), seuls les identifiants sont acceptés.
+    """
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        if not allow_token:
+            metrics.inc_auth('failure', 'token_not_allowed')
+            return None, jsonify({
+                'error': 'Jeton de session refusé: headers X-Autodesk-User, X-Computer-Name et X-API-Key requis'
+            }), 401
+        return authenticate_token_request(authorization[len('Bearer '):].strip())
 
-
-def authenticate_request():
-    """Authentification par autodesk_user + computer_name + api_key"""
     autodesk_user = request.headers.get('X-Autodesk-User')
     computer_name = request.headers.get('X-Computer-Name')
     api_key = request.headers.get('X-API-Key')
 
     if not autodesk_user or not computer_name or not api_key:
+        metrics.inc_auth('failure', 'missing_headers')
         return None, jsonify({
             'error': 'Headers X-Autodesk-User, X-Computer-Name et X-API-Key requis'
         }), 401
 
+    user_key = f"{autodesk_user}_{computer_name}"
+    g.user_key = user_key
+    client_key = ('ip', request.remote_addr)
+    pair_key = ('pair', user_key, api_key)
+    user_throttle_key = ('user', user_key)
+    failure_keys = (client_key, pair_key, user_throttle_key)
+
+    # Délestage par couple refusé avant toute recherche dans la configuration
+    retry_after = auth_throttle.retry_after(pair_key)
+    if retry_after:
+        return None, throttled_response(retry_after), 429
+
+    generation = plugin_server.config_generation
+    cached_error = auth_throttle.cached_failure(user_key, api_key, generation)
+    if cached_error is not None:
+        retry_after = auth_throttle.retry_after(client_key)
+        auth_throttle.record_failure(*failure_keys)
+        if retry_after:
+            return None, throttled_response(retry_after), 429
+        metrics.inc_auth('failure', cached_error.reason)
+        return None, jsonify({'error': str(cached_error)}), 403
+
+    # IP ou user_key épuisés: seuls les couples déjà validés atteignent la configuration
+    if not auth_throttle.is_known(user_key, api_key):
+        retry_after = auth_throttle.retry_after(client_key, user_throttle_key)
+        if retry_after:
+            return None, throttled_response(retry_after), 429
+
     try:
         auth_data = plugin_server.authenticate_user(autodesk_user, computer_name, api_key)
+        g.company_id = auth_data['company_id']
+        auth_throttle.remember_success(user_key, api_key)
+        metrics.inc_auth('success', 'ok')
         return auth_data, None, None
+    except AuthenticationError as e:
+        auth_throttle.record_failure(*failure_keys)
+        auth_throttle.remember_failure(user_key, api_key, generation, e)
+        metrics.inc_auth('failure', e.reason)
+        return None, jsonify({'error': str(e)}), 403
     except Exception as e:
+        metrics.inc_auth('failure', 'error')
         return None, jsonify({'error': str(e)}), 403
 
 
+def authenticate_token_request(token):
+    """Authentification par jeton de session (Authorization: Bearer)"""
+    client_key = ('ip', request.remote_addr)
+
+    # Vérification HMAC peu coûteuse: un jeton valide n'est jamais délesté
+    try:
+        auth_data = plugin_server.authenticate_token(token, session_serializer)
+    except AuthenticationError as e:
+        retry_after = auth_throttle.retry_after(client_key)
+        auth_throttle.record_failure(client_key)
+        if retry_after:
+            return None, throttled_response(retry_after), 429
+        metrics.inc_auth('failure', e.reason)
+        return None, jsonify({'error': str(e)}), 401
+
+    g.user_key = auth_data['user_key']
+    g.company_id = auth_data['company_id']
+    metrics.inc_auth('success', 'token')
+    return auth_data, None, None
+
+
+def authenticate_admin():
+    """Vérifie le header X-Admin-Key; retourne (erreur, code) ou (None, None)"""
+    if not ADMIN_API_KEY:
+        return jsonify({'error': 'API d\'administration désactivée'}), 403
+    client_key = ('admin', request.remote_addr)
+    retry_after = auth_throttle.retry_after(client_key)
+    if retry_after:
+        return throttled_response(retry_after), 429
+    if not hmac.compare_digest(request.headers.get('X-Admin-Key', ''), ADMIN_API_KEY):
+        auth_throttle.record_failure(client_key)
+        return jsonify({'error': 'Clé d\'administration invalide'}), 403
+    return None, None
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    metrics.ensure_flusher()
+    metrics.request_started()
+    g.in_flight = True
+
+
+@app.teardown_request
+def finish_request(exc):
+    if g.pop('in_flight', False):
+        metrics.request_finished()
+
+
+@app.after_request
+def log_access(response):
+    """Ligne d'accès structurée et métriques pour chaque requête"""
+    start = g.get('request_start')
+    duration = time.perf_counter() - start if start is not None else 0.0
+    duration_ms = round(duration * 1000, 2) if start is not None else None
+    route = request.url_rule.rule if request.url_rule is not None else request.path
+
+    # Label de route borné: les chemins inconnus sont regroupés
+    metrics_route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+    if response.is_streamed and not response.direct_passthrough:
+        # Corps streamé (SSE, archives): la requête reste en cours et sa latence
+        # court jusqu'à la fermeture du corps, pas jusqu'au premier octet
+        method, status = request.method, response.status_code
+        in_flight = g.pop('in_flight', False)
+
+        def finish_stream(sent):
+            if in_flight:
+                metrics.request_finished()
+            elapsed = time.perf_counter() - start if start is not None else 0.0
+            metrics.observe_request(metrics_route, method, status, elapsed, sent)
+
+        response.response = CountingIterable(response.response, finish_stream)
+    else:
+        metrics.observe_request(metrics_route, request.method, response.status_code, duration,
+                                response.content_length or 0)
+    logger.info(f"{request.method} {route} {response.status_code}", extra={
+        'route': route,
+        'method': request.method,
+        'status': response.status_code,
+        'duration_ms': duration_ms,
+        'user_key': g.get('user_key'),
+        'company_id': g.get('company_id'),
+        'plugin': g.get('plugin'),
+        'remote_addr': request.remote_addr
+    })
+    return response
+
+
+def cached_json_response(key, build, generation=None, **volatile):
+    """Réponse JSON servie depuis response_cache
+
+    La clé est complétée par la route et les générations courantes
+    (configuration, catalogue); build() produit le corps ouvert (open_json),
+    volatile les champs recalculés à chaque requête avec le timestamp.
+    Une réponse construite à partir de auth_data passe generation=
+    auth_data['generation']: une modification appliquée depuis
+    l'authentification ne range pas l'ancien corps sous la nouvelle génération.
+    """
+    # Réveille si besoin le rescan du catalogue (en arrière-plan, hors premier scan)
+    plugin_server.catalog.entries()
+    route = request.url_rule.rule
+    if generation is None:
+        generation = plugin_server.config_generation
+    body, hit = response_cache.get((route, generation, plugin_server.catalog_epoch) + key, build)
+    metrics.inc_response_cache(route, 'hit' if hit else 'miss')
+    tail = json.dumps(dict(volatile, timestamp=datetime.now().isoformat()), sort_keys=True)
+    return Response(body + b', ' + tail[1:].encode('utf-8') + b'\n', mimetype='application/json')
+
+
 @app.route('/')
 def home():
     """Page d'accueil"""
-    try:
-        stats = plugin_server.get_global_stats()
-        return {
+    def build():
+        return open_json({
             'service': 'Revit Plugins Server',
             'status': 'running',
-            'timestamp': datetime.now().isoformat(),
             'version': '4.0.0-companies',
             'features': ['company_management', 'individual_plugins', 'user_expiration'],
-            'statistics': stats,
+            'statistics': plugin_server.get_global_stats(),
             'endpoints': {
                 'get_plugin': '/api/get_plugin',
+                'resolve_plugin': '/api/resolve_plugin',
+                'get_plugin_bundle': '/api/get_plugin_bundle',
+                'events': '/api/events',
+                'plugin_object': '/objects/<sha256>',
                 'user_info': '/api/user_info',
                 'company_stats': '/api/company_stats',
+                'sync': '/api/sync',
                 'status': '/api/status'
             }
-        }
+        })
+
+    try:
+        return cached_json_response((), build)
     except Exception as e:
         logger.error(f"Erreur dans home(): {e}")
         return jsonify({
@@ -229,6 +3334,141 @@ def home():
         }), 500
 
 
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    """Liveness: le processus répond"""
+    return jsonify({'status': 'alive', 'pid': os.getpid()})
+
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    """Readiness: configuration chargée et caches préchauffés"""
+    ready = plugin_server.ready and plugin_server.config_generation > 0
+    return jsonify({
+        'status': 'ready' if ready else 'starting',
+        'config_generation': plugin_server.config_generation,
+        'catalog_generation': plugin_server.catalog.generation,
+        'pid': os.getpid()
+    }), 200 if ready else 503
+
+
+@app.route('/api/token', methods=['POST'])
+def issue_token():
+    """Échange les identifiants contre un jeton de session signé
+
+    Les autres routes acceptent ensuite 'Authorization: Bearer <jeton>' à la
+    place des headers X-Autodesk-User / X-Computer-Name / X-API-Key. Le jeton
+    cesse d'être valide si users.json change ou à l'expiration du compte. Un
+    jeton ne peut pas en obtenir un autre: sans les identifiants, la durée de
+    validité (SESSION_TOKEN_TTL) ne serait plus bornée.
+    """
+    auth_data, error_response, status_code = authenticate_request(allow_token=False)
+    if not auth_data:
+        return error_response, status_code
+
+    token, expires = plugin_server.issue_session_token(auth_data, session_serializer, SESSION_TOKEN_TTL)
+    return jsonify({
+        'success': True,
+        'token': token,
+        'token_type': 'Bearer',
+        'expires_at': datetime.fromtimestamp(expires).isoformat(),
+        'config_version': auth_data['version'],
+        'allowed_fingerprint': auth_data['record'].permissions.fingerprint
+    })
+
+
+# Champs publics d'un plugin, pour la projection fields=
+PLUGIN_FIELDS = ('name', 'type', 'size', 'sha256', 'modified', 'description', 'version',
+                 'entry_points', 'syntax_error')
+# Champs de la liste anonyme (/api/plugins): sans le hash, qui suffit à
+# télécharger le plugin par /objects/<sha256>
+ANONYMOUS_PLUGIN_FIELDS = tuple(field for field in PLUGIN_FIELDS if field != 'sha256')
+PLUGIN_PAGE_PARAMS = ('limit', 'cursor', 'prefix', 'modified_since', 'fields')
+
+
+def plugin_page_query(known_fields=PLUGIN_FIELDS):
+    """Paramètres de pagination d'une liste de plugins, None sans aucun d'eux
+
+    Sans paramètre, la réponse historique (liste complète) est conservée pour
+    les anciens clients. Lève ValueError si un paramètre est invalide ou si
+    fields demande un champ hors de known_fields.
+    """
+    args = request.args
+    if not any(param in args for param in PLUGIN_PAGE_PARAMS):
+        return None
+    fields = None
+    if args.get('fields'):
+        fields = tuple(dict.fromkeys(field for field in args['fields'].split(',') if field))
+        unknown = sorted(set(fields) - set(known_fields))
+        if unknown:
+            raise ValueError(f"fields inconnus: {', '.join(unknown)}")
+    modified_since = args.get('modified_since') or None
+    if modified_since is not None:
+        modified_since = datetime.fromisoformat(modified_since).timestamp()
+    return {
+        'prefix': args.get('prefix', ''),
+        'after': args.get('cursor') or None,
+        'modified_since': modified_since,
+        'limit': min(max(args.get('limit', PLUGIN_PAGE_SIZE, type=int), 1), MAX_PLUGIN_PAGE),
+        'fields': fields
+    }
+
+
+def anonymous_plugin_details(details):
+    """Détails d'un plugin sans son hash, pour les clients non authentifiés"""
+    return {key: value for key, value in details.items() if key != 'sha256'}
+
+
+def plugin_page_key(query):
+    """Clé de response_cache d'une requête normalisée par plugin_page_query
+
+    Les paramètres inconnus ou redondants de l'URL n'y figurent pas: ils ne
+    créent pas de nouvelles entrées dans le cache.
+    """
+    return None if query is None else tuple(sorted(query.items()))
+
+
+def plugin_page(query, allowed=None, anonymous=False):
+    """Page de détails de plugins selon plugin_page_query: (détails, curseur suivant)"""
+    fields = query['fields']
+    entries, next_cursor = plugin_server.catalog.page(query['prefix'], query['after'], query['modified_since'],
+                                                      query['limit'], allowed)
+    if fields is None:
+        if anonymous:
+            return [anonymous_plugin_details(entry.details) for entry in entries], next_cursor
+        return [entry.details for entry in entries], next_cursor
+    return [{field: entry.details.get(field) for field in fields} for entry in entries], next_cursor
+
+
+def plugin_response(entry, content):
+    """Réponse de téléchargement d'un plugin: conditionnelle (304), partielle (206) et négociée en encodage
+
+    ETag fort = hash du contenu (suffixé par l'encodage pour les variantes
+    compressées); content None (hors cache mémoire) = envoi direct du fichier.
+    """
+    if content is None:
+        # send_file gère Range / If-Range: reprise d'un téléchargement interrompu
+        response = send_file(entry.path, as_attachment=True, download_name=entry.filename,
+                             mimetype='application/zip' if entry.is_package else 'text/x-python',
+                             etag=entry.sha256, last_modified=entry.mtime)
+    else:
+        encoding = negotiate_encoding(request.accept_encodings)
+        data = content.variants.get(encoding) if encoding else None
+        if data is None:
+            encoding, data = None, content.raw
+        response = Response(data, mimetype='text/x-python')
+        response.headers['Content-Disposition'] = f'attachment; filename={entry.filename}'
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+            response.set_etag(f"{entry.sha256}-{encoding}")
+        else:
+            response.set_etag(entry.sha256)
+        response.last_modified = entry.mtime
+        response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+    response.vary.add('Accept-Encoding')
+    return response
+
+
 @app.route('/api/get_plugin', methods=['GET'])
 def get_plugin():
     """API pour récupérer un plugin"""
@@ -241,28 +3481,238 @@ def get_plugin():
         plugin_name = request.headers.get('X-Plugin-Name')
         if not plugin_name:
             return jsonify({'error': 'X-Plugin-Name requis'}), 400
+        g.plugin = plugin_name
 
         # Vérification des droits
         plugin_server.check_plugin_access(auth_data, plugin_name)
 
-        # Lecture et envoi du fichier
-        file_path = os.path.join(PLUGINS_DIR, f"{plugin_name}.py")
-        if not os.path.exists(file_path):
+        # Recherche dans le catalogue (pas d'accès disque si absent)
+        entry = plugin_server.catalog.get(plugin_name)
+        if entry is None:
             return jsonify({'error': f'Plugin {plugin_name} introuvable'}), 404
 
         user_info = auth_data['user']
         company_info = auth_data['company']
 
-        logger.info(f"Plugin {plugin_name} téléchargé par {user_info['name']} "
-                    f"({company_info['name']})")
+        # Contenu servi depuis le cache mémoire; au-delà du budget, envoi direct du fichier
+        try:
+            try:
+                content = plugin_server.content_cache.get(entry)
+            except StalePluginError:
+                # Fichier modifié depuis le scan: attente du rescan du catalogue
+                plugin_server.catalog.rescan()
+                entry = plugin_server.catalog.get(plugin_name)
+                if entry is None:
+                    return jsonify({'error': f'Plugin {plugin_name} introuvable'}), 404
+                content = plugin_server.content_cache.get(entry)
+
+            response = plugin_response(entry, content)
+        except (FileNotFoundError, StalePluginError):
+            plugin_server.catalog.invalidate()
+            return jsonify({'error': f'Plugin {plugin_name} introuvable'}), 404
+
+        metrics.inc_plugin_download(entry.name, 'not_modified' if response.status_code == 304 else 'downloaded')
+        if response.status_code == 304:
+            logger.info(f"Plugin {plugin_name} inchangé pour {user_info['name']} "
+                        f"({company_info['name']})")
+        else:
+            logger.info(f"Plugin {plugin_name} téléchargé par {user_info['name']} "
+                        f"({company_info['name']})")
 
-        return send_file(file_path, as_attachment=True)
+        return response
 
     except Exception as e:
         logger.error(f"Erreur get_plugin: {e}")
         return jsonify({'error': str(e)}), 403
 
 
+@app.route('/api/resolve_plugin', methods=['GET'])
+def resolve_plugin():
+    """Hash de la version courante d'un plugin autorisé (header X-Plugin-Name)
+
+    Le contenu se télécharge ensuite sans authentification sur l'URL
+    immuable /objects/<sha256>, que les caches intermédiaires peuvent servir.
+    """
+    auth_data, error_response, status_code = authenticate_request()
+    if not auth_data:
+        return error_response, status_code
+
+    plugin_name = request.headers.get('X-Plugin-Name')
+    if not plugin_name:
+        return jsonify({'error': 'X-Plugin-Name requis'}), 400
+    g.plugin = plugin_name
+    try:
+        plugin_server.check_plugin_access(auth_data, plugin_name)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 403
+
+    entry = plugin_server.catalog.get(plugin_name)
+    if entry is None:
+        return jsonify({'error': f'Plugin {plugin_name} introuvable'}), 404
+    return jsonify({
+        'success': True,
+        'name': entry.name,
+        'sha256': entry.sha256,
+        'size': entry.size,
+        'url': f'/objects/{entry.sha256}'
+    })
+
+
+@app.route('/objects/<sha256>', methods=['GET'])
+def get_plugin_object(sha256):
+    """Téléchargement d'une version de plugin par son hash (sans authentification)
+
+    Le contenu d'un hash ne change jamais: réponse cacheable un an
+    (Cache-Control immutable), y compris par un proxy partagé. Les versions
+    précédentes suivent la rétention du stockage (PLUGIN_OBJECTS_KEEP_VERSIONS,
+    PLUGIN_OBJECTS_RETENTION_DAYS); celles d'un plugin retiré répondent 404.
+    """
+    entry = plugin_server.catalog.get_by_hash(sha256)
+    content = None
+    if entry is not None:
+        try:
+            content = plugin_server.content_cache.get(entry)
+        except (OSError, StalePluginError):
+            # Fichier modifié depuis le scan: la copie du stockage par hash fait foi
+            plugin_server.catalog.invalidate()
+            entry = None
+
+    if content is not None:
+        response = plugin_response(entry, content)
+    else:
+        path = plugin_server.objects.find(sha256)
+        if path is None:
+            return jsonify({'error': 'Version de plugin introuvable'}), 404
+        response = send_file(path, mimetype=plugin_server.objects.mimetype(path), etag=sha256)
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+
+    g.plugin = entry.name if entry is not None else sha256[:12]
+    metrics.inc_plugin_download(entry.name if entry is not None else '_previous',
+                                'not_modified' if response.status_code == 304 else 'downloaded')
+    return response
+
+
+@app.route('/api/get_plugin_bundle', methods=['GET'])
+def get_plugin_bundle():
+    """Plugin (header X-Plugin-Name) et ses dépendances transitives en une archive zip
+
+    Les dépendances sont les autres plugins importés, limitées aux droits de
+    l'utilisateur (les refusées sont listées dans bundle_manifest.json avec
+    l'ordre de chargement). 422 si un plugin de l'ensemble ne compile pas.
+    """
+    auth_data, error_response, status_code = authenticate_request()
+    if not auth_data:
+        return error_response, status_code
+
+    plugin_name = request.headers.get('X-Plugin-Name')
+    if not plugin_name:
+        return jsonify({'error': 'X-Plugin-Name requis'}), 400
+    g.plugin = plugin_name
+    # Droits vérifiés avant l'existence: pas de sondage des noms de plugins
+    try:
+        plugin_server.check_plugin_access(auth_data, plugin_name)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 403
+    if plugin_server.catalog.get(plugin_name) is None:
+        return jsonify({'error': f'Plugin {plugin_name} introuvable'}), 404
+
+    try:
+        entries, graph, denied = plugin_server.resolve_plugin_closure(auth_data, plugin_name)
+    except (OSError, StalePluginError):
+        plugin_server.catalog.invalidate()
+        return jsonify({'error': f'Plugin {plugin_name} introuvable'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 403
+
+    broken = {entry.name: entry.manifest['syntax_error'] for entry in entries if entry.manifest['syntax_error']}
+    if broken:
+        return jsonify({'error': 'Plugin invalide (erreur de syntaxe)', 'syntax_errors': broken}), 422
+
+    bundle_manifest = {
+        'plugin': plugin_name,
+        'plugins': {entry.name: entry.sha256 for entry in entries},
+        'load_order': [entry.name for entry in entries],
+        'dependencies': graph,
+        'denied': denied,
+        'timestamp': datetime.now().isoformat()
+    }
+    for entry in entries:
+        metrics.inc_plugin_download(entry.name, 'bundled')
+    logger.info(f"Plugin {plugin_name} et {len(entries) - 1} dépendances envoyés à "
+                f"{auth_data['user']['name']} ({auth_data['company']['name']})")
+    return Response(stream_plugin_archive(entries, bundle_manifest, manifest_name='bundle_manifest.json'),
+                    mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename={plugin_name}_bundle.zip'})
+
+
+@app.route('/api/events', methods=['GET'])
+def plugin_events():
+    """Flux Server-Sent Events des changements de plugins et de droits de l'utilisateur
+
+    Remplace le polling de /api/user_info: l'authentification n'a lieu qu'à
+    la connexion. Reprise après coupure avec le header Last-Event-ID.
+    """
+    auth_data, error_response, status_code = authenticate_request()
+    if not auth_data:
+        return error_response, status_code
+    if not plugin_server.events.open_stream():
+        response = jsonify({'error': 'Trop de flux ouverts, réessayer plus tard'})
+        response.headers['Retry-After'] = str(int(SSE_HEARTBEAT))
+        return response, 503
+
+    # Le catalogue doit avoir été scanné au moins une fois (état de référence)
+    plugin_server.catalog.entries()
+    stream = stream_plugin_events(plugin_server, auth_data['record'],
+                                  request.headers.get('Last-Event-ID'), SSE_HEARTBEAT)
+    # close() est appelé par le serveur WSGI même si le flux n'a jamais démarré
+    stream = CountingIterable(stream, lambda sent: plugin_server.events.close_stream())
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/sync', methods=['POST'])
+def sync_plugins():
+    """Synchronisation groupée: renvoie en une archive les plugins nouveaux ou modifiés
+
+    Corps attendu: {"manifest": {"nom_plugin": "sha256", ...}}. L'archive
+    contient sync_manifest.json (hashes à jour + plugins à supprimer) puis
+    les fichiers <nom>.py. 204 si le client est déjà à jour.
+    """
+    auth_data, error_response, status_code = authenticate_request()
+    if not auth_data:
+        return error_response, status_code
+
+    try:
+        data = request.get_json(silent=True) or {}
+        manifest = data.get('manifest', {})
+        if not isinstance(manifest, dict) or not all(
+                isinstance(k, str) and isinstance(v, str) for k, v in manifest.items()):
+            return jsonify({'error': 'manifest doit être un objet {nom: hash}'}), 400
+
+        changed, removed = plugin_server.compute_sync_delta(auth_data, manifest)
+
+        user_info = auth_data['user']
+        company_info = auth_data['company']
+        logger.info(f"Synchronisation pour {user_info['name']} ({company_info['name']}): "
+                    f"{len(changed)} plugins à jour, {len(removed)} à supprimer")
+
+        if not changed and not removed:
+            return '', 204
+
+        sync_manifest = {
+            'plugins': {entry.name: entry.sha256 for entry in changed},
+            'removed': removed,
+            'timestamp': datetime.now().isoformat()
+        }
+        return Response(stream_plugin_archive(changed, sync_manifest), mimetype='application/zip',
+                        headers={'Content-Disposition': 'attachment; filename=plugins_sync.zip'})
+
+    except Exception as e:
+        logger.error(f"Erreur sync: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
+
+
 @app.route('/api/user_info', methods=['GET'])
 def get_user_info():
     """Informations complètes de l'utilisateur"""
@@ -271,17 +3721,14 @@ def get_user_info():
         return error_response, status_code
 
     try:
+        query = plugin_page_query()
+    except ValueError as e:
+        return jsonify({'error': f'Paramètre invalide: {e}'}), 400
+
+    def build():
         user = auth_data['user']
         company = auth_data['company']
-
-        # Plugins autorisés
-        allowed_plugin_names = plugin_server.get_user_allowed_plugins(auth_data)
-
-        # Détails des plugins
-        all_disk_plugins = plugin_server.list_disk_plugins()
-        user_plugins = [p for p in all_disk_plugins if p['name'] in allowed_plugin_names]
-
-        return jsonify({
+        result = {
             'success': True,
             'user': {
                 'name': user['name'],
@@ -294,12 +3741,26 @@ def get_user_info():
             'company': {
                 'name': company['name'],
                 'created_at': company.get('created_at')
-            },
-            'plugins_details': user_plugins,
-            'total_plugins': len(user_plugins),
-            'timestamp': datetime.now().isoformat()
-        })
+            }
+        }
+
+        # Page demandée, filtrée sur les plugins autorisés
+        if query is not None:
+            permissions = auth_data['record'].permissions
+            user_plugins, next_cursor = plugin_page(query, None if permissions.wildcard else permissions.allowed)
+            # total_plugins garde son sens historique: tous les plugins autorisés, pas la page
+            total_plugins = len(plugin_server.allowed_entries(auth_data)[0])
+            return open_json(dict(result, plugins_details=user_plugins, total_plugins=total_plugins,
+                                  next_cursor=next_cursor))
+
+        # Liste complète (anciens clients): fragment JSON partagé par les utilisateurs de mêmes droits
+        entries, fragment = plugin_server.allowed_entries(auth_data)
+        result['total_plugins'] = len(entries)
+        return open_json(result) + b', "plugins_details": ' + fragment.encode('utf-8')
 
+    try:
+        return cached_json_response((auth_data['user_key'], plugin_page_key(query)), build,
+                                    generation=auth_data['generation'])
     except Exception as e:
         logger.error(f"Erreur user_info: {e}")
         return jsonify({'error': 'Erreur interne du serveur'}), 500
@@ -329,15 +3790,34 @@ def get_company_stats():
 
 @app.route('/api/plugins', methods=['GET'])
 def list_plugins():
-    """Liste tous les plugins disponibles sur le serveur"""
+    """Liste des plugins disponibles sur le serveur
+
+    Paramètres optionnels: limit, cursor (next_cursor de la page précédente),
+    prefix, modified_since (ISO 8601) et fields (liste séparée par des
+    virgules). Sans eux, la liste complète est renvoyée. Route anonyme: les
+    hash (sha256) ne sont donnés qu'aux clients authentifiés (user_info).
+    """
     try:
-        plugins = plugin_server.list_disk_plugins()
-        return jsonify({
+        query = plugin_page_query(ANONYMOUS_PLUGIN_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': f'Paramètre invalide: {e}'}), 400
+
+    def build():
+        if query is None:
+            plugins = [anonymous_plugin_details(details) for details in plugin_server.list_disk_plugins()]
+            paging = {}
+        else:
+            plugins, next_cursor = plugin_page(query, anonymous=True)
+            paging = {'next_cursor': next_cursor}
+        return open_json({
             'success': True,
             'plugins': plugins,
             'plugin_count': len(plugins),
-            'timestamp': datetime.now().isoformat()
+            **paging
         })
+
+    try:
+        return cached_json_response((plugin_page_key(query),), build)
     except Exception as e:
         logger.error(f"Erreur list_plugins: {e}")
         return jsonify({'error': 'Erreur interne du serveur'}), 500
@@ -345,17 +3825,36 @@ def list_plugins():
 
 @app.route('/api/status', methods=['GET'])
 def status():
-    """Health check avec statistiques"""
-    try:
-        stats = plugin_server.get_global_stats()
-        return jsonify({
+    """Health check avec statistiques
+
+    La partie liée à la configuration et au catalogue vient du cache de
+    réponses; les compteurs vivants sont relus à chaque requête.
+    """
+    def build():
+        return open_json({
             'status': 'OK',
             'version': '4.0.0-companies',
-            'statistics': stats,
+            'statistics': plugin_server.get_global_stats(),
+            'user_store': plugin_server.user_store.name,
+            'config': {
+                'generation': plugin_server.config_generation,
+                'version': plugin_server.config_version,
+                'loaded_at': plugin_server.config_loaded_at.isoformat()
+            }
+        })
+
+    try:
+        return cached_json_response((), build, **{
             'config_files': {
                 'users_json': os.path.exists(plugin_server.users_file)
             },
-            'timestamp': datetime.now().isoformat()
+            'plugin_cache': plugin_server.content_cache.stats(),
+            'plugin_manifests': plugin_server.manifests.stats(),
+            'permission_sets': PermissionSet.interned_count(),
+            'events': plugin_server.events.stats(),
+            'execution_tracking': execution_tracker.stats(),
+            'auth_throttle': auth_throttle.stats(),
+            'response_cache': response_cache.stats()
         })
     except Exception as e:
         logger.error(f"Erreur status: {e}")
@@ -368,36 +3867,200 @@ def track_execution():
 
     try:
         data = request.get_json()
-        print(f"📦 DEBUG: Données reçues: {data}")
+        execution_tracker.submit([execution_record(data, request.headers.get('X-Computer-Name'))])
+        logger.debug(f"Script execution tracked: {data.get('script_name')} by {data.get('revit_user')}")
 
-        log_entry = {
-            'timestamp': data.get('timestamp'),
-            'revit_user': data.get('revit_user'),
-            'script_name': data.get('script_name'),
-        }
+        return jsonify({'status': 'logged'}), 200
 
-        # Sauvegarder dans un fichier de logs
-        log_file = os.path.join(LOGS_DIR, 'script_executions.log')
-        print(f"📁 DEBUG: Fichier de log: {log_file}")
+    except Exception as e:
+        # Même en cas d'erreur serveur, retourner 200 pour ne pas bloquer le client
+        logger.error(f"Error tracking execution: {e}")
+        return jsonify({'status': 'error'}), 200
 
-        with open(log_file, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(log_entry) + '\n')
 
-        logger.info(f"Script execution tracked: {data.get('script_name')} by {data.get('revit_user')}")
-        print("✅ DEBUG: Log écrit avec succès")
+@app.route('/api/track_executions', methods=['POST'])
+def track_executions():
+    """Tracking groupé: liste d'exécutions bufferisées côté client
 
-        return jsonify({'status': 'logged'}), 200
+    Corps attendu: {"events": [{...}, ...]} ou directement la liste.
+    """
+    try:
+        data = request.get_json()
+        events = data.get('events') if isinstance(data, dict) else data
+        if not isinstance(events, list) or not all(isinstance(e, dict) for e in events):
+            return jsonify({'status': 'error', 'error': 'events doit être une liste d\'objets'}), 400
+        if len(events) > MAX_EXECUTION_BATCH:
+            return jsonify({'status': 'error',
+                            'error': f'{MAX_EXECUTION_BATCH} événements maximum par requête'}), 413
 
-    except Exception as e:
-        print(f"💥 DEBUG: Erreur dans track_execution: {e}")
-        import traceback
-        print(f"🔍 DEBUG: Traceback: {traceback.format_exc()}")
+        computer_name = request.headers.get('X-Computer-Name')
+        accepted = execution_tracker.submit([execution_record(e, computer_name) for e in events])
+        logger.debug(f"{accepted} script executions tracked")
 
-        # Même en cas d'erreur serveur, retourner 200 pour ne pas bloquer le client
-        logger.error(f"Error tracking execution: {e}")
+        return jsonify({'status': 'logged', 'count': accepted}), 200
+
+    except Exception as e:
+        logger.error(f"Error tracking executions: {e}")
         return jsonify({'status': 'error'}), 200
 
 
+@app.route('/api/executions/stats', methods=['GET'])
+def execution_stats():
+    """Statistiques d'exécution des scripts sur une période (administration)
+
+    Paramètres: from, to (ISO 8601), script_name, revit_user, company_id,
+    group_by (script | user | company) et limit pour un top-N.
+    """
+    error_response, status_code = authenticate_admin()
+    if error_response:
+        return error_response, status_code
+    if execution_store is None:
+        return jsonify({'error': 'Historique des exécutions désactivé'}), 404
+
+    try:
+        args = request.args
+        start, end = args.get('from'), args.get('to')
+        filters = {column: args.get(column) for column in ExecutionStore.FILTER_COLUMNS}
+        group_by = args.get('group_by')
+        if group_by and group_by not in ExecutionStore.GROUP_COLUMNS:
+            return jsonify({'error': f'group_by invalide: {group_by}'}), 400
+        limit = min(max(args.get('limit', 10, type=int), 1), 1000)
+
+        result = {
+            'success': True,
+            'from': start,
+            'to': end,
+            'filters': {k: v for k, v in filters.items() if v},
+            'total_executions': execution_store.count(start, end, filters),
+            'timestamp': datetime.now().isoformat()
+        }
+        if group_by:
+            result['group_by'] = group_by
+            result['breakdown'] = execution_store.breakdown(group_by, start, end, filters, limit)
+        return jsonify(result)
+
+    except ValueError as e:
+        return jsonify({'error': f'Date invalide: {e}'}), 400
+    except Exception as e:
+        logger.error(f"Erreur execution_stats: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
+
+
+def apply_admin_change(change, status=200):
+    """Applique une modification d'administration et construit la réponse JSON"""
+    try:
+        snapshot = plugin_server.apply_change(change)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Erreur modification {change['op']} {change['company_id']}: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
+
+    company = snapshot.company(change['company_id'])
+    result = {
+        'success': True,
+        'company_id': change['company_id'],
+        'config_generation': snapshot.generation,
+        'config_version': snapshot.version,
+        'timestamp': datetime.now().isoformat()
+    }
+    if change['op'] == 'user':
+        result['user_key'] = change['user_key']
+        result['user'] = company['users'][change['user_key']]
+    else:
+        result['company'] = {k: v for k, v in company.items() if k != 'users'}
+    return jsonify(result), status
+
+
+def admin_fields():
+    """Corps JSON de la requête (objet de champs), ou None si invalide"""
+    fields = request.get_json(silent=True)
+    return fields if isinstance(fields, dict) else None
+
+
+@app.route('/api/admin/companies/<company_id>', methods=['PUT'])
+def admin_put_company(company_id):
+    """Crée ou modifie une entreprise (champs fournis uniquement, hors utilisateurs)"""
+    error_response, status_code = authenticate_admin()
+    if error_response:
+        return error_response, status_code
+    fields = admin_fields()
+    if fields is None:
+        return jsonify({'error': 'Corps JSON (objet) requis'}), 400
+
+    created = plugin_server.get_company(company_id) is None
+    return apply_admin_change({'op': 'company', 'company_id': company_id, 'fields': fields},
+                              201 if created else 200)
+
+
+@app.route('/api/admin/companies/<company_id>', methods=['DELETE'])
+def admin_deactivate_company(company_id):
+    """Désactive une entreprise (conservée dans users.json)"""
+    error_response, status_code = authenticate_admin()
+    if error_response:
+        return error_response, status_code
+    if plugin_server.get_company(company_id) is None:
+        return jsonify({'error': 'Entreprise non trouvée'}), 404
+    return apply_admin_change({'op': 'company', 'company_id': company_id, 'fields': {'active': False}})
+
+
+@app.route('/api/admin/companies/<company_id>/users/<user_key>', methods=['PUT'])
+def admin_put_user(company_id, user_key):
+    """Crée ou modifie un utilisateur; une API key est générée à la création si absente"""
+    error_response, status_code = authenticate_admin()
+    if error_response:
+        return error_response, status_code
+    fields = admin_fields()
+    if fields is None:
+        return jsonify({'error': 'Corps JSON (objet) requis'}), 400
+
+    company = plugin_server.get_company(company_id)
+    created = company is None or user_key not in company.get('users', {})
+    if created and 'api_key' not in fields:
+        fields = dict(fields, api_key=secrets.token_urlsafe(24))
+    return apply_admin_change({'op': 'user', 'company_id': company_id, 'user_key': user_key, 'fields': fields},
+                              201 if created else 200)
+
+
+@app.route('/api/admin/companies/<company_id>/users/<user_key>', methods=['DELETE'])
+def admin_deactivate_user(company_id, user_key):
+    """Désactive un utilisateur"""
+    error_response, status_code = authenticate_admin()
+    if error_response:
+        return error_response, status_code
+    company = plugin_server.get_company(company_id)
+    if company is None or user_key not in company.get('users', {}):
+        return jsonify({'error': 'Utilisateur non trouvé'}), 404
+    return apply_admin_change({'op': 'user', 'company_id': company_id, 'user_key': user_key,
+                               'fields': {'active': False}})
+
+
+@app.route('/api/admin/companies/<company_id>/users/<user_key>/rotate_key', methods=['POST'])
+def admin_rotate_key(company_id, user_key):
+    """Remplace l'API key d'un utilisateur (l'ancienne est refusée immédiatement)"""
+    error_response, status_code = authenticate_admin()
+    if error_response:
+        return error_response, status_code
+    company = plugin_server.get_company(company_id)
+    if company is None or user_key not in company.get('users', {}):
+        return jsonify({'error': 'Utilisateur non trouvé'}), 404
+    return apply_admin_change({'op': 'user', 'company_id': company_id, 'user_key': user_key,
+                               'fields': {'api_key': secrets.token_urlsafe(24)}})
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Métriques au format texte Prometheus (agrégées sur tous les workers)"""
+    cache_stats = plugin_server.content_cache.stats()
+    body = metrics.render({
+        'config_generation': ('Génération de la configuration users.json', plugin_server.config_generation),
+        'catalog_generation': ('Génération du catalogue de plugins', plugin_server.catalog.generation),
+        'catalog_plugins': ('Plugins au catalogue', len(plugin_server.catalog.entries())),
+        'plugin_cache_resident_bytes': ('Octets en cache mémoire (ce processus)', cache_stats['resident_bytes']),
+    })
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
 # Gestion des erreurs globales
 @app.errorhandler(404)
 def not_found(e):
@@ -418,6 +4081,9 @@ if __name__ == '__main__':
     print("🏢 Gestion des entreprises activée")
     print("🔐 Authentification: autodesk_user + computer_name + api_key")
     print("👥 Permissions individuelles par utilisateur")
+    print("🏭 Production: gunicorn -c gunicorn_config.py wsgi:application")
+
+    plugin_server.warm_up()
 
     # Développement seulement
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,571 @@
+# benchmark.py - Benchmarks reproductibles du serveur de plugins
+#
+# Génère des jeux de données synthétiques (users.json + dossier de plugins),
+# exécute chaque route de app.py via le client de test Flask et via un vrai
+# serveur WSGI local, puis sauvegarde débit et latences p50/p95/p99 en JSON.
+#
+#   python benchmark.py                                # scénarios par défaut
+#   python benchmark.py --users 10,1000 --plugins 10 --requests 200
+#   python benchmark.py --compare bench_results_abc123.json
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import http.client
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ADMIN_KEY = 'benchmark-admin-key'
+SEED = 42
+EVENT_STREAM = 'text/event-stream'
+
+
+# ---------------------------------------------------------------------------
+# Génération des données synthétiques
+# ---------------------------------------------------------------------------
+
+def generate_plugin_source(index, rng):
+    """Source Python synthétique d'un plugin (quelques Ko)"""
+    lines = [
+        '# -*- coding: utf-8 -*-',
+        f'"""Plugin synthétique {index} - généré pour les benchmarks"""',
+        '',
+        'from datetime import datetime',
+        '',
+    ]
+    for f in range(rng.randint(5, 40)):
+        lines += [
+            f'def function_{f}(value):',
+            f'    """Fonction {f} du plugin {index}"""',
+            f'    result = value * {rng.randint(1, 100)} + {rng.randint(1, 100)}',
+            f'    return {{"plugin": {index}, "function": {f}, "result": result}}',
+            '',
+        ]
+    lines += ['', 'def main():', '    return function_0(datetime.now().second)', '']
+    return '\n'.join(lines)
+
+
+def generate_dataset(target_dir, n_users, n_plugins, users_per_company=50, seed=SEED):
+    """Crée config/users.json, plugins/ et logs/ dans target_dir
+
+    Les permissions sont tirées d'un petit nombre de profils partagés (comme
+    en production) avec 10% d'utilisateurs en wildcard. Retourne un
+    échantillon d'identifiants utilisables par le benchmark.
+    """
+    rng = random.Random(seed)
+    plugins_dir = os.path.join(target_dir, 'plugins')
+    config_dir = os.path.join(target_dir, 'config')
+    logs_dir = os.path.join(target_dir, 'logs')
+    for directory in (plugins_dir, config_dir, logs_dir):
+        os.makedirs(directory, exist_ok=True)
+
+    plugin_names = [f'plugin_{i:05d}' for i in range(n_plugins)]
+    object_hashes = []
+    for i, name in enumerate(plugin_names):
+        source = generate_plugin_source(i, rng).encode('utf-8')
+        with open(os.path.join(plugins_dir, f'{name}.py'), 'wb') as f:
+            f.write(source)
+        object_hashes.append(hashlib.sha256(source).hexdigest())
+
+    profiles = [sorted(rng.sample(plugin_names, min(len(plugin_names), rng.randint(1, 20))))
+                for _ in range(20)]
+
+    companies = {}
+    samples = []
+    for u in range(n_users):
+        company_id = f'company_{u // users_per_company:05d}'
+        company = companies.setdefault(company_id, {
+            'name': f'Company {u // users_per_company}',
+            'active': True,
+            'created_at': '2025-01-01T00:00:00',
+            'users': {}
+        })
+        autodesk_user = f'user.{u:06d}'
+        computer_name = f'PC-{u:06d}'
+        allowed = ['*'] if rng.random() < 0.1 else rng.choice(profiles)
+        user = {
+            'name': f'User {u}',
+            'autodesk_user': autodesk_user,
+            'computer_name': computer_name,
+            'email': f'user{u}@example.com',
+            'api_key': f'key-{u:06d}',
+            'active': rng.random() > 0.05,
+            'allowed_plugins': allowed,
+            'expires': rng.choice(['2099-12-31', '2099-06-30', '2020-01-01', None])
+        }
+        company['users'][f'{autodesk_user}_{computer_name}'] = user
+        if user['active'] and user['expires'] != '2020-01-01' and len(samples) < 200:
+            samples.append({
+                'autodesk_user': autodesk_user,
+                'computer_name': computer_name,
+                'api_key': user['api_key'],
+                'allowed_plugins': plugin_names if allowed == ['*'] else allowed,
+                'company_id': company_id
+            })
+
+    with open(os.path.join(config_dir, 'users.json'), 'w', encoding='utf-8') as f:
+        json.dump({'companies': companies}, f)
+    with open(os.path.join(target_dir, 'benchmark_samples.json'), 'w', encoding='utf-8') as f:
+        json.dump(samples, f)
+    # URLs immuables /objects/<sha256> des plugins
+    with open(os.path.join(target_dir, 'benchmark_objects.json'), 'w', encoding='utf-8') as f:
+        json.dump(object_hashes, f)
+    return samples
+
+
+# ---------------------------------------------------------------------------
+# Requêtes par route
+# ---------------------------------------------------------------------------
+
+def auth_headers(sample):
+    return {
+        'X-Autodesk-User': sample['autodesk_user'],
+        'X-Computer-Name': sample['computer_name'],
+        'X-API-Key': sample['api_key']
+    }
+
+
+def build_requests(samples, rng, object_hashes):
+    """Générateurs de requêtes {nom: fonction -> (méthode, url, headers, corps JSON)}"""
+
+    def user():
+        return rng.choice(samples)
+
+    def get_plugin():
+        sample = user()
+        headers = auth_headers(sample)
+        headers['X-Plugin-Name'] = rng.choice(sample['allowed_plugins'])
+        return 'GET', '/api/get_plugin', headers, None
+
+    def resolve_plugin():
+        method, url, headers, body = get_plugin()
+        return method, '/api/resolve_plugin', headers, body
+
+    def get_plugin_bundle():
+        method, url, headers, body = get_plugin()
+        return method, '/api/get_plugin_bundle', headers, body
+
+    def get_plugin_gzip():
+        method, url, headers, body = get_plugin()
+        headers['Accept-Encoding'] = 'gzip'
+        return method, url, headers, body
+
+    def track_execution():
+        return 'POST', '/api/track_execution', {}, {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revit_user': user()['autodesk_user'],
+            'script_name': f'script_{rng.randint(0, 50)}'
+        }
+
+    def track_executions():
+        sample = user()
+        return 'POST', '/api/track_executions', {}, {'events': [{
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revit_user': sample['autodesk_user'],
+            'script_name': f'script_{rng.randint(0, 50)}'
+        } for _ in range(50)]}
+
+    # Écritures d'administration sur des entreprises et utilisateurs dédiés:
+    # les identifiants des échantillons restent valides
+    admin = {'X-Admin-Key': ADMIN_KEY}
+    scratch_users = 20
+    company_counter, user_counter, rotate_counter, delete_counter, company_delete_counter = (
+        itertools.count() for _ in range(5))
+
+    def scratch_user_url(index):
+        return f'/api/admin/companies/bench_scratch_0/users/scratch.{index}_PC-SCRATCH'
+
+    def admin_put_company():
+        return 'PUT', f'/api/admin/companies/bench_scratch_{next(company_counter) % 10}', admin, {
+            'name': 'Scratch company', 'active': True}
+
+    def admin_put_user():
+        index = next(user_counter) % scratch_users
+        return 'PUT', scratch_user_url(index), admin, {
+            'name': f'Scratch {index}', 'email': f'scratch{index}@example.com',
+            'autodesk_user': f'scratch.{index}', 'computer_name': 'PC-SCRATCH',
+            'active': True, 'allowed_plugins': rng.choice(samples)['allowed_plugins'][:5]}
+
+    def admin_rotate_key():
+        return 'POST', scratch_user_url(next(rotate_counter) % scratch_users) + '/rotate_key', admin, None
+
+    def admin_deactivate_user():
+        return 'DELETE', scratch_user_url(next(delete_counter) % scratch_users), admin, None
+
+    def admin_deactivate_company():
+        return 'DELETE', f'/api/admin/companies/bench_scratch_{next(company_delete_counter) % 10}', admin, None
+
+    return {
+        'home': lambda: ('GET', '/', {}, None),
+        'health_live': lambda: ('GET', '/health/live', {}, None),
+        'health_ready': lambda: ('GET', '/health/ready', {}, None),
+        'status': lambda: ('GET', '/api/status', {}, None),
+        'metrics': lambda: ('GET', '/metrics', {}, None),
+        'plugins': lambda: ('GET', '/api/plugins', {}, None),
+        'user_info': lambda: ('GET', '/api/user_info', auth_headers(user()), None),
+        'user_info_bad_key': lambda: ('GET', '/api/user_info',
+                                      dict(auth_headers(user()), **{'X-API-Key': 'wrong'}), None),
+        'company_stats': lambda: ('GET', '/api/company_stats', auth_headers(user()), None),
+        'token': lambda: ('POST', '/api/token', auth_headers(user()), None),
+        'get_plugin': get_plugin,
+        'get_plugin_gzip': get_plugin_gzip,
+        'resolve_plugin': resolve_plugin,
+        'get_plugin_bundle': get_plugin_bundle,
+        'plugin_object': lambda: ('GET', f'/objects/{rng.choice(object_hashes)}', {}, None),
+        'sync': lambda: ('POST', '/api/sync', auth_headers(user()), {'manifest': {}}),
+        # Flux SSE: mesuré jusqu'au premier événement (snapshot), puis fermé
+        'events': lambda: ('GET', '/api/events', dict(auth_headers(user()), Accept=EVENT_STREAM), None),
+        'track_execution': track_execution,
+        'track_executions': track_executions,
+        'executions_stats': lambda: ('GET', '/api/executions/stats?group_by=script',
+                                     {'X-Admin-Key': ADMIN_KEY}, None),
+        # En dernier: chaque écriture change la génération de configuration
+        'admin_put_company': admin_put_company,
+        'admin_put_user': admin_put_user,
+        'admin_rotate_key': admin_rotate_key,
+        'admin_deactivate_user': admin_deactivate_user,
+        'admin_deactivate_company': admin_deactivate_company,
+    }
+
+
+def summarize(latencies, wall_time, status_codes):
+    """Débit et percentiles (rang le plus proche) en millisecondes"""
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        if not ordered:
+            return None
+        rank = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+        return round(ordered[rank] * 1000, 3)
+
+    errors = sum(count for code, count in status_codes.items() if int(code) >= 500)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'status_codes': status_codes,
+        'throughput_rps': round(len(ordered) / wall_time, 1) if wall_time > 0 else None,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+        'p50_ms': percentile(50),
+        'p95_ms': percentile(95),
+        'p99_ms': percentile(99)
+    }
+
+
+# ---------------------------------------------------------------------------
+# Exécution dans un sous-processus (l'application lit son environnement à l'import)
+# ---------------------------------------------------------------------------
+
+def app_environment(dataset_dir):
+    env = dict(os.environ)
+    env.update({
+        'PLUGINS_DIR': os.path.join(dataset_dir, 'plugins'),
+        'PLUGIN_OBJECTS_DIR': os.path.join(dataset_dir, 'plugin_objects'),
+        'CONFIG_DIR': os.path.join(dataset_dir, 'config'),
+        'LOGS_DIR': os.path.join(dataset_dir, 'logs'),
+        'EXECUTIONS_DB': os.path.join(dataset_dir, 'logs', 'executions.sqlite3'),
+        'ADMIN_API_KEY': ADMIN_KEY,
+        # Scénario user_info_bad_key: aucun délestage des scénarios suivants (même IP)
+        'AUTH_FAILURE_BURST': '1000000',
+        'AUTH_IP_FAILURE_BURST': '1000000',
+        # Scénario events: un flux par client concurrent, threads libérés vite après fermeture
+        'SSE_MAX_STREAMS': '1000',
+        'SSE_HEARTBEAT': '1',
+        'CONFIG_RELOAD_INTERVAL': '0',
+        'LOG_HANDLERS': 'file',
+        'PYTHONPATH': BASE_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    })
+    return env
+
+
+def load_dataset(dataset_dir):
+    """(échantillons d'utilisateurs, hashes des plugins) écrits par generate_dataset"""
+    with open(os.path.join(dataset_dir, 'benchmark_samples.json'), encoding='utf-8') as f:
+        samples = json.load(f)
+    with open(os.path.join(dataset_dir, 'benchmark_objects.json'), encoding='utf-8') as f:
+        object_hashes = json.load(f)
+    return samples, object_hashes
+
+
+def read_test_response(response):
+    """Lit une réponse du client de test; un flux SSE jusqu'à son premier événement"""
+    if response.mimetype == EVENT_STREAM:
+        for chunk in response.response:
+            if b'event:' in (chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')):
+                break
+    else:
+        response.get_data()
+    response.close()
+
+
+def run_test_client(dataset_dir, n_requests, warmup):
+    """Benchmark en processus via app.test_client() (coût applicatif seul)"""
+    import app as server_app
+
+    server_app.plugin_server.warm_up()
+    check_route_coverage(server_app.app)
+    client = server_app.app.test_client()
+    samples, object_hashes = load_dataset(dataset_dir)
+    generators = build_requests(samples, random.Random(SEED), object_hashes)
+
+    results = {}
+    for name, generate in generators.items():
+        for _ in range(warmup):
+            method, url, headers, body = generate()
+            read_test_response(client.open(url, method=method, headers=headers, json=body, buffered=False))
+
+        latencies, status_codes = [], {}
+        started = time.perf_counter()
+        for _ in range(n_requests):
+            method, url, headers, body = generate()
+            t0 = time.perf_counter()
+            response = client.open(url, method=method, headers=headers, json=body, buffered=False)
+            read_test_response(response)
+            latencies.append(time.perf_counter() - t0)
+            code = str(response.status_code)
+            status_codes[code] = status_codes.get(code, 0) + 1
+        results[name] = summarize(latencies, time.perf_counter() - started, status_codes)
+    server_app.execution_tracker.stop()
+    return results
+
+
+def run_wsgi_server(dataset_dir, n_requests, warmup, concurrency):
+    """Benchmark HTTP réel: serveur WSGI threadé local + clients concurrents"""
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    import app as server_app
+
+    class QuietHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server_app.plugin_server.warm_up()
+    server = make_server('127.0.0.1', 0, server_app.app, threaded=True, request_handler=QuietHandler)
+    port = server.server_port
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    samples, object_hashes = load_dataset(dataset_dir)
+    generators = build_requests(samples, random.Random(SEED), object_hashes)
+    local = threading.local()
+
+    def send(request_spec):
+        method, url, headers, body = request_spec
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        payload = None
+        headers = dict(headers)
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        t0 = time.perf_counter()
+        try:
+            conn.request(method, url, body=payload, headers=headers)
+            response = conn.getresponse()
+            status = response.status
+            if headers.get('Accept') == EVENT_STREAM and status == 200:
+                # Flux sans fin: lecture du premier événement puis fermeture
+                while not response.readline().startswith(b'event:'):
+                    pass
+                conn.close()
+                local.conn = None
+            else:
+                response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            local.conn = None
+            status = 599
+        return time.perf_counter() - t0, status
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for name, generate in generators.items():
+            list(pool.map(send, [generate() for _ in range(warmup)]))
+            specs = [generate() for _ in range(n_requests)]
+            started = time.perf_counter()
+            outcomes = list(pool.map(send, specs))
+            wall = time.perf_counter() - started
+            status_codes = {}
+            for _, status in outcomes:
+                status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+            results[name] = summarize([latency for latency, _ in outcomes], wall, status_codes)
+
+    server.shutdown()
+    server_app.execution_tracker.stop()
+    return results
+
+
+def check_route_coverage(flask_app):
+    """Signale les routes de app.py non couvertes par le benchmark
+
+    Les URLs générées sont résolues par le routeur Flask: les routes à
+    paramètres (<company_id>, <sha256>...) et les méthodes comptent.
+    """
+    from werkzeug.exceptions import HTTPException
+
+    adapter = flask_app.url_map.bind('localhost')
+    covered = set()
+    for generate in build_requests([{
+            'autodesk_user': 'u', 'computer_name': 'c', 'api_key': 'k',
+            'allowed_plugins': ['p'], 'company_id': 'c'}], random.Random(0), ['0' * 64]).values():
+        method, url = generate()[:2]
+        try:
+            covered.add(adapter.match(url.split('?')[0], method=method)[0])
+        except HTTPException:
+            pass
+    for rule in flask_app.url_map.iter_rules():
+        if rule.endpoint != 'static' and rule.endpoint not in covered:
+            print(f"⚠️ Route non couverte par le benchmark: {' '.join(sorted(rule.methods - {'HEAD', 'OPTIONS'}))} "
+                  f"{rule.rule}", file=sys.stderr)
+
+
+def run_worker(args):
+    """Point d'entrée du sous-processus: imprime les résultats JSON sur stdout"""
+    if args.mode == 'client':
+        results = run_test_client(args.dataset, args.requests, args.warmup)
+    else:
+        results = run_wsgi_server(args.dataset, args.requests, args.warmup, args.concurrency)
+    json.dump(results, sys.stdout)
+
+
+# ---------------------------------------------------------------------------
+# Orchestration, sauvegarde et comparaison
+# ---------------------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(args):
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'parameters': {
+            'users': args.users, 'plugins': args.plugins, 'modes': args.modes,
+            'requests': args.requests, 'warmup': args.warmup, 'concurrency': args.concurrency,
+            'seed': SEED
+        },
+        'scenarios': []
+    }
+
+    for n_users in args.users:
+        for n_plugins in args.plugins:
+            with tempfile.TemporaryDirectory(prefix='bench_') as dataset_dir:
+                print(f"📦 Génération: {n_users} utilisateurs, {n_plugins} plugins")
+                t0 = time.perf_counter()
+                generate_dataset(dataset_dir, n_users, n_plugins)
+                print(f"   ({time.perf_counter() - t0:.1f}s)")
+
+                for mode in args.modes:
+                    print(f"⏱️  Mode {mode}...")
+                    output = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), '_worker', '--dataset', dataset_dir,
+                         '--mode', mode, '--requests', str(args.requests), '--warmup', str(args.warmup),
+                         '--concurrency', str(args.concurrency)],
+                        env=app_environment(dataset_dir), capture_output=True, text=True, check=False)
+                    if output.returncode != 0:
+                        print(output.stderr, file=sys.stderr)
+                        raise SystemExit(f"Échec du scénario {n_users}/{n_plugins}/{mode}")
+                    if output.stderr.strip():
+                        print(output.stderr.strip(), file=sys.stderr)
+                    endpoints = json.loads(output.stdout)
+                    report['scenarios'].append({
+                        'users': n_users, 'plugins': n_plugins, 'mode': mode, 'endpoints': endpoints
+                    })
+                    print_table(endpoints)
+
+    output_path = args.output or os.path.join(BASE_DIR, f'bench_results_{commit}.json')
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📄 Résultats sauvés: {output_path}")
+    return report
+
+
+def print_table(endpoints):
+    print(f"   {'endpoint':<26} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  codes")
+    for name, r in endpoints.items():
+        print(f"   {name:<26} {r['throughput_rps'] or 0:>9.1f} {r['p50_ms'] or 0:>9.3f} "
+              f"{r['p95_ms'] or 0:>9.3f} {r['p99_ms'] or 0:>9.3f}  {r['status_codes']}")
+
+
+def compare_reports(baseline_path, current):
+    """Affiche l'évolution p50/p95 et débit par rapport à un rapport précédent"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(s['users'], s['plugins'], s['mode']): s['endpoints'] for s in baseline['scenarios']}
+    print(f"\n📊 Comparaison {baseline['commit']} -> {current['commit']}")
+    for scenario in current['scenarios']:
+        key = (scenario['users'], scenario['plugins'], scenario['mode'])
+        if key not in previous:
+            continue
+        print(f"  {key[0]} utilisateurs / {key[1]} plugins / {key[2]}")
+        for name, r in scenario['endpoints'].items():
+            old = previous[key].get(name)
+            if not old or not old['p50_ms'] or not r['p50_ms']:
+                continue
+            print(f"    {name:<20} p50 x{r['p50_ms'] / old['p50_ms']:.2f}  "
+                  f"p95 x{r['p95_ms'] / old['p95_ms']:.2f}  "
+                  f"débit x{(r['throughput_rps'] or 0) / (old['throughput_rps'] or 1):.2f}")
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks du serveur de plugins Revit')
+    sub = parser.add_subparsers(dest='command')
+
+    worker = sub.add_parser('_worker')
+    worker.add_argument('--dataset', required=True)
+    worker.add_argument('--mode', choices=['client', 'server'], required=True)
+    worker.add_argument('--requests', type=int, default=200)
+    worker.add_argument('--warmup', type=int, default=10)
+    worker.add_argument('--concurrency', type=int, default=8)
+
+    parser.add_argument('--users', type=int_list, default=[10, 1000, 100000])
+    parser.add_argument('--plugins', type=int_list, default=[10, 1000])
+    parser.add_argument('--modes', type=lambda v: v.split(','), default=['client', 'server'])
+    parser.add_argument('--requests', type=int, default=200, help='requêtes mesurées par endpoint')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=8, help='clients simultanés (mode server)')
+    parser.add_argument('--output', help='fichier JSON de résultats')
+    parser.add_argument('--compare', help='rapport JSON précédent à comparer')
+    parser.add_argument('--generate-only', metavar='DIR', help='génère le jeu de données puis quitte')
+
+    args = parser.parse_args()
+    if args.command == '_worker':
+        run_worker(args)
+        return 0
+
+    if args.generate_only:
+        for n_users in args.users:
+            for n_plugins in args.plugins:
+                target = os.path.join(args.generate_only, f'{n_users}u_{n_plugins}p')
+                generate_dataset(target, n_users, n_plugins)
+                print(f"✅ {target}")
+        return 0
+
+    report = run_benchmarks(args)
+    if args.compare:
+        compare_reports(args.compare, report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+# gunicorn_config.py - Configuration gunicorn pour la production
+#
+# Lancement: gunicorn -c gunicorn_config.py wsgi:application
+# Rechargement à chaud: kill -HUP <pid du maître> (configuration + catalogue)
+import gc
+import glob
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Peu de processus (les caches mémoire sont par processus). Chaque flux SSE
+# ouvert (/api/events) reste connecté: avec le worker gevent (installé par
+# start_dev.sh, utilisé par défaut s'il est présent) un flux inactif ne coûte
+# qu'une greenlet, jusqu'à GUNICORN_WORKER_CONNECTIONS connexions par worker.
+# En repli gthread, chaque flux occupe un des GUNICORN_THREADS threads
+try:
+    import gevent  # noqa: F401
+    default_worker_class = 'gevent'
+except ImportError:
+    default_worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', default_worker_class)
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+if worker_class == 'gevent':
+    # Avant le préchargement de l'application: ses verrous, Conditions (flux
+    # SSE) et threads d'arrière-plan doivent être ceux de gevent, sinon une
+    # attente bloquerait toutes les requêtes du worker
+    from gevent import monkey
+    monkey.patch_all()
+
+# Limite des flux SSE lue par l'application au préchargement: moitié des
+# connexions (gevent) ou des threads (gthread) de chaque worker, le reste
+# étant gardé pour les autres requêtes; au-delà, 503 avec Retry-After
+if worker_class == 'gevent':
+    os.environ.setdefault('SSE_MAX_STREAMS', str(worker_connections // 2))
+else:
+    os.environ.setdefault('SSE_MAX_STREAMS', str(threads // 2))
+
+# Instantanés de métriques partagés entre workers (agrégés par /metrics);
+# défini avant le préchargement de l'application qui lit cette variable
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f'plugin_server_metrics_{os.getpid()}'))
+os.makedirs(os.environ['METRICS_DIR'], exist_ok=True)
+
+# Application chargée une fois dans le maître: configuration, catalogue et
+# cache de contenu sont partagés en copy-on-write. La surveillance de la
+# configuration est démarrée dans chaque worker (post_fork), jamais dans le maître
+preload_app = True
+os.environ.setdefault('CONFIG_WATCHER_POST_FORK', '1')
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+
+# Les accès sont journalisés par l'application (logs/access.log)
+accesslog = None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+
+def on_starting(server):
+    # Compteurs remis à zéro à chaque démarrage du maître
+    for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], 'metrics_*.json')):
+        os.remove(path)
+
+
+def pre_fork(server, worker):
+    # Objets du maître sortis du GC: ses passages ne touchent plus ces pages
+    # dans les workers (évite de casser le partage copy-on-write)
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from app import CONFIG_RELOAD_INTERVAL, plugin_server
+    plugin_server.start_config_watcher(CONFIG_RELOAD_INTERVAL)
+
+
+def on_reload(server):
+    # SIGHUP: recharge dans le maître avant de lancer les nouveaux workers
+    from app import plugin_server
+    plugin_server.reload()
+    server.log.info("Configuration et catalogue rechargés")
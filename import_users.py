@@ -0,0 +1,37 @@
+# import_users.py - Import de users.json dans la base utilisateurs SQLite
+#
+#   python import_users.py [chemin/users.json] [--db chemin/users.sqlite3]
+#
+# Remplace tout le contenu de la base en une transaction: les serveurs en
+# mode USER_STORE=sqlite détectent la nouvelle version et rechargent à chaud.
+import argparse
+import json
+import os
+import sys
+
+# Pas de surveillance de configuration pour un import ponctuel
+os.environ.setdefault('CONFIG_RELOAD_INTERVAL', '0')
+
+from app import CONFIG_DIR, USERS_DB, SqliteUserStore  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importe users.json dans la base utilisateurs SQLite")
+    parser.add_argument('users_file', nargs='?', default=os.path.join(CONFIG_DIR, 'users.json'))
+    parser.add_argument('--db', default=USERS_DB)
+    args = parser.parse_args()
+
+    try:
+        with open(args.users_file, 'rb') as f:
+            config = json.loads(f.read().decode('utf-8'))
+        companies, users = SqliteUserStore(args.db).import_config(config)
+    except (OSError, ValueError) as e:
+        print(f"Import impossible: {e}", file=sys.stderr)
+        return 1
+
+    print(f"{companies} entreprises, {users} utilisateurs importés dans {args.db}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
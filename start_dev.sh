@@ -15,9 +15,9 @@ fi
 source venv/bin/activate
 
 # Vérification des dépendances
-if ! pip show flask > /dev/null 2>&1; then
+if ! pip show flask > /dev/null 2>&1 || ! pip show gevent > /dev/null 2>&1; then
     echo "📦 Installation des dépendances..."
-    pip install flask python-dotenv gunicorn
+    pip install flask python-dotenv gunicorn gevent
 fi
 
 echo "✅ Environnement prêt"
@@ -0,0 +1,21 @@
+#!/bin/bash
+# start_prod.sh - Script de démarrage production (gunicorn)
+
+echo "🚀 Démarrage du serveur Revit Plugins (production)"
+echo "================================================="
+
+# Activation de l'environnement virtuel
+if [ ! -d "venv" ]; then
+    echo "❌ Environnement virtuel non trouvé (lancez start_dev.sh une première fois)"
+    exit 1
+fi
+source venv/bin/activate
+
+if ! python -c "import gevent" > /dev/null 2>&1; then
+    echo "⚠️  gevent absent (pip install gevent): workers gthread, flux SSE limités à GUNICORN_THREADS/2 par worker"
+fi
+
+echo "🌐 Écoute sur ${GUNICORN_BIND:-0.0.0.0:5000}"
+echo "🔄 Rechargement config/catalogue: kill -HUP <pid maître>"
+
+exec gunicorn -c gunicorn_config.py wsgi:application
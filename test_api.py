@@ -0,0 +1,765 @@
+# test_api.py - Routes authentifiées (client de test Flask)
+#
+#   python -m unittest test_api
+#
+# La configuration (users.json) et les plugins de test sont écrits dans les
+# dossiers de l'application puis rechargés avant chaque test.
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+import zlib
+from datetime import datetime
+from unittest import mock
+
+_tmp = tempfile.mkdtemp(prefix='test_api_')
+for _name in ('PLUGINS_DIR', 'CONFIG_DIR', 'LOGS_DIR', 'PLUGIN_OBJECTS_DIR'):
+    os.environ.setdefault(_name, os.path.join(_tmp, _name.lower()))
+    os.makedirs(os.environ[_name], exist_ok=True)
+os.environ.setdefault('EXECUTIONS_DB', '')
+os.environ.setdefault('CONFIG_RELOAD_INTERVAL', '0')
+os.environ.setdefault('LOG_HANDLERS', 'file')
+
+import app  # noqa: E402
+
+CONFIG = {'companies': {'acme': {'name': 'ACME', 'active': True, 'users': {
+    'u1_PC1': {'name': 'U1', 'email': 'u1@example.com', 'autodesk_user': 'u1', 'computer_name': 'PC1',
+               'api_key': 'key-u1', 'active': True, 'allowed_plugins': ['alpha']},
+    'u2_PC2': {'name': 'U2', 'email': 'u2@example.com', 'autodesk_user': 'u2', 'computer_name': 'PC2',
+               'api_key': 'key-u2', 'active': True, 'allowed_plugins': ['*']},
+}}}}
+
+U1 = {'X-Autodesk-User': 'u1', 'X-Computer-Name': 'PC1', 'X-API-Key': 'key-u1'}
+U2 = {'X-Autodesk-User': 'u2', 'X-Computer-Name': 'PC2', 'X-API-Key': 'key-u2'}
+
+
+class ApiTestCase(unittest.TestCase):
+
+    def setUp(self):
+        server = app.plugin_server
+        if os.path.exists(app.USERS_JOURNAL):
+            os.remove(app.USERS_JOURNAL)
+        with open(server.users_file, 'w', encoding='utf-8') as f:
+            json.dump(CONFIG, f)
+        for name in ('alpha', 'beta'):
+            with open(os.path.join(app.PLUGINS_DIR, f'{name}.py'), 'w', encoding='utf-8') as f:
+                f.write(f'"""Plugin {name}"""\n')
+        server.reload()
+        # Délestage propre à chaque test
+        self.throttle = app.AuthThrottle(burst=5, rate=0.01, ip_burst=20, ip_rate=0.01)
+        patcher = mock.patch.object(app, 'auth_throttle', self.throttle)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app.app.test_client()
+
+    def set_allowed_plugins(self, user_key, allowed):
+        app.plugin_server.apply_change({'op': 'user', 'company_id': 'acme', 'user_key': user_key,
+                                        'fields': {'allowed_plugins': allowed}})
+
+    def get_plugin(self, name='alpha', **headers):
+        return self.client.get('/api/get_plugin', headers=dict(U2, **{'X-Plugin-Name': name}, **headers))
+
+
+class ConfigReloadTest(ApiTestCase):
+
+    def write_config(self, config, mtime_ns):
+        path = app.plugin_server.users_file
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(config if isinstance(config, str) else json.dumps(config))
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_changed_file_is_applied_without_restart(self):
+        config = json.loads(json.dumps(CONFIG))
+        config['companies']['acme']['users']['u1_PC1']['api_key'] = 'key-u1-new'
+        generation = app.plugin_server.config_generation
+        self.write_config(config, 2_000_000_000 * 10**9)
+        self.assertTrue(app.plugin_server.reload_config_if_changed())
+        self.assertGreater(app.plugin_server.config_generation, generation)
+        self.assertEqual(self.client.get('/api/user_info', headers=U1).status_code, 403)
+        new_key = dict(U1, **{'X-API-Key': 'key-u1-new'})
+        self.assertEqual(self.client.get('/api/user_info', headers=new_key).status_code, 200)
+        self.assertFalse(app.plugin_server.reload_config_if_changed())
+
+    def test_invalid_file_keeps_last_valid_config(self):
+        version = app.plugin_server.config_version
+        self.write_config('{"companies": ', 2_000_000_001 * 10**9)
+        self.assertFalse(app.plugin_server.reload_config_if_changed())
+        self.assertEqual(app.plugin_server.config_version, version)
+        self.assertEqual(self.client.get('/api/user_info', headers=U1).status_code, 200)
+
+
+class UserInfoCacheTest(ApiTestCase):
+
+    def test_change_after_authentication_is_not_cached_under_new_generation(self):
+        self.assertEqual(self.client.get('/api/user_info', headers=U1).get_json()['user']['allowed_plugins'],
+                         ['alpha'])
+        page_query = app.plugin_page_query
+
+        def change_then_query(*args):
+            # Modification d'administration entre l'authentification et la mise en cache
+            self.set_allowed_plugins('u1_PC1', ['beta'])
+            return page_query(*args)
+
+        with mock.patch('app.plugin_page_query', change_then_query):
+            self.client.get('/api/user_info', headers=U1)
+        data = self.client.get('/api/user_info', headers=U1).get_json()
+        self.assertEqual(data['user']['allowed_plugins'], ['beta'])
+        self.assertEqual([plugin['name'] for plugin in data['plugins_details']], ['beta'])
+
+    def test_touched_plugin_refreshes_cached_lists(self):
+        self.client.get('/api/plugins')
+        self.client.get('/api/user_info', headers=U2)
+        os.utime(os.path.join(app.PLUGINS_DIR, 'alpha.py'), (1_000_000, 1_000_000))
+        app.plugin_server.catalog.rescan()
+        modified = datetime.fromtimestamp(1_000_000).isoformat()
+        plugins = {p['name']: p for p in self.client.get('/api/plugins').get_json()['plugins']}
+        self.assertEqual(plugins['alpha']['modified'], modified)
+        details = {p['name']: p for p in self.client.get('/api/user_info', headers=U2).get_json()['plugins_details']}
+        self.assertEqual(details['alpha']['modified'], modified)
+
+
+class PluginPageTest(ApiTestCase):
+
+    def test_paged_user_info_reports_allowed_total(self):
+        data = self.client.get('/api/user_info?limit=1', headers=U2).get_json()
+        self.assertEqual(len(data['plugins_details']), 1)
+        self.assertEqual(data['total_plugins'], 2)
+
+    def test_epoch_zero_modified_since_filters(self):
+        os.utime(os.path.join(app.PLUGINS_DIR, 'alpha.py'), (0, 0))
+        app.plugin_server.catalog.rescan()
+        data = self.client.get('/api/plugins?modified_since=1970-01-01T00:00:00%2B00:00').get_json()
+        self.assertEqual([plugin['name'] for plugin in data['plugins']], ['beta'])
+
+
+class PluginManifestTest(ApiTestCase):
+
+    def test_main_block_records_only_module_functions(self):
+        with open(os.path.join(app.PLUGINS_DIR, 'alpha.py'), 'w', encoding='utf-8') as f:
+            f.write('"""Plugin alpha"""\nimport sys\n\n\ndef setup():\n    pass\n\n\n'
+                    'if __name__ == \'__main__\':\n    print(len(sys.argv))\n    setup()\n    sys.exit(0)\n')
+        app.plugin_server.catalog.rescan()
+        data = self.client.get('/api/user_info?fields=name,entry_points', headers=U2).get_json()
+        plugins = {plugin['name']: plugin for plugin in data['plugins_details']}
+        self.assertEqual(plugins['alpha']['entry_points'], ['setup'])
+
+
+class PluginDownloadTest(ApiTestCase):
+
+    def test_download_carries_validators(self):
+        response = self.get_plugin()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'"""Plugin alpha"""\n')
+        self.assertEqual(response.headers['ETag'], f'"{app.plugin_server.catalog.get("alpha").sha256}"')
+        self.assertIn('Last-Modified', response.headers)
+
+    def test_matching_etag_returns_304(self):
+        etag = self.get_plugin().headers['ETag']
+        response = self.get_plugin(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(self.get_plugin(**{'If-None-Match': '"other"'}).status_code, 200)
+
+    def test_unmodified_since_last_download_returns_304(self):
+        last_modified = self.get_plugin().headers['Last-Modified']
+        self.assertEqual(self.get_plugin(**{'If-Modified-Since': last_modified}).status_code, 304)
+
+    def test_changed_plugin_invalidates_etag(self):
+        etag = self.get_plugin().headers['ETag']
+        with open(os.path.join(app.PLUGINS_DIR, 'alpha.py'), 'w', encoding='utf-8') as f:
+            f.write('"""Plugin alpha"""\nVERSION = 2\n')
+        app.plugin_server.catalog.rescan()
+        response = self.get_plugin(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+
+class PluginEncodingTest(ApiTestCase):
+
+    SOURCE = '"""Plugin alpha"""\n' + 'print("alpha")\n' * 200
+
+    def setUp(self):
+        super().setUp()
+        with open(os.path.join(app.PLUGINS_DIR, 'alpha.py'), 'w', encoding='utf-8') as f:
+            f.write(self.SOURCE)
+        app.plugin_server.catalog.rescan()
+        self.sha256 = app.plugin_server.catalog.get('alpha').sha256
+
+    def test_gzip_variant_has_its_own_etag(self):
+        response = self.get_plugin(**{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['ETag'], f'"{self.sha256}-gzip"')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertLess(len(response.data), len(self.SOURCE))
+        self.assertEqual(gzip.decompress(response.data), self.SOURCE.encode('utf-8'))
+
+    def test_deflate_variant(self):
+        response = self.get_plugin(**{'Accept-Encoding': 'deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(response.headers['ETag'], f'"{self.sha256}-deflate"')
+        self.assertEqual(zlib.decompress(response.data), self.SOURCE.encode('utf-8'))
+
+    def test_identity_without_accept_encoding(self):
+        response = self.get_plugin(**{'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.headers['ETag'], f'"{self.sha256}"')
+        self.assertEqual(response.data, self.SOURCE.encode('utf-8'))
+
+    def test_variant_etag_revalidates_only_that_variant(self):
+        etag = self.get_plugin(**{'Accept-Encoding': 'gzip'}).headers['ETag']
+        self.assertEqual(self.get_plugin(**{'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code, 304)
+        response = self.get_plugin(**{'Accept-Encoding': 'identity', 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.SOURCE.encode('utf-8'))
+
+
+class PluginContentCacheTest(ApiTestCase):
+
+    def entries(self, names=('alpha', 'beta')):
+        return [app.plugin_server.catalog.get(name) for name in names]
+
+    def test_least_recently_used_is_evicted_within_budget(self):
+        for name in ('gamma', 'delta'):
+            with open(os.path.join(app.PLUGINS_DIR, f'{name}.py'), 'w', encoding='utf-8') as f:
+                f.write(f'"""Plugin {name}"""\n')
+            self.addCleanup(os.remove, os.path.join(app.PLUGINS_DIR, f'{name}.py'))
+        app.plugin_server.catalog.rescan()
+        alpha, beta, gamma, delta = self.entries(('alpha', 'beta', 'gamma', 'delta'))
+        # Sources trop courtes pour une variante compressée: budget de trois plugins
+        cache = app.PluginContentCache(max_bytes=3 * alpha.size)
+        self.assertEqual(cache.get(alpha).raw, b'"""Plugin alpha"""\n')
+        cache.get(beta)
+        cache.get(gamma)
+        self.assertIs(cache.get(alpha), cache.get(alpha))
+        cache.get(delta)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['entries']), (2, 4, 1, 3))
+        self.assertLessEqual(stats['resident_bytes'], stats['max_bytes'])
+        cache.get(alpha)
+        self.assertEqual(cache.stats()['hits'], 3)
+        cache.get(beta)
+        self.assertEqual(cache.stats()['misses'], 5)
+
+    def test_plugin_over_budget_is_served_from_disk(self):
+        cache = app.PluginContentCache(max_bytes=1)
+        self.assertIsNone(cache.get(self.entries()[0]))
+        with mock.patch.object(app.plugin_server, 'content_cache', cache):
+            response = self.get_plugin()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'"""Plugin alpha"""\n')
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_file_changed_since_scan_is_not_cached(self):
+        alpha = self.entries()[0]
+        with open(alpha.path, 'w', encoding='utf-8') as f:
+            f.write('"""Plugin alpha"""\nVERSION = 2\n')
+        cache = app.PluginContentCache(max_bytes=1024 * 1024)
+        with self.assertRaises(app.StalePluginError):
+            cache.get(alpha)
+        # Hors cache, la route rescane le catalogue et sert la nouvelle version
+        with mock.patch.object(app.plugin_server, 'content_cache', cache):
+            self.assertEqual(self.get_plugin().data, b'"""Plugin alpha"""\nVERSION = 2\n')
+
+
+class SyncTest(ApiTestCase):
+
+    def hashes(self):
+        return {name: app.plugin_server.catalog.get(name).sha256 for name in ('alpha', 'beta')}
+
+    def test_archive_holds_changed_allowed_plugins_and_removed_list(self):
+        response = self.client.post('/api/sync', headers=U1, json={'manifest': {'alpha': 'stale', 'gone': 'x'}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ['sync_manifest.json', 'alpha.py'])
+            manifest = json.loads(archive.read('sync_manifest.json'))
+            self.assertEqual(archive.read('alpha.py'), b'"""Plugin alpha"""\n')
+        self.assertEqual(manifest['plugins'], {'alpha': self.hashes()['alpha']})
+        self.assertEqual(manifest['removed'], ['gone'])
+
+    def test_up_to_date_client_gets_204(self):
+        response = self.client.post('/api/sync', headers=U2, json={'manifest': self.hashes()})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response.data, b'')
+
+    def test_invalid_manifest_is_rejected(self):
+        self.assertEqual(self.client.post('/api/sync', headers=U2, json={'manifest': ['alpha']}).status_code, 400)
+
+
+class StreamedMetricsTest(ApiTestCase):
+
+    def test_streamed_response_is_in_flight_until_closed(self):
+        metrics = app.Metrics()
+        with mock.patch.object(app, 'metrics', metrics):
+            response = self.client.post('/api/sync', headers=U2, json={'manifest': {}}, buffered=False)
+            self.assertEqual(metrics.in_flight, 1)
+            self.assertNotIn('/api/sync', metrics.latency)
+            body = b''.join(response.response)
+            response.close()
+        self.assertEqual(metrics.in_flight, 0)
+        self.assertEqual(sum(metrics.latency['/api/sync'][:-1]), 1)
+        self.assertEqual(metrics.response_bytes['/api/sync'], len(body))
+
+
+class PluginPackageTest(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.source = os.path.join(app.PLUGINS_DIR, 'pkg')
+        os.makedirs(self.source)
+        self.addCleanup(app.plugin_server.catalog.rescan)
+        self.addCleanup(shutil.rmtree, self.source)
+        self.write('__init__.py', '"""Paquet pkg"""\n')
+        self.write('data.txt', 'v1')
+        app.plugin_server.catalog.rescan()
+
+    def write(self, relpath, text, mtime=1_000_000):
+        path = os.path.join(self.source, relpath)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.utime(path, (mtime, mtime))
+
+    def archive(self, data):
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            return {name: archive.read(name) for name in archive.namelist()}
+
+    def test_package_is_served_as_archive(self):
+        response = self.get_plugin('pkg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        self.assertEqual(response.headers['ETag'], f'"{app.plugin_server.catalog.get("pkg").sha256}"')
+        self.assertEqual(self.archive(response.data), {'__init__.py': b'"""Paquet pkg"""\n', 'data.txt': b'v1'})
+
+    def test_archive_is_rebuilt_only_when_package_changes(self):
+        entry = app.plugin_server.catalog.get('pkg')
+        stored = app.plugin_server.objects.stored
+        app.plugin_server.catalog.rescan()
+        self.assertIs(app.plugin_server.catalog.get('pkg'), entry)
+        self.write('data.txt', 'v2', mtime=1_000_001)
+        app.plugin_server.catalog.rescan()
+        rebuilt = app.plugin_server.catalog.get('pkg')
+        self.assertNotEqual(rebuilt.sha256, entry.sha256)
+        self.assertEqual(app.plugin_server.objects.stored, stored + 1)
+        self.assertEqual(self.archive(self.get_plugin('pkg').data)['data.txt'], b'v2')
+
+    def test_objects_serve_exact_bytes(self):
+        for name in ('alpha', 'pkg'):
+            entry = app.plugin_server.catalog.get(name)
+            with open(entry.path, 'rb') as f:
+                expected = f.read()
+            response = self.client.get(f'/objects/{entry.sha256}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, expected)
+            self.assertEqual(hashlib.sha256(response.data).hexdigest(), entry.sha256)
+            self.assertEqual(response.headers['Cache-Control'], app.IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(self.client.get(f'/objects/{"0" * 64}').status_code, 404)
+        self.assertEqual(self.client.get('/objects/not-a-hash').status_code, 404)
+
+    def test_range_resumes_download(self):
+        for name in ('alpha', 'pkg'):
+            full = self.get_plugin(name).data
+            response = self.get_plugin(name, Range='bytes=4-9')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.headers['Content-Range'], f'bytes 4-9/{len(full)}')
+            self.assertEqual(response.data, full[4:10])
+            etag = response.headers['ETag']
+            # If-Range périmé: contenu complet
+            stale = self.get_plugin(name, Range='bytes=4-9', **{'If-Range': '"old"'})
+            self.assertEqual(stale.status_code, 200)
+            self.assertEqual(stale.data, full)
+            self.assertEqual(self.get_plugin(name, Range='bytes=4-9', **{'If-Range': etag}).status_code, 206)
+
+
+class PluginEventsTest(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(app, 'SSE_HEARTBEAT', 0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def open_stream(self, headers=U1):
+        response = self.client.get('/api/events', headers=headers, buffered=False)
+        self.addCleanup(response.close)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = iter(response.response)
+        self.assertTrue(next(chunks).startswith(b'retry: '))
+        return response, chunks
+
+    @staticmethod
+    def parse(chunk):
+        """(événement, id, données) d'un bloc SSE"""
+        fields = dict(line.split(': ', 1) for line in chunk.decode('utf-8').strip().split('\n'))
+        return fields['event'], fields['id'], json.loads(fields['data'])
+
+    def test_snapshot_then_permission_change(self):
+        _, chunks = self.open_stream()
+        event, event_id, data = self.parse(next(chunks))
+        self.assertEqual(event, 'snapshot')
+        alpha = app.plugin_server.catalog.get('alpha').sha256
+        self.assertEqual(data['plugins'], {'alpha': alpha})
+        self.set_allowed_plugins('u1_PC1', ['alpha', 'beta'])
+        event, next_id, data = self.parse(next(chunks))
+        self.assertEqual(event, 'permissions')
+        self.assertEqual(set(data['plugins']), {'alpha', 'beta'})
+        self.assertNotEqual(next_id, event_id)
+
+    def test_catalog_change_sends_delta(self):
+        _, chunks = self.open_stream(U2)
+        self.assertEqual(self.parse(next(chunks))[0], 'snapshot')
+        with open(os.path.join(app.PLUGINS_DIR, 'alpha.py'), 'w', encoding='utf-8') as f:
+            f.write('"""Plugin alpha"""\nVERSION = 2\n')
+        app.plugin_server.catalog.rescan()
+        event, _, data = self.parse(next(chunks))
+        self.assertEqual(event, 'catalog')
+        self.assertEqual(data, {'added': {}, 'removed': [],
+                                'updated': {'alpha': app.plugin_server.catalog.get('alpha').sha256}})
+
+    def test_resume_with_last_event_id_skips_snapshot(self):
+        response, chunks = self.open_stream()
+        _, event_id, _ = self.parse(next(chunks))
+        response.close()
+        _, chunks = self.open_stream(dict(U1, **{'Last-Event-ID': event_id}))
+        self.assertEqual(next(chunks), b': heartbeat\n\n')
+
+    def test_deactivated_user_is_revoked(self):
+        _, chunks = self.open_stream()
+        next(chunks)
+        app.plugin_server.apply_change({'op': 'user', 'company_id': 'acme', 'user_key': 'u1_PC1',
+                                        'fields': {'active': False}})
+        event, _, data = self.parse(next(chunks))
+        self.assertEqual(event, 'revoked')
+        self.assertTrue(data['reason'])
+        self.assertEqual(list(chunks), [])
+
+    def test_stream_slot_is_released_on_close(self):
+        streams = app.plugin_server.events.streams
+        response, _ = self.open_stream()
+        self.assertEqual(app.plugin_server.events.streams, streams + 1)
+        response.close()
+        self.assertEqual(app.plugin_server.events.streams, streams)
+
+
+class PluginObjectRetentionTest(ApiTestCase):
+
+    def plugin_hashes(self):
+        details = self.client.get('/api/user_info', headers=U2).get_json()['plugins_details']
+        return {plugin['name']: plugin['sha256'] for plugin in details}
+
+    def write_plugin(self, name, source):
+        with open(os.path.join(app.PLUGINS_DIR, f'{name}.py'), 'w', encoding='utf-8') as f:
+            f.write(source)
+        app.plugin_server.catalog.rescan()
+
+    def test_previous_versions_are_kept_up_to_the_limit(self):
+        versions = [self.plugin_hashes()['alpha']]
+        for i in range(app.plugin_server.objects.keep_versions + 1):
+            self.write_plugin('alpha', f'"""Plugin alpha"""\nVERSION = {i}\n')
+            versions.append(self.plugin_hashes()['alpha'])
+        self.assertEqual(self.client.get(f'/objects/{versions[0]}').status_code, 404)
+        for sha256 in versions[1:]:
+            self.assertEqual(self.client.get(f'/objects/{sha256}').status_code, 200)
+
+    def test_removed_plugin_is_no_longer_downloadable(self):
+        sha256 = self.plugin_hashes()['beta']
+        self.write_plugin('beta', '"""Plugin beta"""\nVERSION = 2\n')
+        previous, sha256 = sha256, self.plugin_hashes()['beta']
+        os.remove(os.path.join(app.PLUGINS_DIR, 'beta.py'))
+        app.plugin_server.catalog.rescan()
+        self.assertEqual(self.client.get(f'/objects/{sha256}').status_code, 404)
+        self.assertEqual(self.client.get(f'/objects/{previous}').status_code, 404)
+
+
+class AuthThrottleTest(ApiTestCase):
+
+    def test_user_key_spraying_is_throttled_per_ip(self):
+        codes = [self.client.get('/api/user_info', headers={
+            'X-Autodesk-User': f'spray{i}', 'X-Computer-Name': 'PC', 'X-API-Key': 'x'}).status_code
+            for i in range(100)]
+        self.assertEqual(codes[:20], [403] * 20)
+        self.assertEqual(set(codes[20:]), {429})
+
+    def test_exhausted_ip_does_not_lock_out_other_users_behind_nat(self):
+        # Utilisateurs du bureau déjà connectés avant le balayage
+        self.client.get('/api/user_info', headers=U1)
+        self.client.get('/api/user_info', headers=U2)
+        for i in range(50):
+            self.client.get('/api/user_info', headers={
+                'X-Autodesk-User': f'spray{i}', 'X-Computer-Name': 'PC', 'X-API-Key': 'x'})
+        self.assertEqual(self.client.get('/api/user_info', headers=U1).status_code, 200)
+        self.assertEqual(self.client.get('/api/user_info', headers=U2).status_code, 200)
+        # Une clé jamais validée est refusée avant toute recherche dans la configuration
+        bad = dict(U2, **{'X-API-Key': 'wrong'})
+        with mock.patch.object(app.plugin_server, 'authenticate_user') as authenticate:
+            self.assertEqual(self.client.get('/api/user_info', headers=bad).status_code, 429)
+        authenticate.assert_not_called()
+
+    def test_repeated_bad_key_is_throttled_per_user(self):
+        bad = dict(U1, **{'X-API-Key': 'wrong'})
+        codes = [self.client.get('/api/user_info', headers=bad).status_code for _ in range(8)]
+        self.assertEqual(codes, [403] * 5 + [429] * 3)
+        self.assertEqual(self.client.get('/api/user_info', headers=U2).status_code, 200)
+
+    def test_bad_key_flood_does_not_lock_out_valid_key(self):
+        office = {'REMOTE_ADDR': '198.51.100.2'}
+        self.assertEqual(self.client.get('/api/user_info', headers=U1, environ_base=office).status_code, 200)
+        attacker = {'REMOTE_ADDR': '203.0.113.7'}
+        for i in range(30):
+            self.client.get('/api/user_info', headers=dict(U1, **{'X-API-Key': f'wrong{i % 3}'}),
+                            environ_base=attacker)
+        response = self.client.get('/api/user_info', headers=U1, environ_base=office)
+        self.assertEqual(response.status_code, 200)
+
+    def test_distinct_wrong_keys_for_known_user_are_throttled(self):
+        self.assertEqual(self.client.get('/api/user_info', headers=U1).status_code, 200)
+        codes = [self.client.get('/api/user_info', headers=dict(U1, **{'X-API-Key': f'guess{i}'})).status_code
+                 for i in range(30)]
+        self.assertEqual(codes[:5], [403] * 5)
+        self.assertEqual(set(codes[5:]), {429})
+        self.assertEqual(self.client.get('/api/user_info', headers=U1).status_code, 200)
+
+
+class TrackExecutionTest(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.log_file = os.path.join(tempfile.mkdtemp(dir=_tmp), 'script_executions.log')
+        self.tracker = app.ExecutionTracker(self.log_file, flush_records=100, flush_interval=0.05)
+        patcher = mock.patch.object(app, 'execution_tracker', self.tracker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def logged(self):
+        with open(self.log_file, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_batch_is_queued_then_written(self):
+        events = [{'timestamp': f'2024-01-01T00:00:0{i}', 'revit_user': 'u1', 'script_name': f's{i}'}
+                  for i in range(3)]
+        response = self.client.post('/api/track_executions', json={'events': events},
+                                    headers={'X-Computer-Name': 'PC1'})
+        self.assertEqual(response.get_json(), {'status': 'logged', 'count': 3})
+        self.client.post('/api/track_execution', json={'revit_user': 'nobody', 'script_name': 's3'})
+        self.tracker.stop()
+        records = self.logged()
+        self.assertEqual([record['script_name'] for record in records], ['s0', 's1', 's2', 's3'])
+        self.assertEqual([record['company_id'] for record in records], ['acme'] * 3 + [None])
+        self.assertEqual(self.tracker.stats()['written'], 4)
+
+    def test_after_stop_records_are_written_directly(self):
+        self.tracker.stop()
+        self.client.post('/api/track_execution', json={'revit_user': 'u1', 'script_name': 'late'})
+        self.assertEqual([record['script_name'] for record in self.logged()], ['late'])
+
+    def test_invalid_and_oversized_batches_are_refused(self):
+        self.assertEqual(self.client.post('/api/track_executions', json={'events': 'x'}).status_code, 400)
+        events = [{'script_name': 's'}] * (app.MAX_EXECUTION_BATCH + 1)
+        self.assertEqual(self.client.post('/api/track_executions', json=events).status_code, 413)
+        self.tracker.stop()
+        self.assertFalse(os.path.exists(self.log_file))
+
+
+class ExecutionHistoryImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(dir=_tmp)
+        self.log_file = os.path.join(self.dir, 'script_executions.log')
+        self.write_lines(25)
+        self.store = app.ExecutionStore(os.path.join(self.dir, 'executions.sqlite3'))
+
+    def write_lines(self, count, script='legacy'):
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            for i in range(count):
+                f.write(json.dumps({'timestamp': f'2024-01-01T00:00:{i % 60:02d}', 'script_name': script,
+                                    'revit_user': 'u1'}) + '\n')
+
+    def test_import_is_batched_resumable_and_stops_at_mark(self):
+        self.store.mark_jsonl_end(self.log_file)
+        # Lignes écrites après le démarrage: indexées par le thread d'écriture, pas par l'import
+        self.write_lines(3, script='live')
+        self.assertEqual(self.store.import_jsonl_batch(self.log_file, batch_size=10), 10)
+        self.assertEqual(self.store.import_jsonl(self.log_file, batch_size=10), 15)
+        self.assertEqual(self.store.import_jsonl(self.log_file), 0)
+        self.assertEqual(self.store.count(filters={'script_name': 'legacy'}), 25)
+        self.assertEqual(self.store.count(filters={'script_name': 'live'}), 0)
+
+    def test_writer_keeps_draining_during_import(self):
+        release = threading.Event()
+        tracker = app.ExecutionTracker(self.log_file, flush_records=1, flush_interval=0.01, store=self.store)
+        with mock.patch.object(self.store, 'import_jsonl', side_effect=lambda *args: release.wait(5)):
+            tracker.submit([{'timestamp': '2024-02-01T00:00:00', 'script_name': 'live', 'revit_user': 'u1'}])
+            deadline = time.monotonic() + 5
+            while tracker.written < 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(tracker.written, 1)
+            release.set()
+        tracker.stop()
+        self.assertEqual(self.store.count(filters={'script_name': 'live'}), 1)
+
+
+class UserStoreParityTest(ApiTestCase):
+    """Mêmes réponses en mode USER_STORE=sqlite qu'avec users.json"""
+
+    ADMIN = {'X-Admin-Key': 'admin-key'}
+    # Champs qui diffèrent par nature d'un stockage à l'autre ou d'une exécution à l'autre
+    VOLATILE = ('timestamp', 'config_generation', 'config_version', 'api_key', 'token', 'expires_at', 'created_at')
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(app, 'ADMIN_API_KEY', 'admin-key')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use_sqlite_store(self):
+        store = app.SqliteUserStore(os.path.join(tempfile.mkdtemp(dir=_tmp), 'users.sqlite3'))
+        store.import_config(CONFIG)
+        patcher = mock.patch.object(app.plugin_server, 'user_store', store)
+        patcher.start()
+        self.addCleanup(app.plugin_server.reload)
+        self.addCleanup(patcher.stop)
+        self.assertTrue(app.plugin_server.reload_config_if_changed())
+        self.assertEqual(app.plugin_server.user_store.name, 'sqlite')
+
+    def normalized(self, value):
+        if isinstance(value, dict):
+            return {k: self.normalized(v) for k, v in value.items() if k not in self.VOLATILE}
+        if isinstance(value, list):
+            return [self.normalized(v) for v in value]
+        return value
+
+    def scenario(self):
+        u3 = {'X-Autodesk-User': 'u3', 'X-Computer-Name': 'PC3', 'X-API-Key': 'key-u3'}
+        steps = [
+            ('GET', '/api/user_info', U1, None),
+            ('GET', '/api/user_info', dict(U1, **{'X-API-Key': 'wrong'}), None),
+            ('GET', '/api/user_info', dict(U1, **{'X-Autodesk-User': 'ghost'}), None),
+            ('GET', '/api/company_stats', U1, None),
+            ('PUT', '/api/admin/companies/acme/users/u3_PC3', self.ADMIN,
+             {'name': 'U3', 'email': 'u3@example.com', 'autodesk_user': 'u3', 'computer_name': 'PC3',
+              'api_key': 'key-u3', 'active': True, 'allowed_plugins': ['beta']}),
+            ('GET', '/api/user_info', u3, None),
+            ('DELETE', '/api/admin/companies/acme/users/u1_PC1', self.ADMIN, None),
+            ('GET', '/api/user_info', U1, None),
+            ('PUT', '/api/admin/companies/globex', self.ADMIN, {'name': 'Globex', 'active': True}),
+            ('POST', '/api/admin/companies/acme/users/u2_PC2/rotate_key', self.ADMIN, None),
+            ('GET', '/api/user_info', U2, None),
+            ('DELETE', '/api/admin/companies/acme/users/nobody', self.ADMIN, None),
+            ('GET', '/api/company_stats', u3, None),
+        ]
+        results = []
+        for method, url, headers, body in steps:
+            response = self.client.open(url, method=method, headers=headers, json=body)
+            results.append((method, url, response.status_code, self.normalized(response.get_json())))
+        token = self.client.post('/api/token', headers=u3).get_json()['token']
+        response = self.client.get('/api/user_info', headers={'Authorization': f'Bearer {token}'})
+        results.append(('token', response.status_code, self.normalized(response.get_json())))
+        status = self.client.get('/api/status').get_json()
+        results.append(('status', status['statistics']))
+        return results
+
+    def test_sqlite_store_answers_like_json_store(self):
+        expected = self.scenario()
+        self.assertEqual([step[2] for step in expected[:13]],
+                         [200, 403, 403, 200, 201, 200, 200, 403, 201, 200, 403, 404, 200])
+        # Même scénario depuis l'état initial, délestage compris
+        patcher = mock.patch.object(app, 'auth_throttle', app.AuthThrottle(burst=5, rate=0.01, ip_burst=20,
+                                                                           ip_rate=0.01))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.use_sqlite_store()
+        self.assertEqual(self.scenario(), expected)
+
+
+class SessionTokenTest(ApiTestCase):
+
+    def issue_token(self, headers=U1):
+        response = self.client.post('/api/token', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['token']
+
+    def bearer(self, token):
+        return {'Authorization': f'Bearer {token}'}
+
+    def test_issued_token_authenticates(self):
+        token = self.issue_token()
+        data = self.client.get('/api/user_info', headers=self.bearer(token)).get_json()
+        self.assertEqual(data['user']['autodesk_user'], 'u1')
+
+    def test_token_requires_valid_credentials(self):
+        response = self.client.post('/api/token', headers=dict(U1, **{'X-API-Key': 'wrong'}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_tampered_token_is_rejected(self):
+        token = self.issue_token()
+        self.assertEqual(self.client.get('/api/user_info', headers=self.bearer(token[:-2] + 'xx')).status_code, 401)
+
+    def test_token_is_stale_after_config_change(self):
+        token = self.issue_token()
+        self.set_allowed_plugins('u2_PC2', ['beta'])
+        response = self.client.get('/api/user_info', headers=self.bearer(token))
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('périmé', response.get_json()['error'])
+
+    def test_key_rotated_during_issuance_yields_stale_token(self):
+        issue = app.plugin_server.issue_session_token
+
+        def rotate_then_issue(*args):
+            # Rotation de clé entre l'authentification et la signature du jeton
+            app.plugin_server.apply_change({'op': 'user', 'company_id': 'acme', 'user_key': 'u1_PC1',
+                                            'fields': {'api_key': 'key-u1-new'}})
+            return issue(*args)
+
+        with mock.patch.object(app.plugin_server, 'issue_session_token', rotate_then_issue):
+            token = self.issue_token()
+        self.assertEqual(self.client.get('/api/user_info', headers=self.bearer(token)).status_code, 401)
+
+    def test_token_survives_journal_compaction(self):
+        self.set_allowed_plugins('u2_PC2', ['beta'])
+        token = self.issue_token()
+        generation = app.plugin_server.config_generation
+        self.assertTrue(app.plugin_server.compact_if_due(0))
+        app.plugin_server.reload_config_if_changed()
+        self.assertEqual(app.plugin_server.config_generation, generation)
+        self.assertEqual(self.client.get('/api/user_info', headers=self.bearer(token)).status_code, 200)
+        # Un worker démarré après la compaction calcule la même version
+        self.assertEqual(app.plugin_server.user_store.load(0).version, app.plugin_server.config_version)
+
+    def test_hand_edit_after_compaction_changes_version(self):
+        self.set_allowed_plugins('u2_PC2', ['beta'])
+        app.plugin_server.compact_if_due(0)
+        version = app.plugin_server.config_version
+        with open(app.plugin_server.users_file, encoding='utf-8') as f:
+            config = json.load(f)
+        config['companies']['acme']['users']['u1_PC1']['allowed_plugins'] = ['beta']
+        with open(app.plugin_server.users_file, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+        app.plugin_server.reload()
+        self.assertNotEqual(app.plugin_server.config_version, version)
+
+    def test_expired_token_is_rejected(self):
+        with mock.patch.object(app, 'SESSION_TOKEN_TTL', 0):
+            token = self.issue_token()
+        response = self.client.get('/api/user_info', headers=self.bearer(token))
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('expiré', response.get_json()['error'])
+
+    def test_token_cannot_be_refreshed_with_a_token(self):
+        token = self.issue_token()
+        self.assertEqual(self.client.post('/api/token', headers=self.bearer(token)).status_code, 401)
+        # Même accompagné des identifiants: le jeton n'est pas un moyen d'émission
+        self.assertEqual(self.client.post('/api/token', headers=dict(U1, **self.bearer(token))).status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
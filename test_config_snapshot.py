@@ -0,0 +1,122 @@
+# test_config_snapshot.py - Surcouches de ConfigSnapshot.with_company
+#
+#   python -m unittest test_config_snapshot
+#
+# Des séquences aléatoires de modifications d'administration appliquées de
+# façon incrémentale doivent donner les mêmes réponses qu'un snapshot
+# reconstruit entièrement depuis le document équivalent (to_config).
+import os
+import random
+import tempfile
+import unittest
+
+_tmp = tempfile.mkdtemp(prefix='test_config_snapshot_')
+for _name in ('PLUGINS_DIR', 'CONFIG_DIR', 'LOGS_DIR', 'PLUGIN_OBJECTS_DIR'):
+    os.environ.setdefault(_name, os.path.join(_tmp, _name.lower()))
+    os.makedirs(os.environ[_name], exist_ok=True)
+os.environ.setdefault('EXECUTIONS_DB', '')
+os.environ.setdefault('CONFIG_RELOAD_INTERVAL', '0')
+os.environ.setdefault('LOG_HANDLERS', 'file')
+
+from app import ConfigSnapshot, merge_change  # noqa: E402
+
+AUTODESK_USERS = [f'u{i}' for i in range(6)]
+COMPUTERS = [f'PC{i}' for i in range(3)]
+COMPANIES = [f'c{i}' for i in range(5)]
+
+
+def random_config(rng):
+    companies = {}
+    for company_id in rng.sample(COMPANIES, 3):
+        users = {}
+        for _ in range(rng.randint(0, 5)):
+            autodesk_user, computer = rng.choice(AUTODESK_USERS), rng.choice(COMPUTERS)
+            users[f'{autodesk_user}_{computer}'] = random_user(rng, autodesk_user, computer)
+        companies[company_id] = {'name': company_id, 'active': rng.random() < 0.8, 'users': users}
+    return {'companies': companies}
+
+
+def random_user(rng, autodesk_user, computer):
+    return {'name': 'U', 'email': 'u@example.com', 'autodesk_user': autodesk_user, 'computer_name': computer,
+            'api_key': f'k{rng.randint(0, 3)}', 'active': rng.random() < 0.8,
+            'allowed_plugins': rng.choice([[], ['a'], ['*']])}
+
+
+def random_change(rng, snapshot):
+    company_id = rng.choice(COMPANIES)
+    if rng.random() < 0.3:
+        return {'op': 'company', 'company_id': company_id,
+                'fields': {'name': company_id, 'active': rng.random() < 0.7}}
+    autodesk_user, computer = rng.choice(AUTODESK_USERS), rng.choice(COMPUTERS)
+    fields = random_user(rng, autodesk_user, computer)
+    company = snapshot.company(company_id)
+    if company is not None and rng.random() < 0.5 and company.get('users'):
+        # Modification partielle d'un utilisateur existant
+        user_key = rng.choice(sorted(company['users']))
+        fields = {'active': rng.random() < 0.6}
+        return {'op': 'user', 'company_id': company_id, 'user_key': user_key, 'fields': fields}
+    return {'op': 'user', 'company_id': company_id, 'user_key': f'{autodesk_user}_{computer}', 'fields': fields}
+
+
+class WithCompanyTest(unittest.TestCase):
+
+    def assert_equivalent(self, snapshot, context):
+        rebuilt = ConfigSnapshot(snapshot.to_config(), generation=0)
+        for autodesk_user in AUTODESK_USERS:
+            for computer in COMPUTERS:
+                user_key = f'{autodesk_user}_{computer}'
+                incremental, full = snapshot.lookup_user(user_key), rebuilt.lookup_user(user_key)
+                self.assertEqual((incremental.company_id, incremental.data) if incremental else None,
+                                 (full.company_id, full.data) if full else None, f'{context} {user_key}')
+            self.assertEqual(snapshot.company_for_autodesk_user(autodesk_user),
+                             rebuilt.company_for_autodesk_user(autodesk_user), f'{context} {autodesk_user}')
+        self.assertEqual(snapshot.global_stats, rebuilt.global_stats, context)
+        for company_id in COMPANIES:
+            self.assertEqual(snapshot.company_stats(company_id), rebuilt.company_stats(company_id), context)
+
+    def test_random_sequences_match_full_rebuild(self):
+        for seed in range(1000):
+            rng = random.Random(seed)
+            snapshot = ConfigSnapshot(random_config(rng), generation=1)
+            for step in range(rng.randint(1, 12)):
+                change = random_change(rng, snapshot)
+                try:
+                    data = merge_change(snapshot.company(change['company_id']), change)
+                except ValueError:
+                    continue
+                snapshot = snapshot.with_company(change['company_id'], data, version='', journal_seq=step)
+                self.assert_equivalent(snapshot, f'seed {seed} étape {step}')
+
+
+class MergeChangeTest(unittest.TestCase):
+
+    def test_company_name_must_be_a_string(self):
+        for name in (1, '', None, ['x']):
+            with self.assertRaises(ValueError):
+                merge_change(None, {'op': 'company', 'company_id': 'c', 'fields': {'name': name}})
+
+    def test_user_identity_fields_must_be_strings(self):
+        company = {'name': 'C', 'active': True, 'users': {}}
+        fields = {'name': 'U', 'email': 'u@example.com', 'autodesk_user': 'u', 'computer_name': 'PC'}
+        merge_change(company, {'op': 'user', 'company_id': 'c', 'user_key': 'u_PC', 'fields': fields})
+        for field in fields:
+            with self.assertRaises(ValueError):
+                merge_change(company, {'op': 'user', 'company_id': 'c', 'user_key': 'u_PC',
+                                       'fields': dict(fields, **{field: 7})})
+
+    def test_user_identity_is_immutable(self):
+        company = merge_change({'name': 'C', 'active': True, 'users': {}}, {
+            'op': 'user', 'company_id': 'c', 'user_key': 'u_PC',
+            'fields': {'name': 'U', 'email': 'u@example.com', 'autodesk_user': 'u', 'computer_name': 'PC'}})
+        for field, value in (('autodesk_user', 'zzz'), ('computer_name', 'PC2')):
+            with self.assertRaises(ValueError):
+                merge_change(company, {'op': 'user', 'company_id': 'c', 'user_key': 'u_PC',
+                                       'fields': {field: value}})
+        # Valeurs inchangées (PUT complet): acceptées
+        merged = merge_change(company, {'op': 'user', 'company_id': 'c', 'user_key': 'u_PC',
+                                        'fields': {'autodesk_user': 'u', 'computer_name': 'PC', 'active': False}})
+        self.assertFalse(merged['users']['u_PC']['active'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,8 @@
+# wsgi.py - Point d'entrée production (gunicorn -c gunicorn_config.py wsgi:application)
+from app import app, plugin_server
+
+# Préchauffage à l'import: avec preload_app, fait une seule fois dans le
+# processus maître puis partagé en copy-on-write par les workers
+plugin_server.warm_up()
+
+application = app